@@ -0,0 +1,299 @@
+"""
+Admission Control
+配置計算の事前見積もりによる受け付け判定（予算超過時の縮退・拒否）と、期限付きの実行
+"""
+
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from incremental_layout import LayoutSession
+from panel_layout import PanelLayout
+from worker_pool import get_process_pool
+
+# 1リクエストで判定してよい候補セル数の上限（超えると縮退、縮退しても超えれば拒否）
+LAYOUT_CELL_BUDGET = int(os.environ.get('LAYOUT_CELL_BUDGET', 4000000))
+
+# 配置計算の打ち切りまでの秒数（超えると計算済みの範囲の結果を返す）
+LAYOUT_DEADLINE_SECONDS = float(os.environ.get('LAYOUT_DEADLINE_SECONDS', 10))
+
+# これ以上の候補セル数の計算はリクエストのスレッドではなくプロセスプールで実行する
+LAYOUT_OFFLOAD_CELLS = int(os.environ.get('LAYOUT_OFFLOAD_CELLS', 200000))
+
+# 配置計算用プロセスプールのワーカー数と、ワーカーの空きを待てる件数
+LAYOUT_WORKERS = int(os.environ.get('LAYOUT_WORKERS', 2))
+LAYOUT_MAX_QUEUED = int(os.environ.get('LAYOUT_MAX_QUEUED', 8))
+
+# 予算超過時の扱い
+OVER_BUDGET_POLICIES = ('downgrade', 'reject')
+
+# 予算を超えたときに順に試す縮退先 (mode, phase_steps)。要求より軽いものだけを使う
+DOWNGRADE_STEPS = (('search', 2), ('grid', 1))
+
+# deadline を過ぎてもワーカーの結果を待つ猶予（秒）。ワーカーは deadline で自ら打ち切る
+RESULT_GRACE_SECONDS = 5
+
+
+class LayoutRejected(Exception):
+    """見積もりが予算を超えている（縮退しても収まらない）"""
+
+    def __init__(self, estimated_cells: int, budget: int):
+        super().__init__(f"Layout too large: about {estimated_cells} candidate cells "
+                         f"(budget {budget}). Use a smaller roof, larger panels or layout_mode 'grid'.")
+        self.estimated_cells = estimated_cells
+        self.budget = budget
+
+    def __reduce__(self):
+        # プロセスプールのワーカーから送出されても復元できるようにする
+        return LayoutRejected, (self.estimated_cells, self.budget)
+
+
+class LayoutBusy(Exception):
+    """配置計算用のワーカーと待ち行列が埋まっている"""
+
+
+class Admission(NamedTuple):
+    """受け付け判定の結果（実際に使う配置モードと見積もり）"""
+    mode: str
+    phase_steps: int
+    estimated_cells: int
+    requested_mode: str
+    requested_phase_steps: int
+
+    @property
+    def downgraded(self) -> bool:
+        return (self.mode, self.phase_steps) != (self.requested_mode, self.requested_phase_steps)
+
+    def status(self, complete: bool) -> Dict:
+        """レスポンスの layout_status"""
+        return {
+            "complete": complete,
+            "mode": self.mode,
+            "phase_steps": self.phase_steps,
+            "requested_mode": self.requested_mode,
+            "downgraded": self.downgraded,
+            "estimated_cells": self.estimated_cells,
+            "budget": LAYOUT_CELL_BUDGET
+        }
+
+
+def admit(layout: PanelLayout, polygon_coords: List[List[float]], mode: str, phase_steps: int,
+          policy: str = 'downgrade', budget: int = None) -> Admission:
+    """
+    候補セル数を見積もり、予算内に収まる配置モードを決める
+
+    予算を超える場合、policy が 'downgrade' なら DOWNGRADE_STEPS の軽いモードを順に試す。
+
+    Args:
+        layout: 配置に使う PanelLayout
+        polygon_coords: 屋根の多角形 [[lat, lng], ...]
+        mode, phase_steps: 要求された配置モードと位相の分割数
+        policy: 'downgrade' または 'reject'
+        budget: 候補セル数の上限（省略時は LAYOUT_CELL_BUDGET）
+
+    Returns:
+        Admission
+
+    Raises:
+        LayoutRejected: 予算に収まるモードが無い場合
+    """
+    budget = LAYOUT_CELL_BUDGET if budget is None else budget
+    requested = estimate = layout.estimate_cells(polygon_coords, mode, phase_steps)
+    if estimate <= budget:
+        return Admission(mode, phase_steps, estimate, mode, phase_steps)
+
+    if policy == 'downgrade' and mode != 'strips':
+        for fallback_mode, fallback_steps in DOWNGRADE_STEPS:
+            if (fallback_mode, fallback_steps) == (mode, phase_steps):
+                continue
+            estimate = layout.estimate_cells(polygon_coords, fallback_mode, fallback_steps)
+            if estimate < requested and estimate <= budget:
+                return Admission(fallback_mode, fallback_steps, estimate, mode, phase_steps)
+    raise LayoutRejected(requested, budget)
+
+
+def layout_until(layout: PanelLayout, polygon_coords: List[List[float]], mode: str, phase_steps: int,
+                 deadline: float, allow_parallel: bool = False) -> Tuple[Dict[str, np.ndarray], bool]:
+    """
+    deadline（time.time()）までに配置を計算（プロセスプールのワーカーでも実行）
+
+    ワーカー内でさらにプロセスプールを起動しないよう、allow_parallel でなければ並列評価は無効にする。
+
+    Returns:
+        (配置配列, 最後まで計算できたか)
+    """
+    if not allow_parallel:
+        layout.parallel_min_cells = math.inf
+    layout.deadline = deadline
+    layout_arrays = layout.calculate_layout_arrays(polygon_coords, mode=mode, phase_steps=phase_steps)
+    return layout_arrays, not layout.timed_out
+
+
+class LayoutRunner:
+    def __init__(self, max_workers: int = 2, max_queued: int = 8,
+                 offload_cells: int = 200000, deadline_seconds: float = 10):
+        """
+        受け付けた配置計算を期限付きで実行する
+
+        見積もりが offload_cells 以上の計算は専用のプロセスプール（max_workers 個）で実行し、リクエストの
+        スレッドは結果を待つだけにする（GIL を手放すので /health や軽いエンドポイントが止まらない）。
+        大きい配置が1つだけのリクエストは候補の評価をこのプールで並列に行う。
+        実行中と待機中の合計が max_workers + max_queued に達したら LayoutBusy を送出する。
+
+        Args:
+            max_workers: 配置計算用プロセスプールのワーカー数
+            max_queued: ワーカーの空きを待てる件数
+            offload_cells: プロセスプールで実行する候補セル数の下限
+            deadline_seconds: 計算を打ち切るまでの秒数
+        """
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.offload_cells = offload_cells
+        self.deadline_seconds = deadline_seconds
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def run(self, layout: PanelLayout, polygon_coords: List[List[float]], admission: Admission,
+            deadline_seconds: Optional[float] = None) -> Tuple[Dict[str, np.ndarray], bool]:
+        """
+        受け付けたモードで配置を計算
+
+        Returns:
+            (配置配列, 最後まで計算できたか)。deadline で打ち切った場合は評価済みの候補の中の
+            最良の配置（粗い結果）か、判定済みの行までの配置（部分的な結果）になる
+
+        Raises:
+            LayoutBusy: ワーカーと待ち行列が埋まっている場合
+            TimeoutError: deadline と猶予を過ぎてもワーカーの結果が返らない場合
+        """
+        return self.run_many([(layout, polygon_coords, admission)], deadline_seconds)[0]
+
+    def run_many(self, jobs: List[Tuple[PanelLayout, List[List[float]], Admission]],
+                 deadline_seconds: Optional[float] = None) -> List[Tuple[Dict[str, np.ndarray], bool]]:
+        """
+        複数の配置（屋根面など）を共通の deadline で計算
+
+        offload_cells 以上の配置はプロセスプールへ投入し、小さい配置はその間にリクエストの
+        スレッドで計算する。1リクエストが使う実行枠は配置の数によらず1つ。
+
+        Args:
+            jobs: (PanelLayout, 屋根の多角形, Admission) のリスト
+
+        Returns:
+            jobs と同じ順の (配置配列, 最後まで計算できたか)
+
+        Raises:
+            LayoutBusy: ワーカーと待ち行列が埋まっている場合
+            TimeoutError: deadline と猶予を過ぎてもワーカーの結果が返らない場合
+        """
+        deadline = time.time() + (self.deadline_seconds if deadline_seconds is None else deadline_seconds)
+        offloaded = [i for i, (_, _, admission) in enumerate(jobs)
+                     if admission.estimated_cells >= self.offload_cells]
+        if not offloaded:
+            return [layout_until(layout, polygon_coords, admission.mode, admission.phase_steps, deadline)
+                    for layout, polygon_coords, admission in jobs]
+
+        # 大きい配置が1つだけなら、その候補の評価をプロセスプールで並列に行う（リクエストのスレッドは
+        # 屋根の準備と結果の集約だけ）。複数なら配置ごとにプロセスプールへ投入する
+        parallel = offloaded[0] if len(offloaded) == 1 and jobs[offloaded[0]][2].mode != 'strips' else None
+
+        with self._slot():
+            pool = get_process_pool('layout_requests', self.max_workers)
+            futures = {
+                i: pool.submit(layout_until, jobs[i][0], jobs[i][1], jobs[i][2].mode, jobs[i][2].phase_steps,
+                               deadline)
+                for i in offloaded if i != parallel
+            }
+            results = {}
+            try:
+                for i, (layout, polygon_coords, admission) in enumerate(jobs):
+                    if i == parallel:
+                        layout.parallel_pool = 'layout_requests'
+                        layout.parallel_min_cells = 0
+                        results[i] = layout_until(layout, polygon_coords, admission.mode,
+                                                  admission.phase_steps, deadline, allow_parallel=True)
+                    elif i not in futures:
+                        results[i] = layout_until(layout, polygon_coords, admission.mode,
+                                                  admission.phase_steps, deadline)
+                # 待ち行列にいる間も deadline は進む（ワーカーが開始時点で期限切れなら最初の候補だけ計算する）
+                for i, future in futures.items():
+                    results[i] = future.result(timeout=max(0.0, deadline - time.time()) + RESULT_GRACE_SECONDS)
+            except TimeoutError:
+                raise TimeoutError("Layout did not finish before the deadline")
+            finally:
+                for future in futures.values():
+                    future.cancel()
+            return [results[i] for i in range(len(jobs))]
+
+    def create_session(self, layout: PanelLayout, polygon_coords: List[List[float]], admission: Admission,
+                       deadline_seconds: Optional[float] = None) -> Tuple[LayoutSession, bool]:
+        """
+        インクリメンタル編集用のセッションを期限付きで作成
+
+        向きと位相の選択は deadline で打ち切り、評価済みの候補の中の最良のグリッドに固定する。
+        固定したグリッドのセル判定は編集の基準になるため最後まで行う。
+        offload_cells 以上の見積もりは実行枠を1つ使い、候補の評価を配置計算用のプロセスプールで並列に行う。
+
+        Returns:
+            (セッション, 候補の選択を最後まで行えたか)
+
+        Raises:
+            LayoutBusy: ワーカーと待ち行列が埋まっている場合
+        """
+        deadline = time.time() + (self.deadline_seconds if deadline_seconds is None else deadline_seconds)
+        layout.deadline = deadline
+        layout.timed_out = False
+        try:
+            if admission.estimated_cells < self.offload_cells:
+                layout.parallel_min_cells = math.inf
+                session = LayoutSession.create(layout, polygon_coords, mode=admission.mode,
+                                               phase_steps=admission.phase_steps)
+            else:
+                with self._slot():
+                    get_process_pool('layout_requests', self.max_workers)
+                    layout.parallel_pool = 'layout_requests'
+                    layout.parallel_min_cells = 0
+                    session = LayoutSession.create(layout, polygon_coords, mode=admission.mode,
+                                                   phase_steps=admission.phase_steps)
+            return session, not layout.timed_out
+        finally:
+            # セッションが保持する layout で以降の編集が打ち切られないよう期限を外す
+            layout.deadline = None
+
+    @contextmanager
+    def _slot(self):
+        """実行枠を1つ確保する（空きが無ければ LayoutBusy）"""
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queued:
+                raise LayoutBusy("Too many large layouts in progress. Retry later.")
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'in_flight': self._in_flight,
+                'max_workers': self.max_workers,
+                'max_queued': self.max_queued,
+                'offload_cells': self.offload_cells,
+                'deadline_seconds': self.deadline_seconds,
+                'cell_budget': LAYOUT_CELL_BUDGET
+            }
+
+
+# プロセス全体で共有するインスタンス
+layout_runner = LayoutRunner(
+    max_workers=LAYOUT_WORKERS,
+    max_queued=LAYOUT_MAX_QUEUED,
+    offload_cells=LAYOUT_OFFLOAD_CELLS,
+    deadline_seconds=LAYOUT_DEADLINE_SECONDS
+)
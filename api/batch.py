@@ -0,0 +1,221 @@
+"""
+Batch Layout
+複数の屋根をまとめて配置計算し、結果を1件ずつ NDJSON で返す
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+from admission import admit, layout_until, LayoutBusy, LAYOUT_DEADLINE_SECONDS
+from panel_layout import PanelLayout, LAYOUT_MODES, parse_keepouts
+from layout_format import encode_columnar
+from solar_calc import SolarCalculator, IRRADIANCE_MODELS
+from worker_pool import get_process_pool
+
+# 1回のバッチで受け付ける屋根の最大数
+MAX_BATCH_ROOFS = 500
+
+# バッチ専用プロセスプールのワーカー数と、同時に実行できるバッチの数
+# （対話的な /api/calculate-panels の配置計算とはプールを分ける）
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 2))
+BATCH_MAX_CONCURRENT = int(os.environ.get('BATCH_MAX_CONCURRENT', 2))
+
+# 1つのバッチがプールに投入しておく屋根の数（ワーカー数の倍数）
+BATCH_SUBMIT_AHEAD = 2
+
+# 屋根ごとに上書きできる項目と既定値
+ROOF_DEFAULTS = {
+    'panel_width': 165,
+    'panel_height': 100,
+    'offset': 10,
+    'layout_mode': 'grid',
+    'phase_steps': 4,
+    'keepouts': [],
+    'location': {'lat': 35.6762, 'lng': 139.6503},
+}
+
+
+def resolve_roofs(data: Dict) -> List[Dict]:
+    """
+    リクエストボディから屋根ごとの設定を組み立てる
+
+    トップレベルの panel_width などを共通設定とし、各屋根の同名項目で上書きする。
+
+    Args:
+        data: {"roofs": [{"polygon": [[lat, lng], ...], ...}, ...], 共通設定...}
+
+    Returns:
+        屋根ごとの設定のリスト
+
+    Raises:
+        ValueError: 入力が不正な場合
+    """
+    roofs = data.get('roofs')
+    if not isinstance(roofs, list) or not roofs:
+        raise ValueError("roofs must be a non-empty array")
+    if len(roofs) > MAX_BATCH_ROOFS:
+        raise ValueError(f"Too many roofs. At most {MAX_BATCH_ROOFS} per batch.")
+
+    shared = {key: data.get(key, default) for key, default in ROOF_DEFAULTS.items()}
+    resolved = []
+    for index, roof in enumerate(roofs):
+        if not isinstance(roof, dict):
+            raise ValueError(f"roofs[{index}] must be an object")
+        spec = {key: roof.get(key, value) for key, value in shared.items()}
+        spec['id'] = roof.get('id', index)
+        spec['polygon'] = roof.get('polygon', [])
+
+        if not spec['polygon'] or len(spec['polygon']) < 3:
+            raise ValueError(f"roofs[{index}]: Invalid polygon. At least 3 points required.")
+        if spec['layout_mode'] not in LAYOUT_MODES:
+            raise ValueError(f"roofs[{index}]: Invalid layout_mode. Use one of: {', '.join(LAYOUT_MODES)}")
+        try:
+            spec['keepouts'] = parse_keepouts(spec['keepouts'] or [])
+        except ValueError as e:
+            raise ValueError(f"roofs[{index}]: {e}")
+        resolved.append(spec)
+    return resolved
+
+
+def layout_roof(spec: Dict, include_panels: bool = False) -> Dict:
+    """
+    1つの屋根の配置を計算（プロセスプールのワーカーで実行）
+
+    ワーカー内でさらにプロセスプールを起動しないよう、並列評価は無効にする。
+    見積もりが予算を超える屋根は軽いモードに縮退し（収まらなければ LayoutRejected）、
+    ワーカーで計算を始めてから LAYOUT_DEADLINE_SECONDS で打ち切る。
+    """
+    layout = PanelLayout(spec['panel_width'], spec['panel_height'], spec['offset'], spec['keepouts'])
+    admission = admit(layout, spec['polygon'], spec['layout_mode'], spec['phase_steps'])
+    layout_arrays, complete = layout_until(layout, spec['polygon'], admission.mode, admission.phase_steps,
+                                           time.time() + LAYOUT_DEADLINE_SECONDS)
+    panel_count = len(layout_arrays['orientation'])
+
+    result = {
+        "panel_count": panel_count,
+        "total_area": panel_count * (spec['panel_width'] * spec['panel_height'] / 10000),
+        "layout_bounds": layout.get_bounds(spec['polygon']),
+        "layout_status": admission.status(complete)
+    }
+    if include_panels:
+        result["panels"] = encode_columnar(layout_arrays, layout.orientation_sizes_cm())
+    return result
+
+
+def iter_batch_results(roofs: List[Dict], irradiance_model: str = 'table', tilt=None, azimuth=None,
+                       include_panels: bool = False) -> Iterator[str]:
+    """
+    配置計算をバッチ専用のプロセスプールに投入し、完了した屋根から順に NDJSON の行を返す
+
+    'table' モデルの月別日射量は全地点分を配列演算で一度に求めておき、
+    配置が終わった屋根にパネル枚数を掛けるだけで発電量を出す。
+    最後に件数をまとめた summary 行を返す。
+
+    Args:
+        roofs: resolve_roofs で組み立てた屋根ごとの設定
+        irradiance_model: 'table' または 'hourly'
+        tilt, azimuth: 'hourly' 時の設置角度・方位
+        include_panels: True なら列指向形式のパネル配置も含める
+
+    Yields:
+        改行で終わる JSON 文字列
+    """
+    if irradiance_model not in IRRADIANCE_MODELS:
+        raise ValueError(f"Invalid irradiance_model. Use one of: {', '.join(IRRADIANCE_MODELS)}")
+
+    solar_calc = SolarCalculator()
+    lats = np.array([spec['location'].get('lat', 35.6762) for spec in roofs], dtype=float)
+    lngs = np.array([spec['location'].get('lng', 139.6503) for spec in roofs], dtype=float)
+    profiles = solar_calc.monthly_profiles(lats, lngs) if irradiance_model == 'table' else None
+
+    # プールに投入しておくのは BATCH_WORKERS * BATCH_SUBMIT_AHEAD 件まで（残りは完了に合わせて投入）
+    pool = get_process_pool('batch', BATCH_WORKERS)
+    pending_roofs = iter(enumerate(roofs))
+    futures = {}
+
+    def submit_ahead():
+        for index, spec in pending_roofs:
+            futures[pool.submit(layout_roof, spec, include_panels)] = index
+            if len(futures) >= BATCH_WORKERS * BATCH_SUBMIT_AHEAD:
+                return
+
+    succeeded = 0
+    try:
+        submit_ahead()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures.pop(future)
+                spec = roofs[index]
+                line = {"index": index, "id": spec['id']}
+                try:
+                    result = future.result()
+                    lat, lng = float(lats[index]), float(lngs[index])
+                    panel_area = spec['panel_width'] * spec['panel_height'] / 10000
+                    if profiles is not None:
+                        power_data = solar_calc.power_from_profile(lat, lng, result['panel_count'],
+                                                                   panel_area, profiles[index])
+                    else:
+                        power_data = solar_calc.calculate_power(lat, lng, result['panel_count'], panel_area,
+                                                                model=irradiance_model, tilt=tilt, azimuth=azimuth)
+                    line.update(result)
+                    line["power_estimation"] = power_data
+                    succeeded += 1
+                except Exception as e:
+                    line["error"] = str(e)
+                yield json.dumps(line, ensure_ascii=False) + '\n'
+            submit_ahead()
+    finally:
+        # クライアント切断時は未着手の配置計算を取り消す
+        for future in futures:
+            future.cancel()
+
+    yield json.dumps({"summary": {"total": len(roofs), "succeeded": succeeded,
+                                  "failed": len(roofs) - succeeded}}) + '\n'
+
+
+class BatchSlots:
+    def __init__(self, max_batches: int = 2):
+        """
+        同時に実行するバッチの数を制限する
+
+        Args:
+            max_batches: 同時に実行できるバッチの数
+        """
+        self.max_batches = max_batches
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        バッチの実行枠を確保（終了時に release を呼ぶ）
+
+        Raises:
+            LayoutBusy: 実行中のバッチが上限に達している場合
+        """
+        with self._lock:
+            if self._active >= self.max_batches:
+                raise LayoutBusy("Too many batches in progress. Retry later.")
+            self._active += 1
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'active': self._active,
+                'max_batches': self.max_batches,
+                'workers': BATCH_WORKERS
+            }
+
+
+# プロセス全体で共有するインスタンス
+batch_slots = BatchSlots(max_batches=BATCH_MAX_CONCURRENT)
@@ -0,0 +1,186 @@
+"""
+Panel Layout Benchmark
+旧来のセル単位ループと配列化したグリッド配置の速度比較・出力の差の確認
+
+Usage:
+    cd api && python -m benchmarks.bench_layout
+"""
+
+import math
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+from shapely.geometry import Polygon, box
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from panel_layout import PanelLayout  # noqa: E402
+from projection import LocalProjection  # noqa: E402
+
+# 屋根の基準点（東京）
+REF_LAT = 35.6762
+REF_LNG = 139.6503
+
+PANEL_WIDTH = 165
+PANEL_HEIGHT = 100
+OFFSET = 10
+
+
+class LegacyPanelLayout(PanelLayout):
+    """比較用: 1セルずつ box() を作り contains() で判定する旧実装"""
+
+    def calculate_layout(self, polygon_coords: List[List[float]]) -> List[Dict]:
+        roof_polygon = Polygon(self._legacy_to_meters(polygon_coords))
+        roof_polygon = roof_polygon.buffer(-self.offset / 100)
+        if not roof_polygon.is_valid or roof_polygon.is_empty:
+            return []
+
+        panel_w_m = self.panel_width / 100
+        panel_h_m = self.panel_height / 100
+        panels = []
+        minx, miny, maxx, maxy = roof_polygon.bounds
+        panel_id = 0
+
+        for orientation in ['landscape', 'portrait']:
+            if orientation == 'landscape':
+                w, h = panel_w_m, panel_h_m
+            else:
+                w, h = panel_h_m, panel_w_m
+            spacing = 0.05
+
+            y = miny
+            while y + h <= maxy:
+                x = minx
+                while x + w <= maxx:
+                    panel_rect = box(x, y, x + w, y + h)
+                    if roof_polygon.contains(panel_rect):
+                        center = self._legacy_to_latlon([[x + w/2, y + h/2]], polygon_coords[0])[0]
+                        corners = self._legacy_to_latlon(
+                            [[x, y], [x + w, y], [x + w, y + h], [x, y + h]], polygon_coords[0])
+                        panels.append({
+                            'id': panel_id,
+                            'center': center,
+                            'corners': corners,
+                            'orientation': orientation,
+                            'width_cm': self.panel_width if orientation == 'landscape' else self.panel_height,
+                            'height_cm': self.panel_height if orientation == 'landscape' else self.panel_width
+                        })
+                        panel_id += 1
+                    x += w + spacing
+                y += h + spacing
+
+        return panels
+
+    @staticmethod
+    def _legacy_to_meters(coords):
+        ref_lat, ref_lon = coords[0]
+        meters = []
+        for lat, lon in coords:
+            x = (lon - ref_lon) * 111320 * math.cos(math.radians(ref_lat))
+            y = (lat - ref_lat) * 110540
+            meters.append((x, y))
+        return meters
+
+    @staticmethod
+    def _legacy_to_latlon(meter_coords, ref_point):
+        ref_lat, ref_lon = ref_point
+        latlon = []
+        for x, y in meter_coords:
+            lon = ref_lon + x / (111320 * math.cos(math.radians(ref_lat)))
+            lat = ref_lat + y / 110540
+            latlon.append([lat, lon])
+        return latlon
+
+
+def vectorized_all_orientations(layout: PanelLayout, polygon_coords: List[List[float]]) -> List[Dict]:
+    """旧実装と同じく横置き・縦置きの両パスを連結した結果を新エンジン（ローカル投影を含む）で作成"""
+    projection = layout._make_projection(polygon_coords)
+    roof_polygon = layout._prepare_roof(polygon_coords, projection)
+    pivot = layout._rotation_pivot(roof_polygon)
+    rows = [
+        (candidate, layout._grid_origins(roof_polygon, candidate), pivot)
+        for candidate in layout._search_candidates(1)
+    ]
+    return layout.to_panel_dicts(layout._panel_arrays(rows, projection))
+
+
+def compare_outputs(legacy: List[Dict], vectorized: List[Dict]) -> Dict:
+    """
+    旧実装の出力と新エンジンの出力を比較
+
+    向きごとの枚数と、枚数が同じ向きについて対応するパネル中心のずれの最大値 (m) を返す
+    （座標変換が変わったため緯度経度は完全には一致しない）。
+    """
+    counts = {}
+    max_shift = 0.0
+    for orientation in ('landscape', 'portrait'):
+        old = [p['center'] for p in legacy if p['orientation'] == orientation]
+        new = [p['center'] for p in vectorized if p['orientation'] == orientation]
+        counts[orientation] = (len(old), len(new))
+        if old and len(old) == len(new):
+            projection = LocalProjection(*old[0])
+            shift = np.hypot(*(projection.to_local(old) - projection.to_local(new)).T).max()
+            max_shift = max(max_shift, float(shift))
+    return {'counts': counts, 'max_shift_m': max_shift,
+            'same_counts': all(old == new for old, new in counts.values())}
+
+
+def legacy_roof(meters: List[Tuple[float, float]]) -> List[List[float]]:
+    """旧来の簡易変換（REF 基準の正距円筒近似）でメートル座標を緯度経度にした屋根"""
+    return LegacyPanelLayout._legacy_to_latlon(meters, [REF_LAT, REF_LNG])
+
+
+def make_roof(area_m2: float) -> List[List[float]]:
+    """指定面積の L 字型屋根（緯度経度）を作成"""
+    # 一辺 a の正方形から (a/2)² を欠いた L 字: 面積 = 3a²/4
+    a = math.sqrt(area_m2 * 4 / 3)
+    return legacy_roof([(0, 0), (a, 0), (a, a / 2), (a / 2, a / 2), (a / 2, a), (0, a)])
+
+
+def time_call(func, repeat: int) -> float:
+    """最良実行時間（ms）を返す"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    roofs = [(f'L {area} m2', make_roof(area)) for area in (100, 1000, 10000)]
+    roofs.append(('rect 20x12 m', legacy_roof([(0, 0), (20, 0), (20, 12), (0, 12)])))
+
+    print(f"{'roof':>14} {'legacy':>8} {'vector':>8} {'legacy ms':>10} {'vector ms':>10} {'speedup':>8} "
+          f"{'shift cm':>9}  same counts")
+    for name, polygon in roofs:
+        legacy = LegacyPanelLayout(PANEL_WIDTH, PANEL_HEIGHT, OFFSET)
+        vectorized = PanelLayout(PANEL_WIDTH, PANEL_HEIGHT, OFFSET)
+
+        legacy_panels = legacy.calculate_layout(polygon)
+        vector_panels = vectorized_all_orientations(vectorized, polygon)
+        diff = compare_outputs(legacy_panels, vector_panels)
+        repeat = 2 if len(legacy_panels) > 5000 else 5
+        legacy_ms = time_call(lambda: legacy.calculate_layout(polygon), repeat)
+        vector_ms = time_call(lambda: vectorized_all_orientations(vectorized, polygon), repeat)
+
+        print(f"{name:>14} {len(legacy_panels):>8} {len(vector_panels):>8} {legacy_ms:>10.1f} {vector_ms:>10.1f} "
+              f"{legacy_ms / vector_ms:>7.1f}x {diff['max_shift_m'] * 100:>9.2f}  {diff['same_counts']} "
+              f"{diff['counts']}")
+
+    print()
+    print(f"{'roof m2':>10} {'mode':>8} {'panels':>8} {'ms':>10}")
+    for area in (100, 1000, 10000):
+        polygon = make_roof(area)
+        layout = PanelLayout(PANEL_WIDTH, PANEL_HEIGHT, OFFSET)
+        for mode in ('grid', 'search', 'rotated', 'strips'):
+            count = len(layout.calculate_layout(polygon, mode=mode))
+            elapsed = time_call(lambda: layout.calculate_layout(polygon, mode=mode), 3)
+            print(f"{area:>10} {mode:>8} {count:>8} {elapsed:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
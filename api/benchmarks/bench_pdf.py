@@ -0,0 +1,146 @@
+"""
+PDF Benchmark
+地図画像の大きさごとの PDF 生成時間とピークメモリ（RSS）の比較
+
+Usage:
+    cd api && python -m benchmarks.bench_pdf
+
+ピーク RSS はプロセス単位でしか取れないため、1ケースごとに子プロセスで計測する。
+画像の作成で子プロセスのピークが上がらないよう、画像は親プロセスで作ってファイル経由で渡す。
+"""
+
+import base64
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+from reportlab.lib.utils import ImageReader
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pdf_generator import PDFGenerator, MAP_FRAME  # noqa: E402
+
+IMAGE_SIZES_MB = (1, 5, 10)
+IMAGE_FORMATS = ('PNG', 'JPEG')
+
+POWER_DATA = {
+    'yearly_total_kwh': 5400.0,
+    'monthly_data': [{'month': m, 'generation_kwh': 300.0 + 40 * m} for m in range(1, 13)],
+    'panel_info': {'count': 24, 'total_area_m2': 39.6, 'total_rated_power_kw': 7.92},
+    'assumptions': {'panel_efficiency': 0.2, 'system_efficiency': 0.85}
+}
+
+
+class LegacyPDFGenerator(PDFGenerator):
+    """比較用: 画像を元の解像度のまま PNG に再エンコードし、BytesIO に出力する旧実装"""
+
+    def generate(self, *args, **kwargs):
+        return super().generate(*args, output=BytesIO(), **kwargs)
+
+    def _draw_map_image(self, pdf, map_image_base64):
+        x, y, width, height = MAP_FRAME
+        image_data = base64.b64decode(map_image_base64.split(',')[1] if ',' in map_image_base64 else map_image_base64)
+        image = Image.open(BytesIO(image_data))
+
+        temp_image = BytesIO()
+        image.save(temp_image, format='PNG')
+        temp_image.seek(0)
+
+        pdf.drawImage(ImageReader(temp_image), x, y, width=width, height=height, preserveAspectRatio=True)
+
+
+def make_map_image(size_mb: int, image_format: str) -> str:
+    """
+    おおよそ size_mb MB になる地図画像の data URL を作成
+
+    航空写真に近い圧縮率になるよう、なめらかな模様にノイズを重ねる。
+    """
+    bytes_per_pixel = 2.7 if image_format == 'PNG' else 0.6
+    side = int((size_mb * 1024 * 1024 / bytes_per_pixel) ** 0.5)
+    rng = np.random.default_rng(size_mb)
+    yy, xx = np.mgrid[0:side, 0:side].astype(np.float32) / side
+    base = np.stack([np.sin(xx * 17) * 60, np.cos(yy * 23) * 60, np.sin((xx + yy) * 11) * 60], axis=-1) + 128
+    pixels = np.clip(base + rng.normal(0, 24, base.shape).astype(np.float32), 0, 255).astype(np.uint8)
+
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, format=image_format, quality=92)
+    mime = 'image/png' if image_format == 'PNG' else 'image/jpeg'
+    return f"data:{mime};base64," + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def peak_rss_kb() -> int:
+    """
+    このプロセスのピーク RSS (KB)
+
+    ru_maxrss は親プロセスの値を exec 後も引き継ぐため、Linux では /proc の VmHWM を優先する。
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_case(implementation: str, image_path: str) -> dict:
+    """1ケースを計測（子プロセスで実行）"""
+    map_image = Path(image_path).read_text()
+    generator = LegacyPDFGenerator() if implementation == 'legacy' else PDFGenerator()
+    baseline_kb = peak_rss_kb()
+
+    start = time.perf_counter()
+    output = generator.generate(
+        polygon=[], panels=[], power_data=POWER_DATA, map_image_base64=map_image,
+        location={'lat': 35.6762, 'lng': 139.6503, 'address': 'Tokyo'},
+        panel_specs={'width': 165, 'height': 100, 'offset': 10}
+    )
+    pdf_size = len(output.read())
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    peak_kb = peak_rss_kb()
+    return {
+        'ms': round(elapsed_ms, 1),
+        'peak_rss_delta_mb': round((peak_kb - baseline_kb) / 1024, 1),
+        'pdf_kb': round(pdf_size / 1024, 1)
+    }
+
+
+def measure(implementation: str, image_path: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_pdf', '--case', implementation, image_path],
+        cwd=Path(__file__).resolve().parent.parent, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout)
+
+
+def main():
+    print(f"{'format':>6} {'input MB':>9} {'impl':>7} {'ms':>8} {'peak RSS +MB':>13} {'PDF KB':>8}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for image_format in IMAGE_FORMATS:
+            for size_mb in IMAGE_SIZES_MB:
+                map_image = make_map_image(size_mb, image_format)
+                input_mb = round(len(map_image) * 3 / 4 / 1024 / 1024, 1)
+                image_path = Path(work_dir) / f'map_{size_mb}.{image_format.lower()}.txt'
+                image_path.write_text(map_image)
+                del map_image
+
+                for implementation in ('legacy', 'current'):
+                    r = measure(implementation, str(image_path))
+                    print(f"{image_format:>6} {input_mb:>9} {implementation:>7} {r['ms']:>8} "
+                          f"{r['peak_rss_delta_mb']:>13} {r['pdf_kb']:>8}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--case':
+        print(json.dumps(run_case(sys.argv[2], sys.argv[3])))
+    else:
+        main()
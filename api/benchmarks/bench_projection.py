@@ -0,0 +1,67 @@
+"""
+Projection Benchmark
+LocalProjection の変換速度と往復誤差の確認（誤差の上限は tests/test_projection.py で検証する）
+
+Usage:
+    cd api && python -m benchmarks.bench_projection
+"""
+
+import math
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from projection import LocalProjection  # noqa: E402
+
+REF_LAT = 35.6762
+REF_LNG = 139.6503
+
+
+def legacy_meters_to_latlon(meter_coords, ref_point):
+    """比較用: 1点ずつ変換する旧実装"""
+    ref_lat, ref_lon = ref_point
+    latlon = []
+    for x, y in meter_coords:
+        lon = ref_lon + x / (111320 * math.cos(math.radians(ref_lat)))
+        lat = ref_lat + y / 110540
+        latlon.append([lat, lon])
+    return latlon
+
+
+def main():
+    projection = LocalProjection(REF_LAT, REF_LNG)
+    rng = np.random.default_rng(0)
+
+    # 10,000 枚分のパネル4隅（屋根 200 m 四方）
+    corners = rng.uniform(-100, 100, size=(10000, 4, 2))
+
+    start = time.perf_counter()
+    projection.to_latlng(corners)
+    vector_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    for panel in corners:
+        legacy_meters_to_latlon(panel.tolist(), [REF_LAT, REF_LNG])
+    legacy_ms = (time.perf_counter() - start) * 1000
+
+    print(f"10k panels x 4 corners: legacy {legacy_ms:.1f} ms, vectorized {vector_ms:.1f} ms")
+
+    # 往復誤差（原点から約 10 km の範囲）
+    points = np.column_stack([
+        REF_LAT + rng.uniform(-0.09, 0.09, 100000),
+        REF_LNG + rng.uniform(-0.11, 0.11, 100000),
+    ])
+    latlng_error = np.abs(projection.to_latlng(projection.to_local(points)) - points).max()
+    xy = projection.to_local(points)
+    meter_error = np.abs(projection.to_local(projection.to_latlng(xy)) - xy).max()
+
+    print(f"round trip latlng->m->latlng: {latlng_error:.2e} deg")
+    print(f"round trip m->latlng->m:      {meter_error:.2e} m")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Startup Benchmark
+コールドスタートの計測: main の import 時間と、gunicorn 起動から最初の応答までの時間
+
+Usage:
+    cd api && python -m benchmarks.bench_startup [--repeat 3] [--output startup.json]
+                                                 [--compare baseline.json]
+
+起動設定（preload・ウォームアップの有無）ごとに gunicorn を gunicorn.conf.py で起動し、
+/health が応答するまで（ready）、最初の配置計算（first_layout）、最初の時間別発電量計算
+（first_hourly）の時間を測る。どれも新しいプロセスで毎回計測する。
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.roofs import REF_LAT, REF_LNG, roof_corpus  # noqa: E402
+from benchmarks.results import summarize_samples, save_results, load_results, compare  # noqa: E402
+
+API_DIR = Path(__file__).resolve().parent.parent
+
+# main の import 後に読み込まれていてはいけない（遅延 import の対象の）モジュール
+LAZY_MODULES = ('pandas', 'pvlib', 'reportlab', 'PIL', 'scipy')
+
+# 起動設定 → 環境変数
+VARIANTS = {
+    'plain': {'GUNICORN_PRELOAD': '0', 'STARTUP_WARMUP': '0'},
+    'preload': {'GUNICORN_PRELOAD': '1', 'STARTUP_WARMUP': '0'},
+    'preload_warmup': {'GUNICORN_PRELOAD': '1', 'STARTUP_WARMUP': '1'},
+}
+
+READY_TIMEOUT_S = 120
+
+IMPORT_SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({{'ms': elapsed * 1000, 'loaded': [m for m in {LAZY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import() -> Dict:
+    """新しいプロセスで main を import する時間と、読み込まれた遅延 import 対象のモジュール"""
+    result = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=API_DIR,
+                            capture_output=True, text=True, check=True, env=_env({}))
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _env(extra: Dict[str, str]) -> Dict[str, str]:
+    return dict(os.environ, IRRADIANCE_WARMUP='0', **extra)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _post(url: str, body: Dict) -> int:
+    request = urllib.request.Request(url, data=json.dumps(body).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=300) as response:
+        response.read()
+        return response.status
+
+
+def measure_server(variant: str) -> Dict[str, float]:
+    """gunicorn を起動し、ready・最初の配置計算・最初の時間別計算までの時間（ms）を測る"""
+    port = _free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    env = _env({**VARIANTS[variant], 'PORT': str(port)})
+    polygon = roof_corpus(['rect_house'])['rect_house']
+    location = {'lat': REF_LAT, 'lng': REF_LNG}
+
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+         'main:app'],
+        cwd=API_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError(f'gunicorn exited with {server.returncode} ({variant})')
+            if time.perf_counter() - start > READY_TIMEOUT_S:
+                raise RuntimeError(f'gunicorn did not become ready ({variant})')
+            try:
+                with urllib.request.urlopen(base_url + '/health', timeout=1) as response:
+                    if response.status == 200:
+                        break
+            except OSError:
+                time.sleep(0.02)
+        ready = time.perf_counter()
+
+        _post(base_url + '/api/calculate-panels', {'polygon': polygon, 'location': location})
+        first_layout = time.perf_counter()
+
+        _post(base_url + '/api/calculate-panels',
+              {'polygon': polygon, 'location': location, 'irradiance_model': 'hourly', 'offset': 20})
+        first_hourly = time.perf_counter()
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    return {
+        'ready': (ready - start) * 1000,
+        'first_layout': (first_layout - ready) * 1000,
+        'first_hourly': (first_hourly - first_layout) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time and time-to-first-response')
+    parser.add_argument('--repeat', type=int, default=3, help='fresh processes per measurement')
+    parser.add_argument('--variant', nargs='+', default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to compare against')
+    args = parser.parse_args()
+
+    results = {}
+    imports = [measure_import() for _ in range(args.repeat)]
+    results['import/main'] = {**summarize_samples([r['ms'] for r in imports]), 'loaded': imports[0]['loaded']}
+    print(f"import main: p50 {results['import/main']['p50_ms']:.0f} ms, "
+          f"heavy modules loaded: {', '.join(imports[0]['loaded']) or 'none'}")
+
+    print(f"\n{'variant':>16} {'ready ms':>10} {'first layout':>13} {'first hourly':>13}")
+    for variant in args.variant:
+        samples: Dict[str, List[float]] = {}
+        for _ in range(args.repeat):
+            for name, value in measure_server(variant).items():
+                samples.setdefault(name, []).append(value)
+        for name, values in samples.items():
+            results[f'{name}/{variant}'] = summarize_samples(values)
+        print(f"{variant:>16} {results[f'ready/{variant}']['p50_ms']:>10.0f} "
+              f"{results[f'first_layout/{variant}']['p50_ms']:>13.0f} "
+              f"{results[f'first_hourly/{variant}']['p50_ms']:>13.0f}")
+
+    if args.output:
+        payload = save_results(args.output, 'startup', results)
+        print(f"\nwrote {args.output} (commit {payload['environment']['commit']})")
+    if args.compare:
+        print()
+        compare({'environment': {'commit': 'current'}, 'results': results}, load_results(args.compare))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""
+Microbenchmark Suite
+合成屋根コーパスを使った calculate_layout / calculate_power / calculate_roi / PDFGenerator.generate の計測
+
+Usage:
+    cd api && python -m benchmarks.bench_suite [--filter layout/] [--output results.json]
+                                               [--compare baseline.json]
+
+ケースごとに1回の空実行（プロセスプールの起動やキャッシュの準備）のあと repeat 回計測し、
+分位点を表示する。--output で結果を JSON に保存し、別のコミットで保存した結果を
+--compare に渡すと p50 の比を表示する。
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.roofs import REF_LAT, REF_LNG, roof_corpus, keepouts  # noqa: E402
+from benchmarks.results import summarize_samples, save_results, load_results, compare  # noqa: E402
+from financial import evaluate_grid  # noqa: E402
+from irradiance_cache import IrradianceCache  # noqa: E402
+from panel_layout import PanelLayout, parse_keepouts  # noqa: E402
+from pdf_generator import PDFGenerator  # noqa: E402
+from solar_calc import SolarCalculator  # noqa: E402
+
+PANEL_WIDTH = 165
+PANEL_HEIGHT = 100
+OFFSET = 10
+PANEL_AREA_M2 = PANEL_WIDTH * PANEL_HEIGHT / 10000
+
+LAYOUT_MODES = ('grid', 'search')
+
+# 設置禁止区域ありで計測する屋根と区域の数（区域なしの同じ屋根と比べる）
+KEEPOUT_ROOFS = (('l_large', 12), ('factory', 40), ('campus_l', 40))
+PDF_ROOFS = ('rect_house', 'l_large', 'factory')
+
+# 1ケースの計測に使う時間の目安（秒）。超えたら repeat 回に満たなくても打ち切る（最低 MIN_REPEAT 回）
+CASE_BUDGET_S = 5.0
+MIN_REPEAT = 3
+
+SENSITIVITY_GRID = {
+    'electricity_price_per_kwh': [24, 27, 30, 33, 36, 39, 42],
+    'installation_cost': [1.0e6, 1.2e6, 1.4e6, 1.6e6, 1.8e6, 2.0e6],
+    'degradation_rate': [0.003, 0.004, 0.005, 0.006, 0.007],
+    'price_escalation': [0.0, 0.005, 0.01, 0.015, 0.02, 0.025, 0.03, 0.035, 0.04, 0.045],
+}
+
+LOCATION = {'lat': REF_LAT, 'lng': REF_LNG, 'address': 'Tokyo'}
+PANEL_SPECS = {'width': PANEL_WIDTH, 'height': PANEL_HEIGHT, 'offset': OFFSET}
+
+
+def no_extra(result) -> Dict:
+    return {}
+
+
+# 各ケースは (名前, 計測する関数, 空実行の戻り値から結果に添える情報を作る関数)
+def layout_cases() -> Iterator[Tuple[str, Callable, Callable]]:
+    for name, polygon in roof_corpus().items():
+        for mode in LAYOUT_MODES:
+            layout = PanelLayout(PANEL_WIDTH, PANEL_HEIGHT, OFFSET)
+            yield (f'layout/{name}/{mode}',
+                   lambda layout=layout, polygon=polygon, mode=mode: layout.calculate_layout(polygon, mode=mode),
+                   lambda panels: {'panels': len(panels)})
+    for name, count in KEEPOUT_ROOFS:
+        polygon = roof_corpus([name])[name]
+        zones = parse_keepouts(keepouts(name, count))
+        for mode in LAYOUT_MODES:
+            layout = PanelLayout(PANEL_WIDTH, PANEL_HEIGHT, OFFSET, zones)
+            yield (f'layout/{name}/{mode}+keepouts',
+                   lambda layout=layout, polygon=polygon, mode=mode: layout.calculate_layout(polygon, mode=mode),
+                   lambda panels, zones=zones: {'panels': len(panels), 'keepouts': len(zones)})
+
+
+def power_cases() -> Iterator[Tuple[str, Callable, Callable]]:
+    warm = SolarCalculator()
+    yield ('power/table', lambda: warm.calculate_power(REF_LAT, REF_LNG, 24, PANEL_AREA_M2), no_extra)
+    yield ('power/hourly_warm',
+           lambda: warm.calculate_power(REF_LAT, REF_LNG, 24, PANEL_AREA_M2, model='hourly'), no_extra)
+    # 空のキャッシュで pvlib の時間別シミュレーションから計算
+    yield ('power/hourly_cold',
+           lambda: SolarCalculator(cache=IrradianceCache()).calculate_power(
+               REF_LAT, REF_LNG, 24, PANEL_AREA_M2, model='hourly'), no_extra)
+
+
+def roi_cases() -> Iterator[Tuple[str, Callable, Callable]]:
+    solar_calc = SolarCalculator()
+    yield ('roi/20y', lambda: solar_calc.calculate_roi(1500000, 5400, 30, years=20), no_extra)
+    yield ('roi/100y_feed_in',
+           lambda: solar_calc.calculate_roi(1500000, 5400, 30, years=100, feed_in_price=16, feed_in_years=10,
+                                            self_consumption_ratio=0.4, discount_rate=0.02), no_extra)
+    scenarios = 1
+    for values in SENSITIVITY_GRID.values():
+        scenarios *= len(values)
+    base = {'yearly_generation_kwh': 5400, 'discount_rate': 0.02}
+    yield ('roi/sensitivity', lambda: evaluate_grid(base, SENSITIVITY_GRID, years=30),
+           lambda table: {'scenarios': scenarios})
+
+
+def pdf_cases(with_map: bool) -> Iterator[Tuple[str, Callable, Callable]]:
+    from benchmarks.bench_pdf import make_map_image
+
+    solar_calc = SolarCalculator()
+    map_images = {'no_map': ''}
+    if with_map:
+        map_images['map_1mb'] = make_map_image(1, 'JPEG')
+
+    corpus = roof_corpus(list(PDF_ROOFS))
+    for name, polygon in corpus.items():
+        layout = PanelLayout(PANEL_WIDTH, PANEL_HEIGHT, OFFSET)
+        panels = layout.calculate_layout(polygon)
+        power_data = solar_calc.calculate_power(REF_LAT, REF_LNG, len(panels), PANEL_AREA_M2)
+        for image_name, map_image in map_images.items():
+            def generate(polygon=polygon, panels=panels, power_data=power_data, map_image=map_image):
+                PDFGenerator().generate(polygon, panels, power_data, map_image, LOCATION, PANEL_SPECS).close()
+            yield f'pdf/{name}/{image_name}', generate, lambda _, count=len(panels): {'panels': count}
+
+
+def run_case(func: Callable, repeat: int) -> Tuple[List[float], Any]:
+    """空実行1回のあと最大 repeat 回計測し、(実行時間（ms）のリスト, 空実行の戻り値) を返す"""
+    result = func()
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < repeat:
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+        if len(samples) >= MIN_REPEAT and time.perf_counter() - started > CASE_BUDGET_S:
+            break
+    return samples, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmarks on the synthetic roof corpus')
+    parser.add_argument('--repeat', type=int, default=20, help='measured runs per case')
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this string')
+    parser.add_argument('--no-map', action='store_true', help='skip PDF cases with a map image')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to compare against')
+    args = parser.parse_args()
+
+    groups = {
+        'layout/': layout_cases,
+        'power/': power_cases,
+        'roi/': roi_cases,
+        'pdf/': lambda: pdf_cases(with_map=not args.no_map),
+    }
+
+    results = {}
+    print(f"{'case':>40} {'n':>4} {'p50 ms':>10} {'p95 ms':>10} {'min ms':>10}  extra")
+    for prefix, cases in groups.items():
+        # 絞り込みが別のグループ名で始まる場合は準備（配置の計算など）ごと飛ばす
+        head = args.filter.split('/')[0] + '/'
+        if head in groups and head != prefix:
+            continue
+        for name, func, describe in cases():
+            if args.filter not in name:
+                continue
+            samples, result = run_case(func, max(args.repeat, 1))
+            stats = summarize_samples(samples)
+            extra = describe(result)
+            results[name] = {**stats, **extra}
+            print(f"{name:>40} {stats['count']:>4} {stats['p50_ms']:>10.2f} {stats['p95_ms']:>10.2f} "
+                  f"{stats['min_ms']:>10.2f}  {extra or ''}")
+
+    if args.output:
+        payload = save_results(args.output, 'micro', results)
+        print(f"\nwrote {args.output} (commit {payload['environment']['commit']})")
+    if args.compare:
+        print()
+        compare({'environment': {'commit': 'current'}, 'results': results}, load_results(args.compare))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+Load Test
+固定の同時実行数で API にリクエストを送り続け、レイテンシの分位点とスループットを計測
+
+Usage:
+    cd api && python -m benchmarks.load_test [--scenario mixed] [--concurrency 8] [--requests 400]
+                                             [--url http://127.0.0.1:8080] [--output load.json]
+                                             [--compare baseline.json]
+
+--url を省略すると Flask のテストクライアントでアプリをこのプロセス内で呼び出す（GIL を
+共有するため、CPU 処理の並列度は実運用より低く出る）。本番に近い値を取るときは別の端末で
+Dockerfile と同じ設定の gunicorn を起動して --url で指定する:
+
+    cd api && gunicorn --bind 127.0.0.1:8080 --workers 1 --threads 8 --timeout 0 main:app
+
+各スレッドは先頭の --warmup 件を計測から除き、その後の応答時間を記録する。
+"""
+
+import argparse
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.roofs import REF_LAT, REF_LNG, roof_corpus, shifted  # noqa: E402
+from benchmarks.results import summarize_samples, save_results, load_results, compare  # noqa: E402
+
+LOCATION = {'lat': REF_LAT, 'lng': REF_LNG, 'address': 'Tokyo'}
+
+# 配置リクエストに使う屋根（負荷試験では大規模屋根を除いた典型的な住宅・倉庫）
+LOAD_ROOFS = ('rect_house', 'l_house', 'comb', 'star', 'rect_warehouse')
+LOAD_CORPUS = roof_corpus(list(LOAD_ROOFS))
+
+
+def layout_request(seed: int, cached: bool) -> Tuple[str, Dict]:
+    """cached でなければ屋根を seed ごとに平行移動し、配置キャッシュに当たらないようにする"""
+    polygon = LOAD_CORPUS[LOAD_ROOFS[seed % len(LOAD_ROOFS)]]
+    if not cached:
+        polygon = shifted(polygon, seed)
+    return '/api/calculate-panels', {
+        'polygon': polygon, 'panel_width': 165, 'panel_height': 100, 'offset': 10, 'location': LOCATION
+    }
+
+
+def roi_request(seed: int) -> Tuple[str, Dict]:
+    return '/api/calculate-roi', {
+        'installation_cost': 1200000 + 10000 * (seed % 50), 'yearly_generation_kwh': 5400,
+        'years': 30, 'discount_rate': 0.02,
+        'sensitivity': {'electricity_price_per_kwh': [25, 30, 35], 'degradation_rate': [0.004, 0.005, 0.007]}
+    }
+
+
+def solar_data_request(seed: int) -> Tuple[str, Dict]:
+    return '/api/get-solar-data', {'lat': REF_LAT + (seed % 20) * 0.1, 'lng': REF_LNG}
+
+
+def mixed_request(seed: int) -> Tuple[str, Dict]:
+    """配置（キャッシュなし）:配置（キャッシュあり）:ROI:日射量 = 1:1:1:1"""
+    kind = seed % 4
+    if kind == 0:
+        return layout_request(seed, cached=False)
+    if kind == 1:
+        return layout_request(seed, cached=True)
+    return roi_request(seed) if kind == 2 else solar_data_request(seed)
+
+
+# シナリオ名 → リクエスト番号から (パス, ボディ) を作る関数
+SCENARIOS: Dict[str, Callable[[int], Tuple[str, Dict]]] = {
+    'layout': lambda seed: layout_request(seed, cached=False),
+    'layout-cached': lambda seed: layout_request(seed, cached=True),
+    'roi': roi_request,
+    'solar-data': solar_data_request,
+    'mixed': mixed_request,
+}
+
+
+class TestClientTransport:
+    """Flask のテストクライアントでアプリを直接呼び出す（スレッドごとにクライアントを作る）"""
+
+    def __init__(self):
+        from main import app
+        self.app = app
+        self.local = threading.local()
+
+    def post(self, path: str, body: Dict) -> int:
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        return self.local.client.post(path, json=body).status_code
+
+
+class HttpTransport:
+    """起動済みのサーバーに HTTP で送る（スレッドごとに接続を再利用する）"""
+
+    def __init__(self, base_url: str):
+        import requests
+        self.requests = requests
+        self.base_url = base_url.rstrip('/')
+        self.local = threading.local()
+
+    def post(self, path: str, body: Dict) -> int:
+        if not hasattr(self.local, 'session'):
+            self.local.session = self.requests.Session()
+        return self.local.session.post(self.base_url + path, json=body, timeout=300).status_code
+
+
+def run_load(transport, scenario: str, concurrency: int, total: int, warmup: int) -> Dict:
+    """
+    concurrency 本のスレッドで合計 total 件（warmup 件/スレッドを除く）を送り、結果を集計
+
+    Returns:
+        {"latency": 分位点, "throughput_rps", "elapsed_s", "errors", "status": {ステータス: 件数}}
+    """
+    make_request = SCENARIOS[scenario]
+    bodies = [make_request(seed) for seed in range(total + warmup * concurrency)]
+    warmup_bodies, bodies = bodies[:warmup * concurrency], bodies[warmup * concurrency:]
+
+    latencies: List[float] = []
+    status: Dict[int, int] = {}
+    lock = threading.Lock()
+    next_index = iter(range(len(bodies)))
+    ready = threading.Barrier(concurrency + 1)
+
+    def worker(worker_id: int):
+        for path, body in warmup_bodies[worker_id::concurrency]:
+            transport.post(path, body)
+        ready.wait()
+        while True:
+            with lock:
+                index = next(next_index, None)
+            if index is None:
+                return
+            path, body = bodies[index]
+            start = time.perf_counter()
+            try:
+                code = transport.post(path, body)
+            except Exception:
+                code = 0
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+                status[code] = status.get(code, 0) + 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed_s = time.perf_counter() - started
+
+    return {
+        'latency': summarize_samples(latencies),
+        'throughput_rps': round(len(latencies) / elapsed_s, 2),
+        'elapsed_s': round(elapsed_s, 3),
+        'errors': sum(count for code, count in status.items() if not 200 <= code < 300),
+        'status': {str(code): count for code, count in sorted(status.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fixed-concurrency load generator for the API')
+    parser.add_argument('--scenario', default=['mixed'], choices=sorted(SCENARIOS), nargs='+',
+                        help='request mix (several may be given)')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent client threads')
+    parser.add_argument('--requests', type=int, default=400, help='measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=2, help='unmeasured requests per thread')
+    parser.add_argument('--url', help='base URL of a running server (default: in-process test client)')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to compare against')
+    args = parser.parse_args()
+
+    transport = HttpTransport(args.url) if args.url else TestClientTransport()
+    target = args.url or 'test-client'
+
+    results = {}
+    print(f"{'scenario':>14} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}  ({target}, "
+          f"concurrency {args.concurrency})")
+    for scenario in args.scenario:
+        r = run_load(transport, scenario, args.concurrency, args.requests, args.warmup)
+        latency = r['latency']
+        print(f"{scenario:>14} {r['throughput_rps']:>8.1f} {latency['p50_ms']:>9.1f} {latency['p95_ms']:>9.1f} "
+              f"{latency['p99_ms']:>9.1f} {r['errors']:>7}")
+        # 比較は分位点をトップレベルに置いた形で行う
+        results[f'{scenario}/c{args.concurrency}'] = {**latency, **{k: v for k, v in r.items() if k != 'latency'}}
+
+    if args.output:
+        payload = save_results(args.output, 'load', results, target=target)
+        print(f"\nwrote {args.output} (commit {payload['environment']['commit']})")
+    if args.compare:
+        baseline = load_results(args.compare)
+        current = {'environment': {'commit': 'current'}, 'results': results}
+        for metric in ('p50_ms', 'p99_ms'):
+            print()
+            compare(current, baseline, metric)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark Results
+計測結果の JSON 保存とコミット間の比較
+
+結果ファイルの形式:
+    {
+        "suite": "micro" | "load",
+        "environment": {"commit", "dirty", "python", "platform", "cpu_count", "created_at"},
+        "results": {ケース名: {"p50_ms": ..., ...}}
+    }
+
+Usage:
+    cd api && python -m benchmarks.results CURRENT.json BASELINE.json
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+# 比較で「変化あり」として印を付ける p50 の比
+CHANGE_THRESHOLD = 0.10
+
+
+def summarize_samples(samples_ms: Sequence[float]) -> Dict[str, float]:
+    """計測値（ms）の分位点と平均"""
+    samples = np.asarray(samples_ms, dtype=float)
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {
+        'count': int(samples.size),
+        'min_ms': round(float(samples.min()), 3),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'mean_ms': round(float(samples.mean()), 3),
+        'max_ms': round(float(samples.max()), 3),
+    }
+
+
+def environment() -> Dict:
+    """計測したコミットと実行環境"""
+    repo = Path(__file__).resolve().parent.parent
+    commit, dirty = None, None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repo,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return {
+        'commit': commit,
+        'dirty': dirty,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+
+
+def save_results(path: str, suite: str, results: Dict[str, Dict], **extra) -> Dict:
+    """結果を環境情報とともに JSON で保存"""
+    payload = {'suite': suite, 'environment': environment(), **extra, 'results': results}
+    with open(path, 'w') as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+    return payload
+
+
+def load_results(path: str) -> Dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(current: Dict, baseline: Dict, metric: str = 'p50_ms') -> None:
+    """
+    2つの結果ファイルの同名ケースを metric で比較して表示
+
+    比が CHANGE_THRESHOLD を超えて遅くなったケースに '+'、速くなったケースに '-' を付ける。
+    """
+    print(f"baseline {baseline['environment'].get('commit')}  ->  current {current['environment'].get('commit')}"
+          f"  ({metric})")
+    print(f"{'case':>40} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None or metric not in base or metric not in result:
+            print(f"{name:>40} {'-':>10} {result.get(metric, '-'):>10}")
+            continue
+        ratio = result[metric] / base[metric] if base[metric] else float('inf')
+        mark = '+' if ratio > 1 + CHANGE_THRESHOLD else '-' if ratio < 1 - CHANGE_THRESHOLD else ' '
+        print(f"{name:>40} {base[metric]:>10.2f} {result[metric]:>10.2f} {ratio:>6.2f}x {mark}")
+
+
+def compare_files(current_path: str, baseline_path: str, metric: Optional[str] = None) -> None:
+    current = load_results(current_path)
+    compare(current, load_results(baseline_path), metric or 'p50_ms')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4):
+        print(__doc__)
+        sys.exit(1)
+    compare_files(*sys.argv[1:])
@@ -0,0 +1,140 @@
+"""
+Synthetic Roof Corpus
+ベンチマーク・負荷試験で共通に使う合成屋根（長方形・L字・凹形状・大規模多角形）
+
+Usage:
+    cd api && python -m benchmarks.roofs    # 屋根の一覧（面積・頂点数）を表示
+"""
+
+import math
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from projection import LocalProjection  # noqa: E402
+
+# 屋根の基準点（東京）
+REF_LAT = 35.6762
+REF_LNG = 139.6503
+
+
+def rectangle(width: float, height: float) -> List[Tuple[float, float]]:
+    """width × height (m) の長方形"""
+    return [(0, 0), (width, 0), (width, height), (0, height)]
+
+
+def l_shape(area_m2: float) -> List[Tuple[float, float]]:
+    """一辺 a の正方形から (a/2)² を欠いた L 字（面積 = 3a²/4）"""
+    a = math.sqrt(area_m2 * 4 / 3)
+    return [(0, 0), (a, 0), (a, a / 2), (a / 2, a / 2), (a / 2, a), (0, a)]
+
+
+def comb(teeth: int, tooth_width: float, tooth_length: float, spine: float) -> List[Tuple[float, float]]:
+    """幅 spine の背から tooth_length の歯が teeth 本並ぶ櫛形（歯の間隔は歯の幅と同じ）"""
+    width = tooth_width * (2 * teeth - 1)
+    points = [(0, 0), (width, 0)]
+    for i in reversed(range(teeth)):
+        right = tooth_width * (2 * i + 1)
+        left = right - tooth_width
+        points += [(right, spine + tooth_length), (left, spine + tooth_length)]
+        if i:
+            points += [(left, spine), (left - tooth_width, spine)]
+    return [points[0], points[1], (width, spine)] + points[2:]
+
+
+def star(points: int, outer: float, inner: float) -> List[Tuple[float, float]]:
+    """外径 outer・内径 inner (m) の星形（凹頂点が points 個）"""
+    angles = np.arange(points * 2) * math.pi / points
+    radii = np.where(np.arange(points * 2) % 2 == 0, outer, inner)
+    return list(zip(radii * np.cos(angles), radii * np.sin(angles)))
+
+
+def wavy_circle(vertices: int, radius: float, amplitude: float) -> List[Tuple[float, float]]:
+    """頂点数の多いなめらかな凹形状（半径が周方向に波打つ円）"""
+    angles = np.arange(vertices) * 2 * math.pi / vertices
+    radii = radius + amplitude * np.sin(angles * 9)
+    return list(zip(radii * np.cos(angles), radii * np.sin(angles)))
+
+
+# 名前 → (種類, メートル座標の頂点)。名前はベンチマーク結果のキーになるため変えないこと
+ROOF_SHAPES = {
+    'rect_small': ('rectangle', rectangle(8, 5)),
+    'rect_house': ('rectangle', rectangle(12, 7)),
+    'rect_warehouse': ('rectangle', rectangle(60, 30)),
+    'l_house': ('l_shape', l_shape(100)),
+    'l_large': ('l_shape', l_shape(2000)),
+    'comb': ('concave', comb(teeth=5, tooth_width=6, tooth_length=18, spine=8)),
+    'star': ('concave', star(points=7, outer=25, inner=11)),
+    'wavy_circle': ('concave', wavy_circle(vertices=720, radius=40, amplitude=4)),
+    'factory': ('very_large', rectangle(200, 120)),
+    'campus_l': ('very_large', l_shape(40000)),
+}
+
+
+def to_latlng(meters: List[Tuple[float, float]]) -> List[List[float]]:
+    """基準点まわりのメートル座標を緯度経度の頂点リストに変換"""
+    return LocalProjection(REF_LAT, REF_LNG).to_latlng(np.asarray(meters, dtype=float)).tolist()
+
+
+def roof_corpus(names: List[str] = None) -> Dict[str, List[List[float]]]:
+    """
+    合成屋根の多角形（緯度経度）を返す
+
+    Args:
+        names: 取り出す屋根の名前（省略時は全て）
+
+    Returns:
+        {屋根の名前: [[lat, lng], ...]}
+    """
+    names = list(ROOF_SHAPES) if names is None else names
+    return {name: to_latlng(ROOF_SHAPES[name][1]) for name in names}
+
+
+def keepouts(name: str, count: int, size: float = 2.0, setback_cm: float = 50) -> List[Dict]:
+    """
+    屋根 name の内側に格子状に並べた size × size (m) の設置禁止区域（天窓・換気口の想定）
+
+    外接矩形を約 count 個の格子に分け、区域が屋根に収まる格子点だけを使う。
+    """
+    from shapely.geometry import Polygon, box
+
+    roof = Polygon(ROOF_SHAPES[name][1])
+    minx, miny, maxx, maxy = roof.bounds
+    side = max(1, round(math.sqrt(count)))
+    zones = []
+    for x in np.linspace(minx, maxx, side + 2)[1:-1]:
+        for y in np.linspace(miny, maxy, side + 2)[1:-1]:
+            if roof.contains(box(x, y, x + size, y + size)):
+                zones.append({'polygon': to_latlng(rectangle(size, size) + np.array([x, y])),
+                              'setback': setback_cm})
+    return zones
+
+
+def shifted(polygon: List[List[float]], seed: int, meters: float = 500) -> List[List[float]]:
+    """
+    屋根を平行移動したコピー（負荷試験で配置キャッシュに当たらないリクエストを作る）
+
+    seed ごとに最大 meters (m) ずらす。形状と面積は変わらない。
+    """
+    rng = np.random.default_rng(seed)
+    projection = LocalProjection(REF_LAT, REF_LNG)
+    xy = projection.to_local(np.asarray(polygon, dtype=float)) + rng.uniform(-meters, meters, 2)
+    return projection.to_latlng(xy).tolist()
+
+
+def main():
+    from shapely.geometry import Polygon
+
+    print(f"{'name':>16} {'kind':>11} {'vertices':>9} {'area m2':>10}")
+    for name, (kind, meters) in ROOF_SHAPES.items():
+        polygon = Polygon(meters)
+        assert polygon.is_valid, name
+        print(f"{name:>16} {kind:>11} {len(meters):>9} {polygon.area:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Irradiance Grid Builder
+日本全域の日射量グリッド（.npy + .json）を作成するオフライン処理
+
+月別の日平均日射量は、観測値の CSV（--monthly-csv、例: NEDO MONSOLA の地点データ）が
+与えられればグリッド点ごとに近傍地点の逆距離加重平均で求め、無ければ SolarCalculator の
+簡易テーブルを用いる。時刻別の代表日プロファイルは、各月15日の晴天日射（pvlib Ineichen）の
+日変化の形を月別の日射量に合わせて縮小したもの。
+
+Usage:
+    cd api && python build_irradiance_grid.py [--step 0.25] [--monthly-csv stations.csv]
+
+CSV の形式（ヘッダ行あり）:
+    lat,lng,m1,m2,...,m12   （各月の日平均日射量 Wh/m²/day）
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pvlib
+
+from solar_calc import SolarCalculator, DEFAULT_GRID_PATH, SIMULATION_YEAR, SIMULATION_TZ
+
+# 日本の範囲（南西諸島〜北海道）
+LAT_MIN, LAT_MAX = 24.0, 46.0
+LNG_MIN, LNG_MAX = 122.0, 154.0
+
+DAYS_IN_MONTH = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+def representative_times() -> pd.DatetimeIndex:
+    """各月15日の 0〜23 時（各時間の中央時刻）の 288 時刻"""
+    days = [pd.Timestamp(SIMULATION_YEAR, month, 15, tz=SIMULATION_TZ) for month in range(1, 13)]
+    return pd.DatetimeIndex([day + pd.Timedelta(minutes=30 + 60 * hour) for day in days for hour in range(24)])
+
+
+def clearsky_day_profiles(latitude: float, longitude: float, times: pd.DatetimeIndex) -> np.ndarray:
+    """代表日の晴天時水平面日射量（W/m²、12×24）"""
+    solar_position = pvlib.solarposition.get_solarposition(times, latitude, longitude)
+    # pandas の演算コストを避けるため以降は ndarray で計算する
+    apparent_zenith = solar_position['apparent_zenith'].values
+    airmass = pvlib.atmosphere.get_absolute_airmass(pvlib.atmosphere.get_relative_airmass(apparent_zenith))
+    linke_turbidity = pvlib.clearsky.lookup_linke_turbidity(times, latitude, longitude).values
+    with np.errstate(divide='ignore', invalid='ignore'):  # 夜間（天頂角 > 90°）の計算は捨てる
+        clearsky = pvlib.clearsky.ineichen(apparent_zenith, airmass, linke_turbidity)
+    return np.nan_to_num(clearsky['ghi']).reshape(12, 24)
+
+
+def load_stations(path: str) -> np.ndarray:
+    """観測地点 CSV を (地点数, 14) [lat, lng, m1..m12] の配列で読み込む"""
+    with open(path, newline='') as f:
+        rows = [[float(row['lat']), float(row['lng'])] + [float(row[f'm{m}']) for m in range(1, 13)]
+                for row in csv.DictReader(f)]
+    return np.array(rows)
+
+
+def station_monthly(stations: np.ndarray, latitude: float, longitude: float, k: int = 4) -> np.ndarray:
+    """近傍 k 地点の逆距離加重平均による月別日射量"""
+    distance = np.hypot(stations[:, 0] - latitude,
+                        (stations[:, 1] - longitude) * np.cos(np.radians(latitude)))
+    nearest = np.argsort(distance)[:k]
+    weights = 1 / np.maximum(distance[nearest], 1e-6) ** 2
+    return (stations[nearest, 2:] * weights[:, None]).sum(axis=0) / weights.sum()
+
+
+def build(step: float, output: str, monthly_csv: str = None):
+    lats = np.arange(LAT_MIN, LAT_MAX + step / 2, step)
+    lngs = np.arange(LNG_MIN, LNG_MAX + step / 2, step)
+    stations = load_stations(monthly_csv) if monthly_csv else None
+    
+    calculator = SolarCalculator()
+    times = representative_times()
+    grid = np.zeros((len(lats), len(lngs), 12 + 12 * 24), dtype=np.float32)
+    
+    start = time.time()
+    for i, lat in enumerate(lats):
+        for j, lng in enumerate(lngs):
+            if stations is not None:
+                monthly = station_monthly(stations, lat, lng)
+            else:
+                monthly = calculator.table_monthly_profile(lat)
+            
+            # 代表日の日変化の形を月別日射量に合わせる
+            profiles = clearsky_day_profiles(lat, lng, times)
+            daily_clearsky = profiles.sum(axis=1)
+            scale = np.divide(monthly, daily_clearsky, out=np.zeros(12), where=daily_clearsky > 0)
+            
+            grid[i, j, :12] = monthly
+            grid[i, j, 12:] = (profiles * scale[:, None]).ravel()
+        print(f"  lat {lat:.2f} ({i + 1}/{len(lats)}) {time.time() - start:.1f}s", flush=True)
+    
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    np.save(output, grid)
+    with open(os.path.splitext(output)[0] + '.json', 'w') as f:
+        json.dump({
+            'lat_min': LAT_MIN,
+            'lng_min': LNG_MIN,
+            'step': step,
+            'shape': list(grid.shape),
+            'source': os.path.basename(monthly_csv) if monthly_csv else 'table',
+            'created_at': pd.Timestamp.now(tz=SIMULATION_TZ).isoformat()
+        }, f, indent=2)
+    
+    print(f"wrote {output} {grid.shape} ({grid.nbytes / 1e6:.1f} MB)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the irradiance grid for Japan')
+    parser.add_argument('--step', type=float, default=0.25, help='grid spacing in degrees')
+    parser.add_argument('--output', default=DEFAULT_GRID_PATH, help='output .npy path')
+    parser.add_argument('--monthly-csv', help='station monthly irradiance CSV (lat,lng,m1..m12)')
+    args = parser.parse_args()
+    build(args.step, args.output, args.monthly_csv)
@@ -0,0 +1,207 @@
+"""
+Financial Projection
+発電量から年ごとの収支を配列演算で求める投資回収シミュレーション
+"""
+
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+# シナリオごとに変えられるパラメータと既定値
+ROI_DEFAULTS = {
+    'installation_cost': 0.0,           # 設置費用（円）
+    'yearly_generation_kwh': 0.0,       # 初年度の年間発電量（kWh）
+    'electricity_price_per_kwh': 30.0,  # 買電単価（円/kWh）
+    'degradation_rate': 0.005,          # 年あたりの発電量低下率
+    'price_escalation': 0.0,            # 買電単価の年上昇率
+    'self_consumption_ratio': 1.0,      # 自家消費の割合（残りは売電）
+    'feed_in_price': 0.0,               # 売電単価（円/kWh）
+    'feed_in_years': np.inf,            # 売電単価が適用される年数（以降は post_feed_in_price）
+    'post_feed_in_price': 0.0,          # 売電期間終了後の売電単価（円/kWh）
+    'maintenance_cost': 0.0,            # 年間の維持費（円）
+    'discount_rate': 0.0,               # 割引率（NPV 用）
+}
+
+# 計算できる最長の年数
+MAX_YEARS = 100
+
+# 感度分析で一度に評価するシナリオ数の上限
+MAX_SCENARIOS = 200000
+
+# 感度分析で一度に計算するシナリオ数 × 年数の上限（年ごとの収支の配列がこの要素数になる）
+MAX_GRID_CELLS = 2000000
+
+# IRR を二分法で求めるときの探索範囲と反復回数
+IRR_BOUNDS = (-0.99, 1.0)
+IRR_ITERATIONS = 60
+
+
+def project_cash_flows(years: int = 20, **params) -> Dict[str, np.ndarray]:
+    """
+    年ごとの発電量・節約額・累積収支を計算
+
+    パラメータには配列を渡せる（互いにブロードキャストできる形状であること）。
+    結果の配列の形状は「パラメータをブロードキャストした形状 + (years,)」になる。
+    年 t（0 始まり）の値は、劣化・単価上昇は (1 + rate) ** t、割引は年末払いとして
+    (1 + discount_rate) ** -(t + 1) を掛け、累積は np.cumsum で求める。
+
+    Args:
+        years: 計算する年数
+        **params: ROI_DEFAULTS のパラメータ（省略時は既定値）
+
+    Returns:
+        {
+            'generation_kwh', 'savings_yen', 'cumulative_savings_yen',
+            'net_benefit_yen', 'discounted_net_benefit_yen': 各 (..., years)
+        }
+    """
+    p = _broadcast_params(params)
+    t = np.arange(years)
+
+    generation = p['yearly_generation_kwh'][..., None] * (1 - p['degradation_rate'][..., None]) ** t
+    retail_price = p['electricity_price_per_kwh'][..., None] * (1 + p['price_escalation'][..., None]) ** t
+    export_price = np.where(t < p['feed_in_years'][..., None],
+                            p['feed_in_price'][..., None], p['post_feed_in_price'][..., None])
+
+    self_ratio = p['self_consumption_ratio'][..., None]
+    savings = generation * (self_ratio * retail_price + (1 - self_ratio) * export_price)
+    savings = savings - p['maintenance_cost'][..., None]
+
+    discount = (1 + p['discount_rate'][..., None]) ** -(t + 1.0)
+    cumulative = np.cumsum(savings, axis=-1)
+    cost = p['installation_cost'][..., None]
+
+    return {
+        'generation_kwh': np.broadcast_to(generation, savings.shape),
+        'savings_yen': savings,
+        'cumulative_savings_yen': cumulative,
+        'net_benefit_yen': cumulative - cost,
+        'discounted_net_benefit_yen': np.cumsum(savings * discount, axis=-1) - cost
+    }
+
+
+def summarize(flows: Dict[str, np.ndarray], installation_cost) -> Dict[str, np.ndarray]:
+    """
+    年ごとの収支から回収年数・NPV・IRR を求める
+
+    累積回収年数は累積収支が 0 を超える年を年内で線形補間した値（期間内に回収できなければ inf）。
+
+    Returns:
+        {'cumulative_payback_years', 'discounted_payback_years', 'npv_yen', 'irr'}: 各 (...)
+    """
+    savings = flows['savings_yen']
+    cost = np.broadcast_to(np.asarray(installation_cost, dtype=float), savings.shape[:-1])
+
+    discount_flows = np.diff(flows['discounted_net_benefit_yen'], axis=-1,
+                             prepend=-cost[..., None])
+    return {
+        'cumulative_payback_years': _payback_years(flows['net_benefit_yen'], savings, cost),
+        'discounted_payback_years': _payback_years(flows['discounted_net_benefit_yen'], discount_flows, cost),
+        'npv_yen': flows['discounted_net_benefit_yen'][..., -1],
+        'irr': _irr(savings, cost)
+    }
+
+
+def evaluate_grid(base: Dict, grid: Dict[str, Sequence[float]], years: int = 20) -> Dict:
+    """
+    パラメータの組み合わせ（感度分析の表）をまとめて評価
+
+    grid の各パラメータを別々の軸に並べてブロードキャストし、1回の配列演算で全シナリオを計算する。
+
+    Args:
+        base: 固定するパラメータ
+        grid: 変化させるパラメータと値のリスト（例: {'electricity_price_per_kwh': [25, 30, 35]}）
+        years: 計算する年数
+
+    Returns:
+        {
+            'parameters': [パラメータ名, ...],
+            'values': [[値, ...], ...],
+            'cumulative_payback_years' など summarize の各値: grid の軸順の多次元配列
+        }
+
+    Raises:
+        ValueError: 未知のパラメータや、シナリオ数・シナリオ数 × 年数が上限を超える場合
+    """
+    names = list(grid)
+    for name in names:
+        if name not in ROI_DEFAULTS:
+            raise ValueError(f"Unknown sensitivity parameter: {name}")
+
+    values = [np.asarray(grid[name], dtype=float).ravel() for name in names]
+    scenario_count = int(np.prod([len(v) for v in values])) if values else 1
+    if scenario_count > MAX_SCENARIOS:
+        raise ValueError(f"Too many scenarios ({scenario_count}). At most {MAX_SCENARIOS}.")
+    if scenario_count * years > MAX_GRID_CELLS:
+        raise ValueError(f"Too many scenarios ({scenario_count}) for {years} years. "
+                         f"At most {MAX_GRID_CELLS // years} scenarios.")
+
+    params = dict(base)
+    for axis, (name, value) in enumerate(zip(names, values)):
+        shape = [1] * len(names)
+        shape[axis] = len(value)
+        params[name] = value.reshape(shape)
+
+    flows = project_cash_flows(years, **params)
+    summary = summarize(flows, params.get('installation_cost', ROI_DEFAULTS['installation_cost']))
+    return {
+        'parameters': names,
+        'values': [v.tolist() for v in values],
+        **summary
+    }
+
+
+def _broadcast_params(params: Dict) -> Dict[str, np.ndarray]:
+    """既定値で補ったパラメータを同じ形状の float 配列に揃える"""
+    unknown = set(params) - set(ROI_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown parameter: {', '.join(sorted(unknown))}")
+
+    merged = {name: np.asarray(params.get(name, default), dtype=float)
+              for name, default in ROI_DEFAULTS.items()}
+    arrays = np.broadcast_arrays(*merged.values())
+    return dict(zip(merged, arrays))
+
+
+def _payback_years(net: np.ndarray, flows: np.ndarray, cost: np.ndarray) -> np.ndarray:
+    """累積収支 net が初めて 0 以上になる時点（年内は線形補間）"""
+    recovered = net >= 0
+    first = np.argmax(recovered, axis=-1)
+    never = ~recovered.any(axis=-1)
+
+    previous = np.where(first > 0, np.take_along_axis(net, np.maximum(first - 1, 0)[..., None], -1)[..., 0], -cost)
+    flow = np.take_along_axis(flows, first[..., None], -1)[..., 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = np.where(flow > 0, -previous / flow, 0.0)
+    return np.where(never, np.inf, first + np.clip(fraction, 0.0, 1.0))
+
+
+def _irr(savings: np.ndarray, cost: np.ndarray) -> np.ndarray:
+    """
+    内部収益率を二分法で求める（全シナリオを同時に反復）
+
+    初期投資のあと年ごとの収支が続く通常のキャッシュフローでは NPV は割引率に対して単調減少する。
+    探索範囲内に解が無い場合は nan。
+    """
+    t = np.arange(1, savings.shape[-1] + 1)
+
+    def npv(rate):
+        return (savings * (1 + rate[..., None]) ** -t).sum(axis=-1) - cost
+
+    low = np.full(cost.shape, IRR_BOUNDS[0])
+    high = np.full(cost.shape, IRR_BOUNDS[1])
+    valid = (npv(low) >= 0) & (npv(high) <= 0)
+    for _ in range(IRR_ITERATIONS):
+        mid = (low + high) / 2
+        positive = npv(mid) > 0
+        low = np.where(positive, mid, low)
+        high = np.where(positive, high, mid)
+    return np.where(valid, (low + high) / 2, np.nan)
+
+
+def to_list(values: np.ndarray, digits: int) -> List:
+    """配列を JSON 用のリストに変換（inf・nan は None）"""
+    rounded = np.asarray(np.round(np.asarray(values, dtype=float), digits))
+    result = rounded.astype(object)
+    result[~np.isfinite(rounded)] = None
+    return result.tolist()
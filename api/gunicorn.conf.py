@@ -0,0 +1,28 @@
+"""
+Gunicorn Configuration
+Cloud Run 用の起動設定（gunicorn はカレントディレクトリのこのファイルを自動で読み込む）
+
+GUNICORN_PRELOAD（既定1）でマスターがアプリを読み込んでから fork する。STARTUP_WARMUP と
+組み合わせると、ウォームアップ済みの状態（読み込んだモジュール・日射量キャッシュ）を
+全ワーカーが copy-on-write で共有する。
+"""
+
+import os
+
+bind = f":{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = 0
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1').lower() in ('1', 'true', 'yes')
+
+if preload_app:
+    # main.py はこれを見てバックグラウンドのスレッドを fork 後（post_fork）まで開始しない
+    os.environ['SOLAR_PRELOADED'] = '1'
+
+
+def post_fork(server, worker):
+    """fork したワーカーの初期化（プロセスプールは worker_pool が fork 時に破棄する）"""
+    if preload_app:
+        import startup
+        startup.after_fork()
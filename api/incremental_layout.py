@@ -0,0 +1,478 @@
+"""
+Incremental Layout
+頂点の移動やオフセット変更に対して、変化した領域のセルだけを再判定するパネル配置
+"""
+
+import math
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
+
+from panel_layout import PanelLayout, LayoutCandidate, ORIENTATIONS, ROTATION_TOLERANCE_M, CELL_TOLERANCE_M
+from projection import LocalProjection
+
+# インクリメンタル配置に対応する配置モード（回転・列詰めはグリッドが固定できないため対象外）
+INCREMENTAL_MODES = ('grid', 'search')
+
+
+class LayoutSession:
+    def __init__(self, layout: PanelLayout, polygon_coords: List[List[float]], projection: LocalProjection,
+                 candidate: LayoutCandidate, frame: Tuple[float, float], roof_polygon: Optional[Polygon],
+                 window: Tuple[int, int], mask: np.ndarray, disabled: Optional[np.ndarray] = None):
+        """
+        インクリメンタル配置の状態（1回の編集ごとに新しいセッションを作り、既存のものは変更しない）
+
+        グリッドは作成時の屋根で決めた原点 frame に固定し、セル (i, j) の左下を
+        frame + (i * (w + spacing), j * (h + spacing)) とする。屋根を編集しても
+        グリッドが動かないため、変化していない領域のセルの判定結果をそのまま使える。
+        グリッドが固定されているので、地点からセルへの対応（パネルの当たり判定）も
+        座標の割り算だけで求まる。
+
+        Args:
+            layout: パネル寸法・オフセット
+            polygon_coords: 屋根の多角形 [[lat, lng], ...]
+            projection: 作成時の屋根で決めたローカル座標系（編集後も固定）
+            candidate: グリッドの向きと位相
+            frame: グリッド原点 (m)
+            roof_polygon: オフセット適用後の屋根（空なら None）
+            window: mask[0, 0] に対応するセル番号 (i0, j0)
+            mask: 配置可能なセルの bool 配列（行 = j、列 = i）
+            disabled: ユーザーが外したセルの bool 配列（mask と同じ形状、省略時は全て False）
+        """
+        self.layout = layout
+        self.polygon_coords = polygon_coords
+        self.projection = projection
+        self.candidate = candidate
+        self.frame = frame
+        self.roof_polygon = roof_polygon
+        self.window = window
+        self.mask = mask
+        self.disabled = disabled if disabled is not None else np.zeros(mask.shape, dtype=bool)
+        self.retested_cells = int(mask.size)
+        self.options: Dict = {}  # 発電量計算の設定など、呼び出し側が引き継ぐ値
+        # グリッドの行（絶対番号 j）ごとの緯度経度配列。配置が変わらない行は前回のセッションと共有する
+        self._rows: Dict[int, Dict[str, np.ndarray]] = {}
+        self._rows_complete = False
+
+    @classmethod
+    def create(cls, layout: PanelLayout, polygon_coords: List[List[float]], mode: str = 'grid',
+               phase_steps: int = 4) -> 'LayoutSession':
+        """
+        通常の配置計算と同じ方法で向きと位相を選び、グリッドを固定したセッションを作成
+        """
+        if mode not in INCREMENTAL_MODES:
+            raise ValueError(f"Incremental layout supports only: {', '.join(INCREMENTAL_MODES)}")
+
+        projection = layout._make_projection(polygon_coords)
+        roof_polygon = layout._prepare_roof(polygon_coords, projection)
+        if roof_polygon is None:
+            candidate = layout._search_candidates(1)[0]
+            return cls(layout, polygon_coords, projection, candidate, (0.0, 0.0), None,
+                       (0, 0), np.zeros((0, 0), dtype=bool))
+
+        candidate, _ = layout._select_best(roof_polygon, layout._search_candidates(
+            phase_steps if mode == 'search' else 1))
+        minx, miny = roof_polygon.bounds[:2]
+        frame = (minx + candidate.phase_x, miny + candidate.phase_y)
+        return cls.on_grid(layout, polygon_coords, projection, candidate, frame, roof_polygon)
+
+    @classmethod
+    def on_grid(cls, layout: PanelLayout, polygon_coords: List[List[float]], projection: LocalProjection,
+                candidate: LayoutCandidate, frame: Tuple[float, float],
+                roof_polygon: Optional[Polygon] = None) -> 'LayoutSession':
+        """
+        指定したグリッドで屋根に掛かる全てのセルを判定したセッションを作成
+
+        同じグリッドのセッションに apply_delta で編集を重ねた結果は、編集後の屋根でこれを
+        呼んだ結果と一致する。
+
+        Args:
+            roof_polygon: オフセット適用後の屋根（省略時は polygon_coords から作成）
+        """
+        if roof_polygon is None:
+            roof_polygon = layout._prepare_roof(polygon_coords, projection)
+        session = cls(layout, polygon_coords, projection, candidate, frame, roof_polygon,
+                      (0, 0), np.zeros((0, 0), dtype=bool))
+        if roof_polygon is None:
+            return session
+
+        window, shape = session._cell_window(roof_polygon.bounds)
+        ii, jj = np.meshgrid(np.arange(shape[1]) + window[0], np.arange(shape[0]) + window[1])
+        session.window = window
+        session.mask = session._test_cells(roof_polygon, ii.ravel(), jj.ravel()).reshape(shape)
+        session.disabled = np.zeros(shape, dtype=bool)
+        session.retested_cells = int(session.mask.size)
+        return session
+
+    def apply_delta(self, polygon_coords: Optional[List[List[float]]] = None,
+                    offset_cm: Optional[float] = None) -> 'LayoutSession':
+        """
+        屋根の形状またはオフセットを変更した新しいセッションを返す
+
+        変更前後の屋根の差分のうち、増えた領域に掛かるセルは全て、減った領域に掛かるセルは
+        配置済みのものだけを再判定する。それ以外のセルは屋根との包含関係が変わらないため
+        前回の結果を引き継ぐ。
+
+        Args:
+            polygon_coords: 新しい屋根の多角形（省略時は変更なし）
+            offset_cm: 新しいオフセット (cm)（省略時は変更なし）
+        """
+        layout = self.layout
+        if offset_cm is not None and offset_cm != layout.offset:
+            layout = PanelLayout(layout.panel_width, layout.panel_height, offset_cm, layout.keepouts)
+        if polygon_coords is None:
+            polygon_coords = self.polygon_coords
+
+        roof_polygon = layout._prepare_roof(polygon_coords, self.projection)
+        if roof_polygon is None:
+            session = LayoutSession(layout, polygon_coords, self.projection, self.candidate, self.frame,
+                                    None, (0, 0), np.zeros((0, 0), dtype=bool))
+            session.retested_cells = 0
+            session.options = self.options
+            return session
+
+        window, shape = self._cell_window(roof_polygon.bounds)
+        mask = self._carry_over(self.mask, window, shape, False)
+        # 外したパネルは屋根を編集しても外したままにする
+        disabled = self._carry_over(self.disabled, window, shape, False)
+
+        # 再判定するセル
+        retest = np.zeros(shape, dtype=bool)
+        if self.roof_polygon is None:
+            retest[:] = True
+        else:
+            added = shapely.difference(roof_polygon, self.roof_polygon)
+            removed = shapely.difference(self.roof_polygon, roof_polygon)
+            for part in shapely.get_parts(added):
+                retest |= self._region_mask(part, window, shape)
+            for part in shapely.get_parts(removed):
+                retest |= self._region_mask(part, window, shape) & mask
+
+        jj, ii = np.nonzero(retest)
+        if len(ii):
+            mask[jj, ii] = self._test_cells(roof_polygon, ii + window[0], jj + window[1])
+
+        session = LayoutSession(layout, polygon_coords, self.projection, self.candidate, self.frame,
+                                roof_polygon, window, mask, disabled)
+        session.retested_cells = len(ii)
+        session.options = self.options
+        if layout.spacing == self.layout.spacing:
+            self._share_arrays(session)
+        return session
+
+    def with_disabled(self, disabled: np.ndarray) -> 'LayoutSession':
+        """
+        外すセルを置き換えた新しいセッションを返す（屋根とセルの判定結果はそのまま）
+
+        Args:
+            disabled: 外すセルの bool 配列（mask と同じ形状）
+        """
+        session = LayoutSession(self.layout, self.polygon_coords, self.projection, self.candidate, self.frame,
+                                self.roof_polygon, self.window, self.mask, disabled)
+        session.retested_cells = 0
+        session.options = self.options
+        self._share_arrays(session)
+        return session
+
+    def _share_arrays(self, session: 'LayoutSession'):
+        """配置が変わらない行は前回の緯度経度をそのまま使うよう session に行の配列を渡す"""
+        if not self._rows_complete:
+            return
+        carried = self._carry_over(self.placed, session.window, session.mask.shape, False)
+        unchanged = (carried == session.placed).all(axis=1)
+        for row in np.nonzero(unchanged)[0]:
+            block = self._rows.get(int(row) + session.window[1])
+            # 新しい窓の外に出たパネルがある行は配置が変わっている
+            if block is not None and len(block['orientation']) == np.count_nonzero(session.placed[row]):
+                session._rows[int(row) + session.window[1]] = block
+
+    def materialize(self):
+        """
+        パネルのある全ての行の緯度経度配列を用意する
+
+        前回のセッションから引き継いだ行は再計算せず、それ以外の行だけまとめて変換する。
+        """
+        if self._rows_complete:
+            return
+        jj, ii = np.nonzero(self.placed)
+        rows = jj + self.window[1]
+        fresh = ~np.isin(rows, list(self._rows))
+        if fresh.any():
+            arrays = self._cell_arrays(ii[fresh], jj[fresh])
+            fresh_rows, starts = np.unique(rows[fresh], return_index=True)
+            bounds = list(starts) + [int(np.count_nonzero(fresh))]
+            for k, row in enumerate(fresh_rows):
+                # 行ごとに複製して、共有した行が変換結果全体を保持し続けないようにする
+                self._rows[int(row)] = {name: values[bounds[k]:bounds[k + 1]].copy()
+                                        for name, values in arrays.items()}
+        self._rows_complete = True
+
+    def layout_arrays(self) -> Dict[str, np.ndarray]:
+        """
+        配置結果を calculate_layout_arrays と同じ形式の配列で返す
+        
+        行ごとの配列を連結した新しい配列を返す（前回のセッションから引き継いだ行は緯度経度を再計算しない）。
+        """
+        self.materialize()
+        if not self._rows:
+            empty = np.zeros(0, dtype=int)
+            return self._cell_arrays(empty, empty)
+        blocks = [self._rows[row] for row in sorted(self._rows)]
+        return {name: np.concatenate([block[name] for block in blocks]) for name in blocks[0]}
+
+    def memory_blocks(self) -> List[Tuple[object, int]]:
+        """
+        保持している配列のまとまりとそのバイト数
+
+        前回のセッションと共有している配列は同じオブジェクトになる（LayoutSessionStore が重複を除いて数える）。
+        """
+        blocks = [(self.mask, self.mask.nbytes), (self.disabled, self.disabled.nbytes)]
+        blocks += [(block, sum(values.nbytes for values in block.values())) for block in self._rows.values()]
+        return blocks
+    
+    def _cell_arrays(self, ii: np.ndarray, jj: np.ndarray) -> Dict[str, np.ndarray]:
+        """セル番号の配列からパネルの緯度経度配列を作成"""
+        step_x, step_y = self._steps()
+        origins = np.column_stack([
+            self.frame[0] + (ii + self.window[0]) * step_x,
+            self.frame[1] + (jj + self.window[1]) * step_y
+        ])
+        return self.layout._panel_arrays([(self.candidate, origins, (0.0, 0.0))], self.projection)
+
+    @property
+    def placed(self) -> np.ndarray:
+        """パネルを置いているセル（配置可能かつ外していないセル）の bool 配列"""
+        return self.mask & ~self.disabled
+
+    @property
+    def panel_count(self) -> int:
+        return int(np.count_nonzero(self.placed))
+
+    def cell_at(self, lat: float, lng: float) -> Optional[Tuple[int, int]]:
+        """
+        地点に重なる配置可能なセルの window 上の位置 (行, 列) を返す（外したセルも含む）
+
+        地点をローカル座標に変換し、グリッドの刻みで割ってセルを求める。
+        パネル間の隙間や配置できないセルの上なら None。
+        """
+        x, y = self.projection.to_local(np.array([lat, lng]))
+        step_x, step_y = self._steps()
+        i = math.floor((x - self.frame[0]) / step_x)
+        j = math.floor((y - self.frame[1]) / step_y)
+        if x - (self.frame[0] + i * step_x) > self.candidate.w or y - (self.frame[1] + j * step_y) > self.candidate.h:
+            return None
+
+        row, col = j - self.window[1], i - self.window[0]
+        if not (0 <= row < self.mask.shape[0] and 0 <= col < self.mask.shape[1]) or not self.mask[row, col]:
+            return None
+        return row, col
+
+    def cells_in_region(self, polygon_coords: List[List[float]]) -> np.ndarray:
+        """
+        領域（[[lat, lng], ...]）と重なる配置可能なセルの bool 配列（mask と同じ形状）
+
+        _region_mask で候補のセルを絞り込んでから、セルの矩形と領域の交差をまとめて判定する
+        （辺や頂点で接するだけのセルは含めない）。
+        """
+        result = np.zeros(self.mask.shape, dtype=bool)
+        region = shapely.make_valid(Polygon(self.projection.to_local(np.asarray(polygon_coords, dtype=float))))
+        for part in shapely.get_parts(region):
+            if isinstance(part, Polygon):
+                result |= self._region_mask(part, self.window, self.mask.shape)
+        result &= self.mask
+
+        jj, ii = np.nonzero(result)
+        if len(ii):
+            boxes = self._cell_boxes(ii + self.window[0], jj + self.window[1])
+            shapely.prepare(region)
+            result[jj, ii] = shapely.intersects(region, boxes) & ~shapely.touches(region, boxes)
+        return result
+
+    def panel_id(self, row: int, col: int) -> Optional[int]:
+        """セルのパネルが layout_arrays の何番目か（外したセルなら None）"""
+        placed = self.placed
+        if not placed[row, col]:
+            return None
+        return int(np.count_nonzero(placed.ravel()[:row * placed.shape[1] + col]))
+
+    def describe_cell(self, row: int, col: int) -> Dict:
+        """セルのパネル情報（id は外したセルなら None）"""
+        arrays = self._cell_arrays(np.array([col]), np.array([row]))
+        width, height = self.layout.orientation_sizes_cm()[ORIENTATIONS.index(self.candidate.orientation)]
+        return {
+            'id': self.panel_id(row, col),
+            'cell': self.cell_index(row, col),
+            'enabled': not self.disabled[row, col],
+            'center': arrays['centers'][0].tolist(),
+            'corners': arrays['corners'][0].tolist(),
+            'orientation': self.candidate.orientation,
+            'width_cm': width,
+            'height_cm': height
+        }
+
+    def cell_index(self, row: int, col: int) -> List[int]:
+        """window 上の位置をグリッドのセル番号 [i, j] に変換（編集を重ねても変わらない）"""
+        return [int(col) + self.window[0], int(row) + self.window[1]]
+
+    def cell_position(self, i: int, j: int) -> Optional[Tuple[int, int]]:
+        """グリッドのセル番号 [i, j] を window 上の位置 (行, 列) に変換（範囲外なら None）"""
+        row, col = j - self.window[1], i - self.window[0]
+        if not (0 <= row < self.mask.shape[0] and 0 <= col < self.mask.shape[1]):
+            return None
+        return row, col
+
+    def _steps(self) -> Tuple[float, float]:
+        return self.candidate.w + self.layout.spacing, self.candidate.h + self.layout.spacing
+
+    def _cell_window(self, bounds: Tuple[float, float, float, float]
+                     ) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        """範囲に掛かる可能性のある全セルを覆うセル番号の範囲 ((i0, j0), (行数, 列数))"""
+        minx, miny, maxx, maxy = bounds
+        step_x, step_y = self._steps()
+        i0 = math.floor((minx - self.candidate.w - self.frame[0]) / step_x)
+        j0 = math.floor((miny - self.candidate.h - self.frame[1]) / step_y)
+        i1 = math.ceil((maxx - self.frame[0]) / step_x)
+        j1 = math.ceil((maxy - self.frame[1]) / step_y)
+        return (i0, j0), (j1 - j0 + 1, i1 - i0 + 1)
+
+    def _region_mask(self, region: Polygon, window: Tuple[int, int], shape: Tuple[int, int]) -> np.ndarray:
+        """
+        領域（単一のポリゴン）に掛かるセルを True にした window 上の bool 配列
+        
+        セルの行ごとに、行の高さの帯と領域の交差部分の x 範囲を求め、その範囲に掛かるセルを選ぶ。
+        頂点の移動で生じる辺に沿った細長い差分領域でも、差分の近くのセルだけが選ばれる。
+        """
+        result = np.zeros(shape, dtype=bool)
+        if shapely.is_empty(region):
+            return result
+        
+        step_x, step_y = self._steps()
+        w, h = self.candidate.w, self.candidate.h
+        minx, miny, maxx, maxy = region.bounds
+        rows = np.arange(max(math.floor((miny - h - self.frame[1]) / step_y), window[1]),
+                         min(math.ceil((maxy - self.frame[1]) / step_y), window[1] + shape[0] - 1) + 1)
+        if len(rows) == 0:
+            return result
+        
+        ys = self.frame[1] + rows * step_y
+        pieces = shapely.intersection(region, shapely.box(minx - 1, ys, maxx + 1, ys + h))
+        # 帯の中で交差部分が複数に分かれる場合（頂点を挟む2辺など）は部分ごとに範囲を取る
+        parts, index = shapely.get_parts(pieces, return_index=True)
+        bounds = shapely.bounds(parts)
+        # 交差部分の端がセルの端と一致する場合も含めるよう、わずかに広げて判定する
+        eps = ROTATION_TOLERANCE_M
+        for row, (left, _, right, _) in zip(rows[index] - window[1], bounds):
+            if np.isnan(left):
+                continue
+            c0 = max(math.floor((left - eps - w - self.frame[0]) / step_x) - window[0], 0)
+            c1 = min(math.ceil((right + eps - self.frame[0]) / step_x) - window[0] + 1, shape[1])
+            if c0 < c1:
+                result[row, c0:c1] = True
+        return result
+    
+    def _carry_over(self, values: np.ndarray, window: Tuple[int, int], shape: Tuple[int, int],
+                    fill) -> np.ndarray:
+        """現在の window 上の配列を新しい window に写す（範囲外のセルは fill）"""
+        result = np.full(shape, fill, dtype=values.dtype)
+        old_rows, old_cols = values.shape
+        dr, dc = self.window[1] - window[1], self.window[0] - window[0]
+        r0, c0 = max(dr, 0), max(dc, 0)
+        r1, c1 = min(dr + old_rows, shape[0]), min(dc + old_cols, shape[1])
+        if r0 < r1 and c0 < c1:
+            result[r0:r1, c0:c1] = values[r0 - dr:r1 - dr, c0 - dc:c1 - dc]
+        return result
+    
+    def _test_cells(self, roof_polygon: Polygon, ii: np.ndarray, jj: np.ndarray) -> np.ndarray:
+        """セル番号の配列について、セルが屋根に収まるかをまとめて判定"""
+        result = np.empty(len(ii), dtype=bool)
+        chunk = self.layout.max_cells_per_chunk
+        for start in range(0, len(ii), chunk):
+            boxes = self._cell_boxes(ii[start:start + chunk], jj[start:start + chunk])
+            result[start:start + chunk] = self.layout._cells_within(roof_polygon, boxes)
+        return result
+
+    def _cell_boxes(self, ii: np.ndarray, jj: np.ndarray) -> np.ndarray:
+        """セル番号の配列から判定用のパネルの矩形（ローカル座標、CELL_TOLERANCE_M だけ縮める）の配列を作成"""
+        step_x, step_y = self._steps()
+        x = self.frame[0] + ii * step_x
+        y = self.frame[1] + jj * step_y
+        eps = CELL_TOLERANCE_M
+        return shapely.box(x + eps, y + eps, x + self.candidate.w - eps, y + self.candidate.h - eps)
+
+
+class LayoutSessionStore:
+    def __init__(self, max_bytes: int = 128 * 1024 * 1024, ttl_seconds: float = 1800):
+        """
+        レイアウトトークンとセッションの対応表
+
+        セッションが保持する配列の合計（セッション間で共有する配列は1回だけ数える）が max_bytes 以下に
+        なるよう LRU で追い出し、最後の参照から ttl_seconds 経過したものは無効とする。
+        最後に保存したセッションは max_bytes を超えていても保持する。
+
+        Args:
+            max_bytes: 保持する配列の合計バイト数の上限
+            ttl_seconds: 有効期間（秒）
+        """
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: 'OrderedDict[str, Tuple[float, LayoutSession]]' = OrderedDict()
+        # id(配列のまとまり) -> [まとまり, 参照しているセッション数, バイト数]
+        self._blocks: Dict[int, list] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, session: LayoutSession) -> str:
+        """セッションを保存し、新しいトークンを返す（保存前に緯度経度配列を用意する）"""
+        session.materialize()
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._entries[token] = (time.monotonic(), session)
+            self._track(session, 1)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._track(self._entries.popitem(last=False)[1][1], -1)
+        return token
+
+    def get(self, token: str) -> Optional[LayoutSession]:
+        """トークンに対応するセッションを返す。無い・期限切れなら None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            if now - entry[0] > self.ttl_seconds:
+                del self._entries[token]
+                self._track(entry[1], -1)
+                return None
+            self._entries[token] = (now, entry[1])
+            self._entries.move_to_end(token)
+            return entry[1]
+
+    def _track(self, session: LayoutSession, delta: int):
+        """セッションの配列の参照数を増減し、合計バイト数を更新（ロック取得済みで呼ぶ）"""
+        for block, nbytes in session.memory_blocks():
+            entry = self._blocks.get(id(block))
+            if entry is None:
+                entry = self._blocks[id(block)] = [block, 0, nbytes]
+                self._bytes += nbytes
+            entry[1] += delta
+            if entry[1] == 0:
+                del self._blocks[id(block)]
+                self._bytes -= entry[2]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'size': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
+
+
+# プロセス内で共有するトークンストア
+layout_sessions = LayoutSessionStore(
+    max_bytes=int(os.environ.get('LAYOUT_SESSION_MAX_BYTES', 128 * 1024 * 1024)),
+    ttl_seconds=float(os.environ.get('LAYOUT_SESSION_TTL', 1800))
+)
@@ -0,0 +1,262 @@
+"""
+Instrumentation
+処理段階ごとの計測（Server-Timing ヘッダ）、Prometheus 形式のメトリクス、リクエスト単位のプロファイル
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+# レイテンシのヒストグラムのバケット境界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# メトリクス名 → (種類, 説明, ラベル名)
+METRICS = {
+    'solar_http_request_duration_seconds': ('histogram', 'Request latency per endpoint',
+                                            ('endpoint', 'method', 'status')),
+    'solar_stage_duration_seconds': ('histogram', 'Time spent in each processing stage', ('stage',)),
+    'solar_layout_cells_tested_total': ('counter', 'Candidate grid cells tested against the roof polygon', ()),
+    'solar_layout_panels_placed_total': ('counter', 'Panels placed by layout calculations', ()),
+}
+
+# ?profile=1 を受け付けるか（本番では無効のまま。ENABLE_PROFILER=1 の環境でのみ有効）
+PROFILER_ENABLED = os.environ.get('ENABLE_PROFILER', '').lower() in ('1', 'true', 'yes')
+
+# プロファイル結果に表示する関数の数
+PROFILE_TOP_FUNCTIONS = 40
+
+
+class Metrics:
+    def __init__(self, definitions: Dict[str, Tuple[str, str, Tuple[str, ...]]],
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        """
+        プロセス内のカウンタ・ヒストグラム
+
+        gunicorn の複数スレッドから更新されるため、全操作をロックで保護する。
+        値はプロセスごとに持つ（ワーカープロセスの子プロセス内での計測は含まれない）。
+
+        Args:
+            definitions: メトリクス名 → (種類 'counter' / 'histogram', 説明, ラベル名)
+            buckets: ヒストグラムのバケット境界（秒、昇順）
+        """
+        self.definitions = definitions
+        self.buckets = tuple(buckets)
+        self._counters: Dict[Tuple[str, Tuple[str, ...]], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple[str, ...]], list] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], Dict[str, float]]]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, self._label_values(name, labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, self._label_values(name, labels))
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                # [バケットごとの件数..., 合計, 件数]
+                entry = self._histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += seconds
+            entry[-1] += 1
+
+    def register_gauges(self, prefix: str, help_text: str, collect: Callable[[], Dict[str, float]]):
+        """
+        出力時に collect() の数値項目を {prefix}_{項目名} のゲージとして出す
+
+        キャッシュの stats() のような既存の統計をそのまま公開するのに使う。
+        """
+        self._gauges[prefix] = (help_text, collect)
+
+    def render(self) -> str:
+        """Prometheus のテキスト形式（version 0.0.4）で出力"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(entry) for key, entry in self._histograms.items()}
+
+        lines = []
+        for name, (kind, help_text, label_names) in self.definitions.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            if kind == 'counter':
+                for (metric, values), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_labels(label_names, values)} {_number(value)}')
+                continue
+            for (metric, values), entry in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry):
+                    cumulative += count
+                    le = _labels(label_names + ('le',), values + (_number(bound),))
+                    lines.append(f'{name}_bucket{le} {cumulative}')
+                lines.append(f'{name}_bucket{_labels(label_names + ("le",), values + ("+Inf",))} {entry[-1]}')
+                lines.append(f'{name}_sum{_labels(label_names, values)} {_number(entry[-2])}')
+                lines.append(f'{name}_count{_labels(label_names, values)} {entry[-1]}')
+
+        for prefix, (help_text, collect) in self._gauges.items():
+            for field, value in collect().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines += [f'# HELP {prefix}_{field} {help_text}: {field}',
+                              f'# TYPE {prefix}_{field} gauge',
+                              f'{prefix}_{field} {_number(value)}']
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """全カウンタ・ヒストグラムを消去"""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def _label_values(self, name: str, labels: Dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(label, '')) for label in self.definitions[name][2])
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, escaped)) + '}'
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class RequestTimings:
+    """1リクエスト中の段階ごとの所要時間（合計）とカウンタ"""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, float] = {}
+
+    def server_timing(self, total_seconds: float) -> str:
+        """Server-Timing ヘッダの値（dur はミリ秒）"""
+        entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.stages.items()]
+        entries += [f'{name};desc="{_number(value)}"' for name, value in self.counters.items()]
+        entries.append(f'total;dur={total_seconds * 1000:.1f}')
+        return ', '.join(entries)
+
+
+metrics = Metrics(METRICS)
+
+# 処理中のリクエストの計測値（リクエスト外・子プロセスでは None）
+_current_timings: ContextVar[Optional[RequestTimings]] = ContextVar('request_timings', default=None)
+
+# cProfile はプロセス内で同時に1つしか有効にできない
+_profiler_lock = threading.Lock()
+
+
+@contextmanager
+def stage(name: str):
+    """
+    with ブロックの所要時間を段階 name として記録
+
+    プロセス全体のヒストグラム（solar_stage_duration_seconds）に加え、リクエスト処理中なら
+    Server-Timing に出す値にも加算する（同じ段階を複数回通った場合は合計）。
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe('solar_stage_duration_seconds', elapsed, stage=name)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.stages[name] = timings.stages.get(name, 0.0) + elapsed
+
+
+def timed(name: str):
+    """関数全体を段階 name として計測するデコレータ"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, value: float = 1):
+    """カウンタ solar_{name}_total に加算（リクエスト処理中なら Server-Timing にも出す）"""
+    metrics.inc(f'solar_{name}_total', value)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.counters[name] = timings.counters.get(name, 0) + value
+
+
+def init_app(app):
+    """
+    Flask アプリにリクエスト単位の計測を組み込む
+
+    - 全レスポンスに Server-Timing ヘッダ（段階ごとの所要時間・カウンタ・total）を付ける
+    - エンドポイントごとのレイテンシを solar_http_request_duration_seconds に記録する
+    - ENABLE_PROFILER が有効なら ?profile=1 のリクエストを cProfile で計測し、
+      本来のレスポンスの代わりに上位関数の集計（text/plain）を返す
+
+    ストリーミングのレスポンスは本文の生成前までの時間になる。
+    """
+    # 配置計算のワーカープロセスでは Flask を読み込まないよう、ここで import する
+    from flask import g, request
+
+    @app.before_request
+    def start_timing():
+        g.instrumentation_start = time.perf_counter()
+        g.instrumentation_token = _current_timings.set(RequestTimings())
+        g.profiler = None
+        if PROFILER_ENABLED and request.args.get('profile') == '1' and _profiler_lock.acquire(blocking=False):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def finish_timing(response):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            _profiler_lock.release()
+            response = _profile_response(profiler, f'{request.method} {request.path} -> {response.status}')
+
+        timings = _current_timings.get()
+        start = g.get('instrumentation_start')
+        if timings is None or start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('solar_http_request_duration_seconds', elapsed,
+                        endpoint=endpoint, method=request.method, status=response.status_code)
+        response.headers['Server-Timing'] = timings.server_timing(elapsed)
+        return response
+
+    @app.teardown_request
+    def reset_timing(exc):
+        # 例外で after_request を通らなかった場合もプロファイラを止める
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            _profiler_lock.release()
+        token = g.pop('instrumentation_token', None)
+        if token is not None:
+            _current_timings.reset(token)
+
+
+def _profile_response(profiler: cProfile.Profile, title: str):
+    """プロファイル結果（累積時間の上位関数）を text/plain のレスポンスにする"""
+    from flask import Response
+
+    output = io.StringIO()
+    output.write(f'# {title}\n')
+    stats = pstats.Stats(profiler, stream=output)
+    stats.strip_dirs().sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+    return Response(output.getvalue(), mimetype='text/plain')
@@ -0,0 +1,151 @@
+"""
+Irradiance Cache
+量子化した緯度経度をキーとする日射量プロファイルの LRU キャッシュ
+"""
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+# 都道府県庁所在地（事前計算用）
+PREFECTURE_CAPITALS: Dict[str, Tuple[float, float]] = {
+    'Sapporo': (43.0642, 141.3469), 'Aomori': (40.8244, 140.7400), 'Morioka': (39.7036, 141.1527),
+    'Sendai': (38.2688, 140.8721), 'Akita': (39.7186, 140.1024), 'Yamagata': (38.2404, 140.3633),
+    'Fukushima': (37.7503, 140.4676), 'Mito': (36.3418, 140.4468), 'Utsunomiya': (36.5657, 139.8836),
+    'Maebashi': (36.3911, 139.0608), 'Saitama': (35.8569, 139.6489), 'Chiba': (35.6047, 140.1233),
+    'Tokyo': (35.6895, 139.6917), 'Yokohama': (35.4478, 139.6425), 'Niigata': (37.9026, 139.0232),
+    'Toyama': (36.6953, 137.2113), 'Kanazawa': (36.5947, 136.6256), 'Fukui': (36.0652, 136.2216),
+    'Kofu': (35.6642, 138.5684), 'Nagano': (36.6513, 138.1810), 'Gifu': (35.3912, 136.7223),
+    'Shizuoka': (34.9769, 138.3831), 'Nagoya': (35.1802, 136.9066), 'Tsu': (34.7303, 136.5086),
+    'Otsu': (35.0045, 135.8686), 'Kyoto': (35.0214, 135.7556), 'Osaka': (34.6863, 135.5200),
+    'Kobe': (34.6913, 135.1830), 'Nara': (34.6851, 135.8329), 'Wakayama': (34.2260, 135.1675),
+    'Tottori': (35.5039, 134.2377), 'Matsue': (35.4723, 133.0505), 'Okayama': (34.6618, 133.9350),
+    'Hiroshima': (34.3963, 132.4596), 'Yamaguchi': (34.1859, 131.4714), 'Tokushima': (34.0658, 134.5593),
+    'Takamatsu': (34.3401, 134.0434), 'Matsuyama': (33.8417, 132.7661), 'Kochi': (33.5597, 133.5311),
+    'Fukuoka': (33.6064, 130.4181), 'Saga': (33.2494, 130.2988), 'Nagasaki': (32.7448, 129.8737),
+    'Kumamoto': (32.7898, 130.7417), 'Oita': (33.2382, 131.6126), 'Miyazaki': (31.9111, 131.4239),
+    'Kagoshima': (31.5602, 130.5581), 'Naha': (26.2124, 127.6809),
+}
+
+
+class IrradianceCache:
+    def __init__(self, grid_deg: float = 0.05, max_entries: int = 1024,
+                 max_bytes: int = 128 * 1024 * 1024, orientation_deg: float = 0.5):
+        """
+        日射量プロファイルのキャッシュ
+        
+        緯度経度を grid_deg 刻み、傾斜角・方位角を orientation_deg 刻みに量子化してキーとし、
+        最大 max_entries 件かつ合計 max_bytes 以下を LRU で保持する。
+        時間別プロファイル（1件あたり 1時間値で約 0.5 MB、15分値で約 2 MB）が件数の上限まで
+        溜まらないよう、値のサイズで追い出す。1件で max_bytes を超える値は保持しない。
+        gunicorn の複数スレッドから共有されるため、全操作をロックで保護する。
+        同じキーの計算が同時に要求された場合は、最初の1件だけが計算し他は結果を待つ。
+        
+        Args:
+            grid_deg: 緯度経度の量子化の刻み（度）
+            max_entries: 保持する最大件数
+            max_bytes: 保持する値の合計バイト数の上限
+            orientation_deg: 傾斜角・方位角の量子化の刻み（度）
+        """
+        self.grid_deg = grid_deg
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.orientation_deg = orientation_deg
+        # key -> (値, バイト数)
+        self._entries: 'OrderedDict[Hashable, Tuple[Any, int]]' = OrderedDict()
+        self._bytes = 0
+        self._in_flight: Dict[Hashable, threading.Event] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def quantize(self, latitude: float, longitude: float) -> Tuple[float, float]:
+        """緯度経度をグリッドの中心に丸める"""
+        step = self.grid_deg
+        return (round(round(latitude / step) * step, 6), round(round(longitude / step) * step, 6))
+    
+    def quantize_orientation(self, tilt: float, azimuth: float) -> Tuple[float, float]:
+        """傾斜角・方位角を orientation_deg 刻みに丸める"""
+        step = self.orientation_deg
+        return (round(round(float(tilt) / step) * step, 6), round(round(float(azimuth) / step) * step, 6))
+    
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        キャッシュ済みの値を返す。無ければ compute() の結果を保存して返す
+        
+        返される値は全スレッドで共有されるため、呼び出し側で変更してはならない。
+        """
+        while True:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][0]
+                
+                event = self._in_flight.get(key)
+                if event is None:
+                    self.misses += 1
+                    event = threading.Event()
+                    self._in_flight[key] = event
+                    break
+            
+            # 他スレッドが計算中なので完了を待って再確認する
+            event.wait()
+        
+        try:
+            value = compute()
+            nbytes = self._value_bytes(value)
+            with self._lock:
+                if nbytes <= self.max_bytes:
+                    self._entries[key] = (value, nbytes)
+                    self._bytes += nbytes
+                    while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                        self._bytes -= self._entries.popitem(last=False)[1][1]
+            return value
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            event.set()
+    
+    @staticmethod
+    def _value_bytes(value: Any) -> int:
+        """値のおおよそのメモリ量（DataFrame・ndarray はデータ部分のバイト数）"""
+        if hasattr(value, 'memory_usage'):
+            return int(value.memory_usage(deep=True).sum())
+        if hasattr(value, 'nbytes'):
+            return int(value.nbytes)
+        return sys.getsizeof(value)
+    
+    def stats(self) -> Dict:
+        """ヒット率などの統計情報"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'grid_deg': self.grid_deg
+            }
+    
+    def clear(self):
+        """全エントリと統計を消去"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+# プロセス内で共有するキャッシュ
+irradiance_cache = IrradianceCache(
+    grid_deg=float(os.environ.get('IRRADIANCE_CACHE_GRID_DEG', 0.05)),
+    max_entries=int(os.environ.get('IRRADIANCE_CACHE_SIZE', 1024)),
+    max_bytes=int(os.environ.get('IRRADIANCE_CACHE_MAX_BYTES', 128 * 1024 * 1024)),
+    orientation_deg=float(os.environ.get('IRRADIANCE_CACHE_ORIENTATION_DEG', 0.5))
+)
@@ -0,0 +1,222 @@
+"""
+Layout Cache
+入力パラメータの正規化ハッシュをキーとするパネル配置結果のキャッシュ
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# 配置アルゴリズムや発電量計算を変更したら上げる（古いディスクキャッシュを無効化）
+CACHE_VERSION = 1
+
+# キーを作るときの座標の丸め桁数（1e-7 度 ≒ 1 cm）
+KEY_COORD_DIGITS = 7
+
+LAYOUT_ARRAY_KEYS = ('centers', 'corners', 'orientation')
+
+
+def make_cache_key(params: Dict) -> str:
+    """
+    配置計算の入力から正規化したハッシュキーを作る
+
+    多角形と地点の座標は KEY_COORD_DIGITS 桁に丸め、数値は float に揃えてから
+    キー順を固定した JSON にして SHA-256 を取る。
+
+    Args:
+        params: polygon, panel_width, panel_height, offset, location などの入力
+
+    Returns:
+        16進のハッシュ文字列
+    """
+    canonical = {'version': CACHE_VERSION}
+    for name, value in params.items():
+        if name == 'polygon':
+            value = [[round(float(lat), KEY_COORD_DIGITS), round(float(lng), KEY_COORD_DIGITS)]
+                     for lat, lng in value]
+        elif name == 'location':
+            value = [round(float(value.get('lat', 35.6762)), KEY_COORD_DIGITS),
+                     round(float(value.get('lng', 139.6503)), KEY_COORD_DIGITS)]
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = float(value)
+        canonical[name] = value
+
+    payload = json.dumps(canonical, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LayoutCache:
+    def __init__(self, max_entries: int = 256, disk_dir: Optional[str] = None,
+                 max_disk_entries: int = 10000, max_bytes: int = 256 * 1024 * 1024):
+        """
+        パネル配置結果のキャッシュ
+
+        メモリ上の LRU（最大 max_entries 件かつ推定サイズの合計が max_bytes 以下）と、
+        disk_dir を指定した場合のディスク層（キーごとの圧縮 .npz ファイル）の2段構成。
+        ディスク層はワーカーの再起動後も残り、メモリに無いときに参照される。
+        1件で max_bytes を超える結果はメモリ層に置かない（ディスク層には書き出す）。
+
+        Args:
+            max_entries: メモリに保持する最大件数
+            disk_dir: ディスク層のディレクトリ（None なら無効）
+            max_disk_entries: ディスク層に保持する最大ファイル数
+            max_bytes: メモリに保持する推定サイズの合計の上限
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        # key -> (値, 推定バイト数)
+        self._entries: 'OrderedDict[str, Tuple[Tuple[Dict, Dict], int]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key: str) -> Optional[Tuple[Dict, Dict]]:
+        """
+        キャッシュ済みの (レスポンス, 配置配列) を返す。無ければ None
+
+        返される値は全スレッドで共有されるため、呼び出し側で変更してはならない。
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, value)
+        return value
+
+    def put(self, key: str, response: Dict, layout_arrays: Dict):
+        """配置結果を保存（ディスク層が有効ならファイルにも書き出す）"""
+        value = (response, layout_arrays)
+        with self._lock:
+            self._store(key, value)
+        self._write_disk(key, value)
+
+    def _store(self, key: str, value: Tuple[Dict, Dict]):
+        """メモリ層に追加して古いエントリを追い出す（ロック取得済みで呼ぶ）"""
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        nbytes = self._estimate_bytes(value)
+        if nbytes > self.max_bytes:
+            return
+        self._entries[key] = (value, nbytes)
+        self._bytes += nbytes
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._bytes -= self._entries.popitem(last=False)[1][1]
+
+    @staticmethod
+    def _estimate_bytes(value: Tuple[Dict, Dict]) -> int:
+        """エントリのおおよそのメモリ量（配置配列のバイト数 + レスポンスの JSON 長）"""
+        response, layout_arrays = value
+        nbytes = sum(np.asarray(values).nbytes for values in layout_arrays.values())
+        return nbytes + len(json.dumps(response, ensure_ascii=False, default=str))
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f'{key}.npz')
+
+    def _read_disk(self, key: str) -> Optional[Tuple[Dict, Dict]]:
+        """ディスク層から読み込む。無い・壊れている場合は None"""
+        if not self.disk_dir:
+            return None
+
+        try:
+            with np.load(self._disk_path(key), allow_pickle=False) as data:
+                response = json.loads(str(data['response']))
+                layout_arrays = {name: data[name] for name in LAYOUT_ARRAY_KEYS}
+        except (OSError, KeyError, ValueError):
+            return None
+        return response, layout_arrays
+
+    def _write_disk(self, key: str, value: Tuple[Dict, Dict]):
+        """
+        ディスク層に書き出す
+
+        書きかけのファイルを他ワーカーが読まないよう、一時ファイルに書いてから置き換える。
+        """
+        if not self.disk_dir:
+            return
+
+        response, layout_arrays = value
+        path = self._disk_path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, response=np.array(json.dumps(response, ensure_ascii=False)),
+                                    **{name: layout_arrays[name] for name in LAYOUT_ARRAY_KEYS})
+            os.replace(tmp_path, path)
+        except OSError:
+            # ディスク層は補助的なものなので書き込み失敗は無視する
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            self._disk_writes += 1
+            prune = self._disk_writes % 64 == 0
+        if prune:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """ディスク層のファイル数が上限を超えたら古いものから削除"""
+        try:
+            entries = [entry for entry in os.scandir(self.disk_dir) if entry.name.endswith('.npz')]
+            if len(entries) <= self.max_disk_entries:
+                return
+            entries.sort(key=lambda entry: entry.stat().st_mtime)
+            for entry in entries[:len(entries) - self.max_disk_entries]:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+    def stats(self) -> Dict:
+        """ヒット率などの統計情報"""
+        with self._lock:
+            total = self.hits + self.disk_hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.disk_hits) / total, 3) if total else 0.0,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'disk_enabled': bool(self.disk_dir)
+            }
+
+    def clear(self):
+        """メモリ層の全エントリと統計を消去（ディスク層は残す）"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.disk_hits = 0
+            self.misses = 0
+
+
+# プロセス内で共有するキャッシュ（LAYOUT_CACHE_DIR を設定するとディスク層を有効化）
+layout_cache = LayoutCache(
+    max_entries=int(os.environ.get('LAYOUT_CACHE_SIZE', 256)),
+    disk_dir=os.environ.get('LAYOUT_CACHE_DIR') or None,
+    max_disk_entries=int(os.environ.get('LAYOUT_CACHE_DISK_SIZE', 10000)),
+    max_bytes=int(os.environ.get('LAYOUT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+)
@@ -0,0 +1,121 @@
+"""
+Layout Response Format
+パネル配置結果のコンパクトな直列化（列指向 JSON / float32 バイナリ）
+"""
+
+import base64
+import json
+import struct
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from panel_layout import ORIENTATIONS
+
+# レスポンス形式（'objects' は従来のパネル辞書リスト）
+RESPONSE_FORMATS = ('objects', 'columnar', 'binary')
+
+# 列指向 JSON で座標差分を整数化する単位（度）。1e-8 度 ≒ 1 mm
+COLUMNAR_SCALE = 1e-8
+
+# application/octet-stream のマジックナンバーとバージョン
+BINARY_MAGIC = b'SPL1'
+
+
+def encode_columnar(layout: Dict[str, np.ndarray], sizes_cm: List[Tuple[float, float]]) -> Dict:
+    """
+    配列形式のレイアウトを列指向 JSON に変換
+    
+    4隅の座標は原点（全隅の南西端）からの差分を COLUMNAR_SCALE 単位の整数で
+    [lat0, lng0, lat1, lng1, ...] と平坦に並べる（1パネル 8 要素）。
+    中心は4隅の平均で復元できるため含めない。
+    """
+    origin, deltas = _corner_deltas(layout)
+    return {
+        **_header(layout, origin, sizes_cm),
+        'encoding': 'int',
+        'scale': COLUMNAR_SCALE,
+        'corners': np.rint(deltas / COLUMNAR_SCALE).astype(np.int64).ravel().tolist(),
+        'orientation': layout['orientation'].tolist()
+    }
+
+
+def encode_binary(layout: Dict[str, np.ndarray], sizes_cm: List[Tuple[float, float]]) -> Dict:
+    """
+    配列形式のレイアウトを float32 バイナリ（base64）入りの JSON に変換
+    
+    corners_b64 は原点からの差分（度）をリトルエンディアン float32 で並べたもの、
+    orientation_b64 は向きコードの uint8 列。
+    """
+    origin, deltas = _corner_deltas(layout)
+    return {
+        **_header(layout, origin, sizes_cm),
+        'encoding': 'float32',
+        'corners_b64': base64.b64encode(deltas.astype('<f4').tobytes()).decode('ascii'),
+        'orientation_b64': base64.b64encode(layout['orientation'].astype(np.uint8).tobytes()).decode('ascii')
+    }
+
+
+def pack_octet_stream(meta: Dict, layout: Dict[str, np.ndarray],
+                      sizes_cm: List[Tuple[float, float]]) -> bytes:
+    """
+    レスポンス全体を application/octet-stream 用のバイト列にまとめる
+    
+    構成: マジック 'SPL1' | JSON 長 (uint32 LE) | JSON（UTF-8、4バイト境界までスペース詰め）
+          | 4隅の差分 float32 LE (N × 8) | 向きコード uint8 (N)
+    JSON には meta と、binary 形式の panels ヘッダ（origin など、座標本体を除く）が入る。
+    """
+    origin, deltas = _corner_deltas(layout)
+    header = json.dumps({**meta, 'panels': {**_header(layout, origin, sizes_cm), 'encoding': 'float32'}},
+                        ensure_ascii=False).encode('utf-8')
+    header += b' ' * (-len(header) % 4)
+    
+    return b''.join([
+        BINARY_MAGIC,
+        struct.pack('<I', len(header)),
+        header,
+        deltas.astype('<f4').tobytes(),
+        layout['orientation'].astype(np.uint8).tobytes()
+    ])
+
+
+def decode_panel_corners(panels) -> np.ndarray:
+    """
+    パネル配置（パネル辞書のリスト、または列指向・binary 形式）から4隅の座標を取り出す
+    
+    Returns:
+        (N, 4, 2) の [lat, lng]
+    """
+    if isinstance(panels, dict):
+        origin = np.asarray(panels.get('origin', [0.0, 0.0]), dtype=float)
+        if panels.get('encoding') == 'float32':
+            deltas = np.frombuffer(base64.b64decode(panels.get('corners_b64', '')), dtype='<f4').astype(float)
+        else:
+            deltas = np.asarray(panels.get('corners', []), dtype=float) * panels.get('scale', COLUMNAR_SCALE)
+        return deltas.reshape(-1, 4, 2) + origin
+    
+    corners = [panel['corners'] for panel in panels or [] if panel.get('corners')]
+    if not corners:
+        return np.empty((0, 4, 2))
+    return np.asarray(corners, dtype=float).reshape(-1, 4, 2)
+
+
+def _header(layout: Dict[str, np.ndarray], origin: List[float],
+            sizes_cm: List[Tuple[float, float]]) -> Dict:
+    """各形式共通のヘッダ"""
+    return {
+        'format': 'columnar',
+        'count': int(len(layout['orientation'])),
+        'origin': origin,
+        'orientations': list(ORIENTATIONS),
+        'sizes_cm': [list(size) for size in sizes_cm]
+    }
+
+
+def _corner_deltas(layout: Dict[str, np.ndarray]) -> Tuple[List[float], np.ndarray]:
+    """4隅の座標を原点（南西端）と差分 (N, 8) に分解"""
+    corners = layout['corners'].reshape(-1, 8)
+    if len(corners) == 0:
+        return [0.0, 0.0], corners
+    origin = layout['corners'].reshape(-1, 2).min(axis=0)
+    return origin.tolist(), corners - np.tile(origin, 4)
@@ -3,7 +3,7 @@ Solar Panel Layout Simulation API
 Cloud Run backend for solar panel placement and power generation simulation
 """
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 import json
 import os
@@ -11,34 +11,128 @@ from datetime import datetime
 import base64
 from io import BytesIO
 
-from panel_layout import PanelLayout
-from solar_calc import SolarCalculator
-from pdf_generator import PDFGenerator
+import numpy as np
+
+from panel_layout import PanelLayout, LAYOUT_MODES, parse_keepouts
+from layout_format import RESPONSE_FORMATS, encode_columnar, encode_binary, pack_octet_stream
+from solar_calc import SolarCalculator, IRRADIANCE_MODELS
+from financial import ROI_DEFAULTS, MAX_YEARS, evaluate_grid, to_list
+from irradiance_cache import irradiance_cache
+from layout_cache import layout_cache, make_cache_key
+from incremental_layout import LayoutSession, INCREMENTAL_MODES, layout_sessions
+from batch import resolve_roofs, iter_batch_results, batch_slots
+from timeseries_export import resolve_systems, resolve_period, iter_export, EXPORT_FORMATS
+from shading import ShadingAnalysis, parse_obstacles, apply_shading
+from roof_faces import resolve_faces, calculate_faces
+from projection import LocalProjection
+from pdf_jobs import pdf_jobs, QueueFullError
+from admission import admit, layout_runner, LayoutRejected, LayoutBusy, OVER_BUDGET_POLICIES, LAYOUT_CELL_BUDGET
+import instrumentation
+import startup
+from instrumentation import metrics, stage
 
 app = Flask(__name__)
-CORS(app, origins='*')  # Bubble HTML埋め込みのためCORS許可
+CORS(app, origins='*', expose_headers=['ETag', 'Retry-After', 'Location', 'Server-Timing'])  # Bubble HTML埋め込みのためCORS許可
+
+# 全レスポンスに Server-Timing を付け、エンドポイントごとのレイテンシを /metrics に集計
+instrumentation.init_app(app)
+metrics.register_gauges('solar_irradiance_cache', 'Irradiance profile cache', irradiance_cache.stats)
+metrics.register_gauges('solar_layout_cache', 'Layout result cache', layout_cache.stats)
+metrics.register_gauges('solar_layout_sessions', 'Incremental layout sessions', layout_sessions.stats)
+metrics.register_gauges('solar_pdf_jobs', 'PDF job queue', pdf_jobs.stats)
+metrics.register_gauges('solar_layout_runner', 'Offloaded layout calculations', layout_runner.stats)
+metrics.register_gauges('solar_batches', 'Batch layout slots', batch_slots.stats)
+
+# STARTUP_WARMUP: 配置・日射量の処理を1回通してから受け付ける（--preload 時はマスターで実行し、
+# ワーカーは fork で結果を引き継ぐ）。都道府県庁所在地の日射量の事前計算（IRRADIANCE_WARMUP）は
+# スレッドで行うため、--preload 時は fork 後に gunicorn.conf.py の post_fork から開始する
+if startup.STARTUP_WARMUP:
+    startup.warm_up()
+if not startup.PRELOADED:
+    startup.start_background_tasks()
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """ヘルスチェック用エンドポイント"""
-    return jsonify({"status": "healthy", "timestamp": datetime.now().isoformat()})
+    return jsonify({
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "irradiance_cache": irradiance_cache.stats(),
+        "layout_cache": layout_cache.stats(),
+        "layout_sessions": layout_sessions.stats(),
+        "pdf_jobs": pdf_jobs.stats(),
+        "layout_runner": layout_runner.stats(),
+        "batches": batch_slots.stats(),
+        "startup": startup.stats()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 形式のメトリクス（エンドポイント・処理段階ごとのレイテンシ、カウンタ、キャッシュ統計）"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/calculate-panels', methods=['POST'])
 def calculate_panels():
     """
     屋根の多角形内にパネルを配置し、配置情報を返す
     
+    Query parameters:
+        format: 'objects'（既定、パネルごとの辞書）/ 'columnar'（整数差分の列指向 JSON）/
+                'binary'（float32 の base64。Accept: application/octet-stream なら生バイナリ）
+    
+    同じ入力の結果はキャッシュから返す。レスポンスの ETag を If-None-Match で送ると、
+    結果が変わらない場合は本文なしの 304 を返す。
+    
+    obstacles を指定すると、代表年の太陽位置ごとの影から各パネルの年間発電量を求め、
+    レスポンスの shading.panel_yield_kwh（panels と同じ順序）と発電量に反映する。
+    min_yield_ratio を指定すると、影なしに対する年間発電量の比がそれ未満のパネルを配置から除く。
+    
+    polygon の代わりに faces を指定すると、設置角度・方位・オフセットが異なる複数の屋根面を
+    並列に配置し、面ごとの向きに応じた時間別モデルの日射量で発電量を計算して合計する。
+    panels は全屋根面を連結したもので、faces[i].panel_range が屋根面 i の範囲 [start, end)。
+    
+    配置計算の候補セル数を屋根の外接矩形とパネル寸法から事前に見積もり、LAYOUT_CELL_BUDGET を
+    超える場合は over_budget に従って軽いモード（'search' の位相2分割 → 'grid'）に縮退するか 422 を返す。
+    計算は LAYOUT_DEADLINE_SECONDS で打ち切り、その時点の最良の配置を返す。実際に使ったモードと
+    打ち切りの有無はレスポンスの layout_status（complete / downgraded など）に入る。
+    大きな計算はプロセスプールで実行し、ワーカーと待ち行列が埋まっていれば 429 を返す。
+    
     Request body:
     {
         "polygon": [[lat, lng], ...],  # 屋根の多角形座標
         "panel_width": float,           # パネル幅 (cm)
         "panel_height": float,          # パネル高さ (cm)
         "offset": float,                # オフセット/離隔 (cm)
+        "layout_mode": string,          # 'grid'（既定）/ 'search' / 'rotated' / 'strips'
+        "phase_steps": int,             # 'search' / 'rotated' 時のグリッド位相の分割数（既定4）
+        "keepouts": [                   # 任意: 天窓・換気口・通路など、パネルを置かない区域
+            {"polygon": [[lat, lng], ...], "setback": float}  # setback は区域の周囲に空ける距離 (cm)
+        ],
+        "over_budget": string,          # 見積もりが予算超過時: 'downgrade'（既定）/ 'reject'
+        "irradiance_model": string,     # 'table'（既定）または 'hourly'（pvlib による時間別計算）
+        "tilt": float,                  # 設置角度（度、'hourly' 時のみ）
+        "azimuth": float,               # 設置方位（度、南=180、'hourly' 時のみ）
         "location": {
             "lat": float,
             "lng": float,
             "address": string
-        }
+        },
+        "obstacles": [                  # 任意: 周辺の建物・煙突など
+            {"polygon": [[lat, lng], ...], "height": float}  # height は屋根面からの高さ (m)
+        ],
+        "min_yield_ratio": float,       # 任意: 影なしに対する年間発電量の比の下限 (0〜1)
+        "faces": [                      # 任意: polygon の代わりに複数の屋根面を指定
+            {
+                "id": any,                      # 任意の識別子（省略時は index）
+                "polygon": [[lat, lng], ...],
+                "tilt": float,                  # 設置角度（度、省略時はトップレベルの値）
+                "azimuth": float,               # 設置方位（度、省略時はトップレベルの値）
+                "offset": float,                # オフセット (cm、省略時はトップレベルの値)
+                "layout_mode": string,          # 省略時はトップレベルの値
+                "phase_steps": int,
+                "keepouts": [...]               # 省略時はトップレベルの値
+            }
+        ]
     }
     """
     try:
@@ -50,47 +144,624 @@ def calculate_panels():
         panel_height = data.get('panel_height', 100)  # デフォルト100cm
         offset = data.get('offset', 10)  # デフォルト10cm
         location = data.get('location', {})
+        layout_mode = data.get('layout_mode', 'grid')
+        phase_steps = data.get('phase_steps', 4)
+        irradiance_model = data.get('irradiance_model', 'table')
+        over_budget = data.get('over_budget', 'downgrade')
+        
+        faces = None
+        if data.get('faces') is not None:
+            try:
+                faces = resolve_faces(data)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            if data.get('obstacles'):
+                return jsonify({"error": "obstacles cannot be combined with faces"}), 400
+        elif not polygon or len(polygon) < 3:
+            return jsonify({"error": "Invalid polygon. At least 3 points required."}), 400
+        
+        if layout_mode not in LAYOUT_MODES:
+            return jsonify({"error": f"Invalid layout_mode. Use one of: {', '.join(LAYOUT_MODES)}"}), 400
+        
+        if over_budget not in OVER_BUDGET_POLICIES:
+            return jsonify({"error": f"Invalid over_budget. Use one of: {', '.join(OVER_BUDGET_POLICIES)}"}), 400
+        
+        if irradiance_model not in IRRADIANCE_MODELS:
+            return jsonify({"error": f"Invalid irradiance_model. Use one of: {', '.join(IRRADIANCE_MODELS)}"}), 400
+        
+        response_format = request.args.get('format', 'objects')
+        if response_format not in RESPONSE_FORMATS:
+            return jsonify({"error": f"Invalid format. Use one of: {', '.join(RESPONSE_FORMATS)}"}), 400
+        
+        try:
+            obstacles = parse_obstacles(data.get('obstacles') or [])
+            keepouts = parse_keepouts(data.get('keepouts') or [])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        min_yield_ratio = data.get('min_yield_ratio')
+        if min_yield_ratio is not None and (not isinstance(min_yield_ratio, (int, float)) or not 0 <= min_yield_ratio <= 1):
+            return jsonify({"error": "min_yield_ratio must be a number between 0 and 1"}), 400
+        
+        # 入力が同じなら結果も同じなので、入力のハッシュをそのまま ETag にする
+        cache_key = make_cache_key({
+            "polygon": polygon,
+            "panel_width": panel_width,
+            "panel_height": panel_height,
+            "offset": offset,
+            "location": location,
+            "layout_mode": layout_mode,
+            "phase_steps": phase_steps,
+            "keepouts": keepouts,
+            "irradiance_model": irradiance_model,
+            "tilt": data.get('tilt'),
+            "azimuth": data.get('azimuth'),
+            "obstacles": obstacles,
+            "min_yield_ratio": min_yield_ratio,
+            "faces": faces,
+            "over_budget": over_budget
+        })
+        representation = _response_representation(response_format)
+        etag = f"{cache_key[:32]}-{representation}"
+        if request.if_none_match.contains(etag):
+            not_modified = Response(status=304)
+            not_modified.set_etag(etag)
+            return not_modified
+        
+        layout = PanelLayout(panel_width, panel_height, offset, keepouts)
+        cached = layout_cache.get(cache_key)
+        if cached is not None:
+            response, layout_arrays = cached
+            response = dict(response)
+        elif faces is not None:
+            # 複数の屋根面（面ごとに並列配置し、同じ向きの面は日射量を共有）。予算と deadline は全屋根面で共通
+            jobs = admit_faces(faces, over_budget)
+            face_layouts = layout_runner.run_many(jobs)
+            response, layout_arrays = calculate_faces(faces, [arrays for arrays, _ in face_layouts],
+                                                      location.get('lat', 35.6762),
+                                                      location.get('lng', 139.6503))
+            incomplete = [index for index, (_, complete) in enumerate(face_layouts) if not complete]
+            response["layout_status"] = {
+                "complete": not incomplete,
+                "incomplete_faces": incomplete,
+                "downgraded": [index for index, (_, _, admission) in enumerate(jobs) if admission.downgraded],
+                "estimated_cells": sum(admission.estimated_cells for _, _, admission in jobs),
+                "budget": LAYOUT_CELL_BUDGET
+            }
+            # 打ち切った結果は次のリクエストで計算し直せるようキャッシュしない
+            if not incomplete:
+                layout_cache.put(cache_key, dict(response), layout_arrays)
+            else:
+                etag = None
+        else:
+            # パネルレイアウト計算（見積もりで受け付け判定し、期限付きで実行）
+            admission = admit(layout, polygon, layout_mode, phase_steps, over_budget)
+            layout_arrays, complete = layout_runner.run(layout, polygon, admission)
+            solar_calc = SolarCalculator()
+            
+            # 障害物の影（発電量の低いパネルを除く）
+            shading = None
+            if obstacles:
+                hourly = solar_calc.get_hourly_profile(
+                    location.get('lat', 35.6762),
+                    location.get('lng', 139.6503),
+                    solar_calc.default_tilt if data.get('tilt') is None else data.get('tilt'),
+                    solar_calc.default_azimuth if data.get('azimuth') is None else data.get('azimuth')
+                )
+                analysis = ShadingAnalysis(obstacles, LocalProjection.for_polygon(polygon))
+                shading = analysis.evaluate(layout_arrays['corners'], hourly)
+                if min_yield_ratio is not None:
+                    keep = shading.yield_ratio() >= min_yield_ratio
+                    layout_arrays = {name: values[keep] for name, values in layout_arrays.items()}
+                    shading = shading.subset(keep)
+            panel_count = len(layout_arrays['orientation'])
+            
+            # 発電量計算
+            power_data = solar_calc.calculate_power(
+                location.get('lat', 35.6762),  # デフォルト東京
+                location.get('lng', 139.6503),
+                panel_count,
+                panel_width * panel_height / 10000,  # cm² to m²
+                model=irradiance_model,
+                tilt=data.get('tilt'),
+                azimuth=data.get('azimuth')
+            )
+            
+            response = {
+                "panel_count": panel_count,
+                "total_area": panel_count * (panel_width * panel_height / 10000),
+                "power_estimation": power_data,
+                "layout_bounds": layout.get_bounds(polygon)
+            }
+            if shading is not None:
+                response["shading"] = apply_shading(power_data, shading, len(obstacles))
+            response["layout_status"] = admission.status(complete)
+            # 打ち切った結果は次のリクエストで計算し直せるようキャッシュしない
+            if complete:
+                layout_cache.put(cache_key, dict(response), layout_arrays)
+            else:
+                etag = None
+        
+        result = _layout_response(response, layout, layout_arrays, representation)
+        if etag is not None:
+            result.set_etag(etag)
+        return result
+    
+    except LayoutRejected as e:
+        return jsonify({"error": str(e), "estimated_cells": e.estimated_cells, "budget": e.budget}), 422
+    except LayoutBusy as e:
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    except TimeoutError as e:
+        return jsonify({"error": str(e)}), 504
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def admit_faces(faces: list, policy: str) -> list:
+    """
+    全屋根面の候補セル数の合計で受け付け判定する
+    
+    屋根面ごとに予算の残りを上限として admit を適用する（超えれば LayoutRejected）。
+    
+    Returns:
+        LayoutRunner.run_many に渡す (PanelLayout, 屋根の多角形, Admission) のリスト
+    """
+    remaining = LAYOUT_CELL_BUDGET
+    jobs = []
+    for spec in faces:
+        layout = PanelLayout(spec['panel_width'], spec['panel_height'], spec['offset'], spec['keepouts'])
+        admission = admit(layout, spec['polygon'], spec['layout_mode'], spec['phase_steps'], policy,
+                          budget=remaining)
+        jobs.append((layout, spec['polygon'], admission))
+        remaining -= admission.estimated_cells
+    return jobs
+
+def _response_representation(response_format: str) -> str:
+    """?format と Accept ヘッダから返す形式を決める（binary かつ octet-stream 指定なら 'octet-stream'）"""
+    if response_format == 'binary':
+        accepted = request.accept_mimetypes.best_match(['application/json', 'application/octet-stream'])
+        if accepted == 'application/octet-stream':
+            return 'octet-stream'
+    return response_format
+
+def _layout_response(response: dict, layout: PanelLayout, layout_arrays: dict, representation: str) -> Response:
+    """配置結果のパネル情報を指定の形式で response に加えてレスポンスを作成"""
+    with stage('serialize'):
+        return _encode_layout_response(response, layout, layout_arrays, representation)
+
+def _encode_layout_response(response: dict, layout: PanelLayout, layout_arrays: dict,
+                            representation: str) -> Response:
+    sizes_cm = layout.orientation_sizes_cm()
+    if representation == 'octet-stream':
+        return Response(pack_octet_stream(response, layout_arrays, sizes_cm),
+                        mimetype='application/octet-stream')
+    elif representation == 'binary':
+        response["panels"] = encode_binary(layout_arrays, sizes_cm)
+    elif representation == 'columnar':
+        response["panels"] = encode_columnar(layout_arrays, sizes_cm)
+    else:
+        response["panels"] = layout.to_panel_dicts(layout_arrays)
+    return jsonify(response)
+
+def _session_response(token: str, session: LayoutSession, representation: str) -> Response:
+    """インクリメンタル配置の結果（トークン・枚数・発電量・パネル配置）のレスポンスを作成"""
+    response = _session_summary(token, session)
+    return _layout_response(response, session.layout, session.layout_arrays(), representation)
+
+def _session_summary(token: str, session: LayoutSession) -> dict:
+    """インクリメンタル配置のトークン・枚数・発電量（パネル配置は含めない）"""
+    layout = session.layout
+    options = session.options
+    panel_area = layout.panel_width * layout.panel_height / 10000
+    
+    power_data = SolarCalculator().calculate_power(
+        options['location'].get('lat', 35.6762),
+        options['location'].get('lng', 139.6503),
+        session.panel_count,
+        panel_area,
+        model=options['irradiance_model'],
+        tilt=options['tilt'],
+        azimuth=options['azimuth']
+    )
+    
+    return {
+        "layout_token": token,
+        "panel_count": session.panel_count,
+        "disabled_count": int(np.count_nonzero(session.mask & session.disabled)),
+        "total_area": session.panel_count * panel_area,
+        "offset": layout.offset,
+        "retested_cells": session.retested_cells,
+        "power_estimation": power_data,
+        "layout_bounds": layout.get_bounds(session.polygon_coords)
+    }
+
+@app.route('/api/layouts', methods=['POST'])
+def create_layout():
+    """
+    インクリメンタル編集用のレイアウトを作成し、トークンと配置結果を返す
+    
+    グリッドの向きと位相は作成時に決めて固定する。以降の編集は /api/layouts/<token>/delta で行う。
+    
+    Query parameters:
+        format: /api/calculate-panels と同じ
+    
+    Request body:
+        /api/calculate-panels と同じ（layout_mode は 'grid' または 'search' のみ）。
+        over_budget も同じ扱い。向きと位相の選択は deadline で打ち切るが（layout_status.complete が false）、
+        選んだグリッドのセル判定は編集の基準になるため最後まで行う
+    """
+    try:
+        data = request.json
+        
+        polygon = data.get('polygon', [])
+        layout_mode = data.get('layout_mode', 'grid')
+        irradiance_model = data.get('irradiance_model', 'table')
+        over_budget = data.get('over_budget', 'downgrade')
         
         if not polygon or len(polygon) < 3:
             return jsonify({"error": "Invalid polygon. At least 3 points required."}), 400
         
-        # パネルレイアウト計算
-        layout = PanelLayout(panel_width, panel_height, offset)
-        panels = layout.calculate_layout(polygon)
+        if layout_mode not in INCREMENTAL_MODES:
+            return jsonify({"error": f"Invalid layout_mode. Use one of: {', '.join(INCREMENTAL_MODES)}"}), 400
         
-        # 発電量計算
-        solar_calc = SolarCalculator()
-        power_data = solar_calc.calculate_power(
-            location.get('lat', 35.6762),  # デフォルト東京
-            location.get('lng', 139.6503),
-            len(panels),
-            panel_width * panel_height / 10000  # cm² to m²
-        )
+        if over_budget not in OVER_BUDGET_POLICIES:
+            return jsonify({"error": f"Invalid over_budget. Use one of: {', '.join(OVER_BUDGET_POLICIES)}"}), 400
+        
+        if irradiance_model not in IRRADIANCE_MODELS:
+            return jsonify({"error": f"Invalid irradiance_model. Use one of: {', '.join(IRRADIANCE_MODELS)}"}), 400
         
-        response = {
-            "panels": panels,
-            "panel_count": len(panels),
-            "total_area": len(panels) * (panel_width * panel_height / 10000),
-            "power_estimation": power_data,
-            "layout_bounds": layout.get_bounds(polygon)
+        response_format = request.args.get('format', 'objects')
+        if response_format not in RESPONSE_FORMATS:
+            return jsonify({"error": f"Invalid format. Use one of: {', '.join(RESPONSE_FORMATS)}"}), 400
+        
+        try:
+            keepouts = parse_keepouts(data.get('keepouts') or [])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        layout = PanelLayout(data.get('panel_width', 165), data.get('panel_height', 100), data.get('offset', 10),
+                             keepouts)
+        admission = admit(layout, polygon, layout_mode, data.get('phase_steps', 4), over_budget)
+        session, complete = layout_runner.create_session(layout, polygon, admission)
+        session.options = {
+            "location": data.get('location', {}),
+            "irradiance_model": irradiance_model,
+            "tilt": data.get('tilt'),
+            "azimuth": data.get('azimuth')
         }
+        token = layout_sessions.put(session)
+        
+        response = _session_summary(token, session)
+        response["layout_status"] = admission.status(complete)
+        return _layout_response(response, session.layout, session.layout_arrays(),
+                                _response_representation(response_format))
+    
+    except LayoutRejected as e:
+        return jsonify({"error": str(e), "estimated_cells": e.estimated_cells, "budget": e.budget}), 422
+    except LayoutBusy as e:
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/layouts/<token>/delta', methods=['POST'])
+def update_layout(token):
+    """
+    前回のレイアウトに編集を適用し、新しいトークンと配置結果を返す
+    
+    変化した領域に掛かるセルだけを再判定する。元のトークンは有効なまま残るため、
+    元に戻す操作は元のトークンを使えばよい。
+    
+    Query parameters:
+        format: /api/calculate-panels と同じ
+    
+    Request body（いずれか1つ以上）:
+    {
+        "vertex": {"index": int, "position": [lat, lng]},  # 移動した頂点
+        "polygon": [[lat, lng], ...],                      # 多角形全体の置き換え
+        "offset": float                                    # 新しいオフセット (cm)
+    }
+    """
+    try:
+        session = layout_sessions.get(token)
+        if session is None:
+            return jsonify({"error": "Unknown or expired layout token"}), 404
+        
+        data = request.json
+        
+        response_format = request.args.get('format', 'objects')
+        if response_format not in RESPONSE_FORMATS:
+            return jsonify({"error": f"Invalid format. Use one of: {', '.join(RESPONSE_FORMATS)}"}), 400
+        
+        polygon = data.get('polygon')
+        vertex = data.get('vertex')
+        if vertex is not None:
+            polygon = [list(point) for point in (polygon or session.polygon_coords)]
+            index = vertex.get('index')
+            if not isinstance(index, int) or not 0 <= index < len(polygon):
+                return jsonify({"error": "Invalid vertex index"}), 400
+            polygon[index] = list(vertex.get('position', polygon[index]))
+        
+        if polygon is not None and len(polygon) < 3:
+            return jsonify({"error": "Invalid polygon. At least 3 points required."}), 400
+        
+        updated = session.apply_delta(polygon_coords=polygon, offset_cm=data.get('offset'))
+        new_token = layout_sessions.put(updated)
+        
+        return _session_response(new_token, updated, _response_representation(response_format))
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/layouts/<token>/panel-at', methods=['GET'])
+def layout_panel_at(token):
+    """
+    指定地点にあるパネルを返す（外したパネルも enabled: false で返す）
+    
+    Query parameters:
+        lat, lng: 地点
+    
+    Response:
+        {"panel": {"id": int | null, "cell": [i, j], "enabled": bool, "center": [...], "corners": [...], ...}}
+        パネルが無ければ {"panel": null}。cell は同じトークン系列の編集を通して変わらない
+    """
+    try:
+        session = layout_sessions.get(token)
+        if session is None:
+            return jsonify({"error": "Unknown or expired layout token"}), 404
+        
+        lat = request.args.get('lat', type=float)
+        lng = request.args.get('lng', type=float)
+        if lat is None or lng is None:
+            return jsonify({"error": "Latitude and longitude required"}), 400
+        
+        position = session.cell_at(lat, lng)
+        return jsonify({"panel": session.describe_cell(*position) if position is not None else None})
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/layouts/<token>/toggle', methods=['POST'])
+def toggle_layout_panels(token):
+    """
+    パネルを個別に外す・戻し、新しいトークンと枚数・発電量を返す（パネル配置は返さない）
+    
+    Request body:
+    {
+        "points": [[lat, lng], ...],   # 地点にあるパネル
+        "cells": [[i, j], ...],        # panel-at で得たセル番号
+        "enabled": bool                # 省略時は各パネルの状態を反転
+    }
+    
+    Response:
+        /api/layouts と同じ（panels を除く）に、状態を変えたセル changed_cells を加えたもの
+    """
+    try:
+        session = layout_sessions.get(token)
+        if session is None:
+            return jsonify({"error": "Unknown or expired layout token"}), 404
+        
+        data = request.json
+        enabled = data.get('enabled')
+        if enabled is not None and not isinstance(enabled, bool):
+            return jsonify({"error": "enabled must be a boolean"}), 400
+        
+        positions = set()
+        try:
+            for lat, lng in data.get('points', []):
+                position = session.cell_at(float(lat), float(lng))
+                if position is not None:
+                    positions.add(position)
+            for i, j in data.get('cells', []):
+                position = session.cell_position(int(i), int(j))
+                if position is not None and session.mask[position]:
+                    positions.add(position)
+        except (TypeError, ValueError):
+            return jsonify({"error": "points must be [lat, lng] pairs and cells must be [i, j] pairs"}), 400
+        
+        disabled = session.disabled.copy()
+        changed = []
+        for position in sorted(positions):
+            value = (not disabled[position]) if enabled is None else (not enabled)
+            if disabled[position] != value:
+                disabled[position] = value
+                changed.append(session.cell_index(*position))
+        
+        updated = session.with_disabled(disabled)
+        response = _session_summary(layout_sessions.put(updated), updated)
+        response["changed_cells"] = changed
+        return jsonify(response)
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/layouts/<token>/remove-region', methods=['POST'])
+def remove_layout_region(token):
+    """
+    領域と重なるパネルを外し、新しいトークンと枚数・発電量を返す（パネル配置は返さない）
+    
+    Request body:
+    {
+        "polygon": [[lat, lng], ...]   # 外す領域
+    }
+    
+    Response:
+        /api/layouts/<token>/toggle と同じ
+    """
+    try:
+        session = layout_sessions.get(token)
+        if session is None:
+            return jsonify({"error": "Unknown or expired layout token"}), 404
         
+        polygon = request.json.get('polygon', [])
+        if not polygon or len(polygon) < 3:
+            return jsonify({"error": "Invalid polygon. At least 3 points required."}), 400
+        
+        region = session.cells_in_region(polygon) & ~session.disabled
+        updated = session.with_disabled(session.disabled | region)
+        
+        response = _session_summary(layout_sessions.put(updated), updated)
+        response["changed_cells"] = [session.cell_index(row, col) for row, col in zip(*np.nonzero(region))]
         return jsonify(response)
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/layouts/<token>/summary', methods=['GET'])
+def layout_summary(token):
+    """
+    レイアウトの枚数と発電量を再計算して返す（パネル配置は返さない）
+    """
+    try:
+        session = layout_sessions.get(token)
+        if session is None:
+            return jsonify({"error": "Unknown or expired layout token"}), 404
+        
+        return jsonify(_session_summary(token, session))
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/calculate-panels/batch', methods=['POST'])
+def calculate_panels_batch():
+    """
+    複数の屋根のパネル配置と発電量をまとめて計算し、NDJSON で順次返す
+    
+    配置計算はバッチ専用のプロセスプールで並列に行い、完了した屋根から1行ずつ返すため
+    行の順序はリクエストの順序と一致しない（各行の index で対応付ける）。
+    同時に実行できるバッチの数（BATCH_MAX_CONCURRENT）を超えると 429 を返す。
+    
+    Request body:
+    {
+        "roofs": [
+            {
+                "id": any,                      # 任意の識別子（省略時は index）
+                "polygon": [[lat, lng], ...],
+                ...                             # 以下の共通設定を屋根ごとに上書き可能
+            }
+        ],
+        "panel_width": float,           # 共通設定: パネル幅 (cm)
+        "panel_height": float,          # 共通設定: パネル高さ (cm)
+        "offset": float,                # 共通設定: オフセット/離隔 (cm)
+        "layout_mode": string,          # 共通設定: 'grid'（既定）/ 'search' / 'rotated' / 'strips'
+        "phase_steps": int,             # 共通設定: グリッド位相の分割数（既定4）
+        "keepouts": [...],              # 共通設定: 設置禁止区域（/api/calculate-panels と同じ）
+        "location": {"lat": float, "lng": float},  # 共通設定: 設置地点
+        "irradiance_model": string,     # 'table'（既定）または 'hourly'
+        "tilt": float,                  # 設置角度（度、'hourly' 時のみ）
+        "azimuth": float,               # 設置方位（度、'hourly' 時のみ）
+        "include_panels": bool          # True なら列指向形式のパネル配置を含める
+    }
+    
+    Response (application/x-ndjson):
+        {"index": 0, "id": ..., "panel_count": ..., "total_area": ..., "power_estimation": {...}, "layout_bounds": {...}}
+        {"index": 1, "id": ..., "error": "..."}
+        {"summary": {"total": ..., "succeeded": ..., "failed": ...}}
+    """
+    try:
+        data = request.json
+        irradiance_model = data.get('irradiance_model', 'table')
+        
+        if irradiance_model not in IRRADIANCE_MODELS:
+            return jsonify({"error": f"Invalid irradiance_model. Use one of: {', '.join(IRRADIANCE_MODELS)}"}), 400
+        
+        try:
+            roofs = resolve_roofs(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        results = iter_batch_results(
+            roofs,
+            irradiance_model=irradiance_model,
+            tilt=data.get('tilt'),
+            azimuth=data.get('azimuth'),
+            include_panels=bool(data.get('include_panels', False))
+        )
+        # 実行枠はレスポンスを返し終えたとき（クライアント切断を含む）に解放する
+        batch_slots.acquire()
+        response = Response(stream_with_context(results), mimetype='application/x-ndjson')
+        response.call_on_close(batch_slots.release)
+        return response
+    
+    except LayoutBusy as e:
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/export-timeseries', methods=['POST'])
+def export_timeseries():
+    """
+    時間別モデルの日射量・発電量の時系列（1年 8760 行、15分間隔なら 35040 行）を出力
+    
+    1か月分ずつ計算して順次返すため、年数・システム数が多くてもメモリは増えない。
+    時刻は区間の開始時刻（日本時間）。2年目以降は degradation_rate で経年劣化させる。
+    
+    Query parameters:
+        format: 'csv'（既定）/ 'parquet' / 'arrow'（Arrow IPC ストリーム）。
+                parquet / arrow は pyarrow がインストールされている場合のみ
+    
+    Request body:
+    {
+        "systems": [                    # 任意: 省略時はトップレベルを1つのシステムとして扱う（最大100、
+                                        #   地点・向きの組み合わせは最大10種類）
+            {
+                "id": string | number,          # 任意の識別子（省略時は index）
+                "layout_token": string,         # /api/layouts のトークン（枚数・寸法・地点・向きを引き継ぐ）
+                "panel_count": int,             # layout_token を指定しない場合は必須
+                ...                             # 以下の共通設定をシステムごとに上書き可能
+            }
+        ],
+        "panel_width": float,           # 共通設定: パネル幅 (cm)
+        "panel_height": float,          # 共通設定: パネル高さ (cm)
+        "location": {"lat": float, "lng": float},  # 共通設定: 設置地点
+        "tilt": float,                  # 共通設定: 設置角度（度）
+        "azimuth": float,               # 共通設定: 設置方位（度、南=180）
+        "degradation_rate": float,      # 共通設定: 年あたりの発電量低下率（既定 0.005）
+        "start_year": int,              # 最初の年（既定は今年）
+        "years": int,                   # 年数（既定1、最大30）
+        "interval_minutes": int         # 60（既定）または 15
+    }
+    
+    Response (text/csv など):
+        system_id,timestamp,poa_w_m2,temp_cell_c,ac_kw,energy_kwh
+        0,2025-01-01T00:00+09:00,0.0,1.23,0.0000,0.00000
+    """
+    try:
+        data = request.json or {}
+        export_format = request.args.get('format', 'csv')
+        
+        try:
+            systems = resolve_systems(data)
+            period = resolve_period(data)
+            chunks = iter_export(systems, export_format=export_format, **period)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        filename = f"timeseries_{period['start_year']}_{period['interval_minutes']}min.{export_format}"
+        response = Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[export_format])
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+        return response
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/generate-pdf', methods=['POST'])
 def generate_pdf():
     """
     レイアウト図と発電量シミュレーション結果のPDFを生成
     
+    屋根とパネルはベクターで描画する。地図画像は任意（指定時は別ページに掲載）。
+    
     Request body:
     {
         "polygon": [[lat, lng], ...],
-        "panels": [...],
+        "panels": [...] または {...},  # パネル辞書のリスト、または ?format=columnar / binary の panels
         "power_data": {...},
-        "map_image": "base64_encoded_image",
+        "map_image": "base64_encoded_image",  # 任意
         "location": {...},
         "panel_specs": {...}
     }
@@ -98,7 +769,8 @@ def generate_pdf():
     try:
         data = request.json
         
-        # PDFGenerator instance
+        # reportlab・PIL は PDF を生成するときに初めて読み込む（コールドスタートを短くするため）
+        from pdf_generator import PDFGenerator
         pdf_gen = PDFGenerator()
         
         # Generate PDF
@@ -122,6 +794,76 @@ def generate_pdf():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/pdf-jobs', methods=['POST'])
+def create_pdf_job():
+    """
+    PDF 生成ジョブを登録し、ジョブ ID をすぐに返す
+    
+    生成はプロセスプールで行うため、大きな PDF が API のスレッドを占有しない。
+    未完了のジョブが上限に達している場合は 429 を返す。
+    
+    Request body:
+        /api/generate-pdf と同じ
+    
+    Response (202):
+    {
+        "job_id": string,
+        "status": "queued",
+        "status_url": "/api/pdf-jobs/<job_id>"
+    }
+    """
+    try:
+        data = request.json
+        
+        try:
+            job_id = pdf_jobs.submit(data)
+        except QueueFullError as e:
+            response = jsonify({"error": str(e)})
+            response.headers['Retry-After'] = '5'
+            return response, 429
+        
+        status_url = f'/api/pdf-jobs/{job_id}'
+        response = jsonify({"job_id": job_id, "status": "queued", "status_url": status_url})
+        response.headers['Location'] = status_url
+        return response, 202
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/pdf-jobs/<job_id>', methods=['GET'])
+def get_pdf_job(job_id):
+    """
+    PDF 生成ジョブの状態を返す。完了していれば PDF をダウンロードとして返す
+    
+    Response:
+        202: {"job_id": string, "status": "queued" | "running"}
+        200: PDF ファイル
+        404: 不明または期限切れのジョブ
+        500: {"job_id": string, "status": "failed", "error": string}
+    """
+    try:
+        job = pdf_jobs.status(job_id)
+        if job is None:
+            return jsonify({"error": "Unknown or expired PDF job"}), 404
+        
+        if job['status'] == 'failed':
+            return jsonify(job), 500
+        
+        if job['status'] != 'done':
+            response = jsonify(job)
+            response.headers['Retry-After'] = '1'
+            return response, 202
+        
+        return send_file(
+            job['path'],
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name=f'solar_simulation_{job_id}.pdf'
+        )
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/get-solar-data', methods=['POST'])
 def get_solar_data():
     """
@@ -149,6 +891,76 @@ def get_solar_data():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/calculate-roi', methods=['POST'])
+def calculate_roi():
+    """
+    投資回収期間と長期の収支を計算
+    
+    "sensitivity" を指定すると、各パラメータの値の組み合わせ（全シナリオ）を1回の配列演算で
+    評価した感度分析表を追加で返す。表の各値は sensitivity.parameters の順に軸を並べた多次元配列。
+    
+    Request body:
+    {
+        "installation_cost": float,          # 設置費用（円）
+        "yearly_generation_kwh": float,      # 初年度の年間発電量（kWh）
+        "electricity_price_per_kwh": float,  # 買電単価（円/kWh、既定30）
+        "years": int,                        # 計算する年数（既定20）
+        "degradation_rate": float,           # 年あたりの発電量低下率（既定0.005）
+        "price_escalation": float,           # 買電単価の年上昇率（既定0）
+        "self_consumption_ratio": float,     # 自家消費の割合（既定1、残りは売電）
+        "feed_in_price": float,              # 売電単価（円/kWh、既定0）
+        "feed_in_years": float,              # 売電単価の適用年数（既定: 全期間）
+        "post_feed_in_price": float,         # 売電期間終了後の売電単価（円/kWh、既定0）
+        "maintenance_cost": float,           # 年間の維持費（円、既定0）
+        "discount_rate": float,              # 割引率（既定0）
+        "sensitivity": {                     # 任意: 感度分析するパラメータと値のリスト
+            "electricity_price_per_kwh": [25, 30, 35],
+            "installation_cost": [1200000, 1500000],
+            "degradation_rate": [0.004, 0.005, 0.007]
+        }
+    }
+    """
+    try:
+        data = request.json
+        
+        if data.get('installation_cost') is None or data.get('yearly_generation_kwh') is None:
+            return jsonify({"error": "installation_cost and yearly_generation_kwh required"}), 400
+        
+        try:
+            years = int(data.get('years', 20))
+            params = {name: float(data[name]) for name in ROI_DEFAULTS if data.get(name) is not None}
+        except (TypeError, ValueError):
+            return jsonify({"error": "Financial parameters must be numbers"}), 400
+        
+        if not 1 <= years <= MAX_YEARS:
+            return jsonify({"error": f"years must be between 1 and {MAX_YEARS}"}), 400
+        
+        solar_calc = SolarCalculator()
+        result = solar_calc.calculate_roi(years=years, **params)
+        
+        sensitivity = data.get('sensitivity')
+        if sensitivity:
+            if not isinstance(sensitivity, dict) or not all(isinstance(v, list) and v for v in sensitivity.values()):
+                return jsonify({"error": "sensitivity must map parameter names to non-empty lists"}), 400
+            try:
+                table = evaluate_grid(params, sensitivity, years=years)
+            except (TypeError, ValueError) as e:
+                return jsonify({"error": str(e)}), 400
+            
+            result['sensitivity'] = {
+                'parameters': table['parameters'],
+                'values': table['values'],
+                'cumulative_payback_years': to_list(table['cumulative_payback_years'], 1),
+                'discounted_payback_years': to_list(table['discounted_payback_years'], 1),
+                'npv_yen': to_list(table['npv_yen'], 0),
+                'irr': to_list(table['irr'], 4)
+            }
+        
+        return jsonify(result)
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
     app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
@@ -4,13 +4,88 @@ Panel Layout Algorithm
 """
 
 import numpy as np
+import shapely
 from shapely.geometry import Polygon, box
-from shapely.affinity import translate, rotate
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Optional, NamedTuple
+from concurrent.futures import as_completed, TimeoutError
 import math
+import time
+
+from projection import LocalProjection
+from worker_pool import get_process_pool
+from instrumentation import stage, count
+
+# パネルの向き（配列形式の向きコードはこのインデックス）
+ORIENTATIONS = ('landscape', 'portrait')
+
+# 配置モード
+LAYOUT_MODES = ('grid', 'search', 'rotated', 'strips')
+
+# 回転配置の判定で許容する誤差 (m)
+ROTATION_TOLERANCE_M = 1e-6
+
+# セルが屋根に収まるかの判定で矩形を縮める幅 (m)。ローカル投影では緯度経度に沿った屋根の辺も
+# わずかに傾く（子午線収差で 20 m の辺あたり約 1e-5 m）ため、辺に接するセルが外れないようにする
+CELL_TOLERANCE_M = 1e-4
+
+# 回転探索で角度を細かくする段階数の見積もり（coarse_angle_step=15, min_angle_step=0.5 のとき）
+ROTATION_REFINE_STEPS = 4
+
+# 1リクエストで受け付ける設置禁止区域の最大数
+MAX_KEEPOUTS = 500
+
+# 設置禁止区域の判定で許容する誤差 (m)。区域の境界に接するだけのセルは配置できる
+KEEPOUT_TOLERANCE_M = 1e-6
+
+
+class LayoutCandidate(NamedTuple):
+    """配置候補（グリッドの向き・位相・回転角）"""
+    orientation: str
+    w: float          # パネル幅 (m)
+    h: float          # パネル高さ (m)
+    phase_x: float    # グリッド開始位置のずらし量 (m)
+    phase_y: float
+    angle: float = 0.0  # グリッドの回転角（度、反時計回り）
+
+def parse_keepouts(keepouts) -> List[Dict]:
+    """
+    リクエストの設置禁止区域（天窓・換気口・通路など）のリストを検証して正規化
+    
+    Args:
+        keepouts: [{"polygon": [[lat, lng], ...], "setback": float}, ...]
+                  setback は区域の周囲に空ける距離 (cm、省略時は 0)
+    
+    Returns:
+        float に揃えた設置禁止区域のリスト
+    
+    Raises:
+        ValueError: 形式が不正な場合
+    """
+    if not isinstance(keepouts, list):
+        raise ValueError("keepouts must be a list")
+    if len(keepouts) > MAX_KEEPOUTS:
+        raise ValueError(f"Too many keepouts ({len(keepouts)}). At most {MAX_KEEPOUTS}.")
+    
+    parsed = []
+    for i, keepout in enumerate(keepouts):
+        if not isinstance(keepout, dict):
+            raise ValueError(f"keepouts[{i}] must be an object")
+        polygon = keepout.get('polygon')
+        if not isinstance(polygon, list) or len(polygon) < 3:
+            raise ValueError(f"keepouts[{i}]: polygon needs at least 3 points")
+        try:
+            points = [[float(lat), float(lng)] for lat, lng in polygon]
+            setback = float(keepout.get('setback', 0))
+        except (TypeError, ValueError):
+            raise ValueError(f"keepouts[{i}]: polygon points and setback must be numbers")
+        if not setback >= 0:
+            raise ValueError(f"keepouts[{i}]: setback must not be negative")
+        parsed.append({'polygon': points, 'setback': setback})
+    return parsed
 
 class PanelLayout:
-    def __init__(self, panel_width_cm: float, panel_height_cm: float, offset_cm: float):
+    def __init__(self, panel_width_cm: float, panel_height_cm: float, offset_cm: float,
+                 keepouts: Optional[List[Dict]] = None):
         """
         パネルレイアウト計算クラス
         
@@ -18,23 +93,171 @@ class PanelLayout:
             panel_width_cm: パネル幅 (cm)
             panel_height_cm: パネル高さ (cm)
             offset_cm: オフセット/離隔 (cm)
+            keepouts: parse_keepouts で正規化した設置禁止区域（屋根から setback を含めて除く）
         """
         self.panel_width = panel_width_cm
         self.panel_height = panel_height_cm
         self.offset = offset_cm
+        self.keepouts = keepouts or []
+        self.spacing = 0.05  # パネル間隔 5cm (m)
+        self.max_cells_per_chunk = 200000  # 一度に判定する候補セル数の上限
+        self.parallel_min_cells = 200000  # 探索をプロセスプールで並列化する候補セル数の下限
+        self.parallel_pool = 'layout'  # 並列評価に使うプロセスプールの名前（worker_pool.get_process_pool）
+        self.coarse_angle_step = 15.0  # 回転探索の粗い刻み（度）
+        self.min_angle_step = 0.5  # 回転探索の最小刻み（度）
+        self.deadline = None  # 計算を打ち切る時刻（time.time()、None なら無制限）
+        self.timed_out = False  # 直前の計算が deadline で打ち切られたか
+        self._cell_filter = None  # 直前に準備した屋根の (屋根, 外周, 設置禁止区域の STRtree)
         
-    def calculate_layout(self, polygon_coords: List[List[float]]) -> List[Dict]:
+    def calculate_layout(self, polygon_coords: List[List[float]], mode: str = 'grid',
+                         phase_steps: int = 4) -> List[Dict]:
         """
         多角形内にパネルを配置
         
         Args:
             polygon_coords: [[lat, lng], ...] 形式の多角形座標
+            mode: 'grid'（横置き/縦置きの良い方）、'search'（位相オフセットも探索）、
+                  'rotated'（屋根の辺に合わせた回転角も探索）、
+                  'strips'（水平帯ごとに横置き/縦置きを選ぶ混在配置）
+            phase_steps: 'search' / 'rotated' モードで各軸のグリッド位相を何分割で試すか
             
         Returns:
             配置されたパネル情報のリスト
         """
-        # 緯度経度をメートル座標系に変換（簡易版）
-        meter_coords = self._latlon_to_meters(polygon_coords)
+        return self.to_panel_dicts(self.calculate_layout_arrays(polygon_coords, mode, phase_steps))
+    
+    def calculate_layout_arrays(self, polygon_coords: List[List[float]], mode: str = 'grid',
+                                phase_steps: int = 4) -> Dict[str, np.ndarray]:
+        """
+        多角形内にパネルを配置し、結果を配列のまま返す（大規模レイアウトの高速な直列化用）
+        
+        Args:
+            calculate_layout と同じ
+            
+        Returns:
+            {
+                'centers': (N, 2) の [lat, lng],
+                'corners': (N, 4, 2) の [lat, lng],
+                'orientation': (N,) の向きコード（ORIENTATIONS のインデックス）
+            }
+        """
+        if mode not in LAYOUT_MODES:
+            raise ValueError(f"Unknown layout mode: {mode}")
+        
+        self.timed_out = False
+        with stage('layout.prepare'):
+            projection = self._make_projection(polygon_coords)
+            roof_polygon = self._prepare_roof(polygon_coords, projection)
+        if roof_polygon is None:
+            return self._panel_arrays([], projection)
+        
+        with stage('layout.search'):
+            if mode == 'strips':
+                rows = self._pack_strips(roof_polygon)
+            else:
+                if mode == 'rotated':
+                    candidate, origins = self._search_rotation(roof_polygon, phase_steps)
+                elif mode == 'search':
+                    candidate, origins = self._select_best(roof_polygon, self._search_candidates(phase_steps))
+                else:
+                    candidate, origins = self._select_best(roof_polygon, self._search_candidates(1))
+                rows = [(candidate, origins, self._rotation_pivot(roof_polygon))]
+        
+        with stage('layout.convert'):
+            layout = self._panel_arrays(rows, projection)
+        count('layout_panels_placed', len(layout['orientation']))
+        return layout
+    
+    def estimate_cells(self, polygon_coords: List[List[float]], mode: str = 'grid',
+                       phase_steps: int = 4) -> int:
+        """
+        配置計算で判定する候補セル数の見積もり（計算前の受け付け判定用）
+        
+        オフセット適用後の屋根の外接矩形とパネル寸法から候補ごとのセル数を求めて合計する。
+        上限到達による早期打ち切りは考えない。'rotated' は回転後の外接矩形が対角線を一辺とする
+        正方形に収まることを使って多めに見積もる。'strips' はセル判定を行わないが、
+        出力の規模の目安として 'grid' と同じ値を返す。
+        
+        Returns:
+            候補セル数（屋根が無効なら 0）
+        """
+        if mode not in LAYOUT_MODES:
+            raise ValueError(f"Unknown layout mode: {mode}")
+        
+        projection = self._make_projection(polygon_coords)
+        roof_polygon = self._prepare_roof(polygon_coords, projection)
+        if roof_polygon is None:
+            return 0
+        
+        minx, miny, maxx, maxy = roof_polygon.bounds
+        width, height = maxx - minx, maxy - miny
+        steps = max(1, int(phase_steps))
+        if mode == 'rotated':
+            width = height = math.hypot(width, height)
+            angles = len(self._seed_angles(roof_polygon)) + 2 * ROTATION_REFINE_STEPS
+            # 粗い探索・細かくする探索は位相 0 のみ、最後に2つの角度で位相を探索
+            candidate_sets = [(angles, 1), (2, steps)]
+        elif mode == 'search':
+            candidate_sets = [(1, steps)]
+        else:
+            candidate_sets = [(1, 1)]
+        
+        cells = 0
+        for angle_count, candidate_steps in candidate_sets:
+            per_angle = sum(
+                (width // (c.w + self.spacing) + 1) * (height // (c.h + self.spacing) + 1)
+                for c in self._search_candidates(candidate_steps)
+            )
+            cells += angle_count * per_angle
+        return int(cells)
+    
+    def _past_deadline(self) -> bool:
+        """deadline を過ぎていれば timed_out を立てて True を返す"""
+        if self.deadline is not None and time.time() >= self.deadline:
+            self.timed_out = True
+        return self.timed_out
+    
+    def to_panel_dicts(self, layout: Dict[str, np.ndarray]) -> List[Dict]:
+        """配列形式のレイアウトをパネル情報のリストに変換"""
+        with stage('layout.to_dicts'):
+            return self._panel_dicts(layout)
+    
+    def _panel_dicts(self, layout: Dict[str, np.ndarray]) -> List[Dict]:
+        sizes = self.orientation_sizes_cm()
+        centers = layout['centers'].tolist()
+        corners = layout['corners'].tolist()
+        
+        return [
+            {
+                'id': i,
+                'center': center,
+                'corners': corner,
+                'orientation': ORIENTATIONS[code],
+                'width_cm': sizes[code][0],
+                'height_cm': sizes[code][1]
+            }
+            for i, (center, corner, code) in enumerate(zip(centers, corners, layout['orientation'].tolist()))
+        ]
+    
+    def orientation_sizes_cm(self) -> List[Tuple[float, float]]:
+        """向きコードごとのパネル寸法 (幅, 高さ) cm"""
+        return [(self.panel_width, self.panel_height), (self.panel_height, self.panel_width)]
+    
+    def _make_projection(self, polygon_coords: List[List[float]]) -> LocalProjection:
+        """屋根の重心を原点とするローカル座標系を作成（1リクエスト中の変換は全てこれを使う）"""
+        return LocalProjection.for_polygon(polygon_coords)
+    
+    def _prepare_roof(self, polygon_coords: List[List[float]],
+                      projection: LocalProjection) -> Optional[Polygon]:
+        """
+        緯度経度の多角形をメートル座標に変換し、オフセットを適用した屋根ポリゴンを返す
+        
+        設置禁止区域があれば setback だけ広げた区域をまとめて差し引く（屋根内の区域は穴になる）。
+        区域は角を丸めずに広げる（矩形の天窓なら矩形のまま。頂点数が増えず判定も速い）。
+        セルの判定用に、穴を除いた外周と区域の STRtree もここで1回だけ作っておく。
+        """
+        # 緯度経度をローカル座標系（メートル）に変換
+        meter_coords = projection.to_local(polygon_coords)
         
         # Shapelyポリゴンを作成
         roof_polygon = Polygon(meter_coords)
@@ -43,100 +266,511 @@ class PanelLayout:
         offset_m = self.offset / 100  # cm to m
         roof_polygon = roof_polygon.buffer(-offset_m)
         
+        if self.keepouts and roof_polygon.is_valid and not roof_polygon.is_empty:
+            zones = shapely.buffer(
+                shapely.polygons([projection.to_local(k['polygon']) for k in self.keepouts]),
+                [k['setback'] / 100 for k in self.keepouts],
+                join_style='mitre'
+            )
+            roof_polygon = roof_polygon.difference(shapely.union_all(zones))
+        
         if not roof_polygon.is_valid or roof_polygon.is_empty:
-            return []
+            return None
         
-        # パネルサイズをメートルに変換
-        panel_w_m = self.panel_width / 100
-        panel_h_m = self.panel_height / 100
+        shapely.prepare(roof_polygon)
+        self._cell_filter = self._build_cell_filter(roof_polygon)
+        return roof_polygon
+    
+    @staticmethod
+    def _build_cell_filter(roof_polygon: Polygon) -> Tuple[Polygon, Polygon, Optional[shapely.STRtree]]:
+        """
+        穴のある屋根のセル判定用に、穴を除いた外周（準備済み）と穴の STRtree を作成
         
-        # 配置するパネルのリスト
-        panels = []
+        準備済みジオメトリでも穴のある多角形の contains は穴の数に比例して遅くなるため、
+        外周の contains と、STRtree で外接矩形が重なった穴だけの判定に分ける。
+        穴は KEEPOUT_TOLERANCE_M だけ縮め、境界に接するだけのセルを除かないようにする。
+        """
+        parts = shapely.get_parts(roof_polygon)
+        holes = [shapely.polygons(ring) for part in parts for ring in part.interiors]
+        if not holes:
+            return roof_polygon, roof_polygon, None
         
-        # バウンディングボックスを取得
-        minx, miny, maxx, maxy = roof_polygon.bounds
+        shells = shapely.polygons(shapely.get_exterior_ring(parts))
+        shell = shells[0] if len(shells) == 1 else shapely.multipolygons(shells)
+        shapely.prepare(shell)
+        return roof_polygon, shell, shapely.STRtree(shapely.buffer(holes, -KEEPOUT_TOLERANCE_M))
+    
+    def _cells_within(self, roof_polygon: Polygon, cells: np.ndarray) -> np.ndarray:
+        """
+        セル（ポリゴンの配列）が屋根に収まるかをまとめて判定
         
-        # グリッド配置アルゴリズム
-        panel_id = 0
+        穴のない屋根は準備済みジオメトリの contains だけで判定する。穴のある屋根は外周に
+        収まるセルのうち、STRtree で穴と外接矩形が重なるものだけを穴と厳密に判定する。
+        """
+        cell_filter = self._cell_filter
+        if cell_filter is None or cell_filter[0] is not roof_polygon:
+            # セッションの再判定やワーカーなど、別に準備した屋根で呼ばれた場合
+            cell_filter = self._cell_filter = self._build_cell_filter(roof_polygon)
+        _, shell, holes = cell_filter
+        
+        shapely.prepare(shell)
+        mask = shapely.contains(shell, cells)
+        if holes is not None:
+            inside = np.flatnonzero(mask)
+            hits, _ = holes.query(cells[inside], predicate='intersects')
+            mask[inside[hits]] = False
+        return mask
+    
+    def _search_candidates(self, phase_steps: int, angle: float = 0.0) -> List[LayoutCandidate]:
+        """
+        評価する配置候補を列挙
+        
+        位相 0 の候補を先頭に置き、上限値による早期打ち切りが効きやすい順にする。
+        """
+        # パネルサイズをメートルに変換
+        panel_w_m = self.panel_width / 100
+        panel_h_m = self.panel_height / 100
+        phase_steps = max(1, int(phase_steps))
         
-        # 横置きと縦置きの両方を試す
+        candidates = []
         for orientation in ['landscape', 'portrait']:
             if orientation == 'landscape':
                 w, h = panel_w_m, panel_h_m
             else:
                 w, h = panel_h_m, panel_w_m
             
-            # 間隔を考慮してグリッド配置
-            spacing = 0.05  # 5cm間隔
-            
-            y = miny
-            while y + h <= maxy:
-                x = minx
-                while x + w <= maxx:
-                    # パネルの矩形を作成
-                    panel_rect = box(x, y, x + w, y + h)
-                    
-                    # 屋根ポリゴン内に完全に含まれるかチェック
-                    if roof_polygon.contains(panel_rect):
-                        # パネルの中心座標を緯度経度に変換
-                        center_m = [x + w/2, y + h/2]
-                        center_latlon = self._meters_to_latlon([center_m], polygon_coords[0])[0]
-                        
-                        panels.append({
-                            'id': panel_id,
-                            'center': center_latlon,
-                            'corners': self._get_panel_corners_latlon(x, y, w, h, polygon_coords[0]),
-                            'orientation': orientation,
-                            'width_cm': self.panel_width if orientation == 'landscape' else self.panel_height,
-                            'height_cm': self.panel_height if orientation == 'landscape' else self.panel_width
-                        })
-                        panel_id += 1
-                    
-                    x += w + spacing
-                y += h + spacing
-        
-        # 最適な配置を選択（パネル数が多い方）
-        return panels
-    
-    def _latlon_to_meters(self, coords: List[List[float]]) -> List[Tuple[float, float]]:
-        """緯度経度をメートル座標系に変換（簡易版）"""
-        if not coords:
+            for i in range(phase_steps):
+                for j in range(phase_steps):
+                    phase_x = (w + self.spacing) * i / phase_steps
+                    phase_y = (h + self.spacing) * j / phase_steps
+                    candidates.append(LayoutCandidate(orientation, w, h, phase_x, phase_y, angle))
+        
+        return sorted(candidates, key=lambda c: (c.phase_x != 0 or c.phase_y != 0))
+    
+    def _select_best(self, roof_polygon: Polygon, candidates: List[LayoutCandidate]
+                     ) -> Tuple[LayoutCandidate, np.ndarray]:
+        """
+        候補の中で最もパネル数が多い配置を選択
+        
+        屋根面積 / パネル面積 を上限とし、上限に達した時点で残りの候補は評価しない。
+        候補セル数が多い場合はプロセスプールで並列評価する。
+        """
+        upper_bound = self._upper_bound(roof_polygon)
+        
+        minx, miny, maxx, maxy = roof_polygon.bounds
+        estimated_cells = sum(
+            ((maxx - minx) / (c.w + self.spacing) + 1) * ((maxy - miny) / (c.h + self.spacing) + 1)
+            for c in candidates
+        )
+        
+        if len(candidates) > 1 and estimated_cells >= self.parallel_min_cells:
+            results = self._evaluate_parallel(roof_polygon, candidates, upper_bound)
+        else:
+            results = self._evaluate_sequential(roof_polygon, candidates, upper_bound)
+        
+        # パネル数が最大の候補（同数なら列挙順で先のもの）
+        best_index = max(results, key=lambda i: (len(results[i]), -i))
+        return candidates[best_index], results[best_index]
+    
+    def _upper_bound(self, roof_polygon: Polygon) -> int:
+        """配置可能なパネル枚数の上限（屋根面積 / パネル面積）"""
+        return int(roof_polygon.area // (self.panel_width * self.panel_height / 10000))
+    
+    def _search_rotation(self, roof_polygon: Polygon, phase_steps: int
+                         ) -> Tuple[LayoutCandidate, np.ndarray]:
+        """
+        屋根の辺に合わせた回転角を粗→細の順に探索し、最良の配置を返す
+        
+        1. 長い辺の角度・最小外接矩形の角度・一定刻みの角度を粗く評価
+        2. 最良角度の前後を刻みを半分にしながら評価
+        3. 最良角度でグリッド位相を探索
+        
+        どの角度でも候補セルを屋根の座標系へ回転して戻し、同じ準備済みジオメトリで判定する。
+        """
+        upper_bound = self._upper_bound(roof_polygon)
+        
+        def evaluate(candidates: List[LayoutCandidate], best):
+            result = self._select_best(roof_polygon, candidates)
+            if best is None or len(result[1]) > len(best[1]):
+                return result
+            return best
+        
+        def at_angles(angles: List[float]) -> List[LayoutCandidate]:
+            return [c for angle in angles for c in self._search_candidates(1, angle)]
+        
+        best = evaluate(at_angles(self._seed_angles(roof_polygon)), None)
+        
+        step = self.coarse_angle_step / 2
+        while step >= self.min_angle_step and len(best[1]) < upper_bound and not self._past_deadline():
+            angle = best[0].angle
+            best = evaluate(at_angles([(angle - step) % 90, (angle + step) % 90]), best)
+            step /= 2
+        
+        if phase_steps > 1 and len(best[1]) < upper_bound and not self._past_deadline():
+            # 最良角度と無回転のそれぞれで位相を探索（位相 0 の候補は評価済みなので除く）
+            candidates = [
+                c for angle in sorted({best[0].angle, 0.0})
+                for c in self._search_candidates(phase_steps, angle)
+                if (c.phase_x or c.phase_y)
+                and (c.orientation == best[0].orientation or angle != best[0].angle)
+            ]
+            best = evaluate(candidates, best)
+        
+        return best
+    
+    def _seed_angles(self, roof_polygon: Polygon) -> List[float]:
+        """回転探索の初期角度（長い辺・最小外接矩形・一定刻み）を [0, 90) 度で返す"""
+        angles = list(np.arange(0.0, 90.0, self.coarse_angle_step))
+        
+        # 長い辺の向き（長さ順に上位4本）
+        rings = shapely.get_exterior_ring(shapely.get_parts(roof_polygon))
+        for ring in rings:
+            coords = shapely.get_coordinates(ring)
+            edges = np.diff(coords, axis=0)
+            lengths = np.hypot(edges[:, 0], edges[:, 1])
+            for k in np.argsort(lengths)[::-1][:4]:
+                angles.append(math.degrees(math.atan2(edges[k, 1], edges[k, 0])) % 90)
+        
+        # 最小外接矩形の向き
+        rect = shapely.get_coordinates(roof_polygon.minimum_rotated_rectangle)
+        if len(rect) >= 2:
+            dx, dy = rect[1] - rect[0]
+            angles.append(math.degrees(math.atan2(dy, dx)) % 90)
+        
+        # 重複を除く（0.1度単位）
+        return sorted({round(a, 1) % 90 for a in angles})
+    
+    @staticmethod
+    def _rotation_pivot(roof_polygon: Polygon) -> Tuple[float, float]:
+        """回転の中心（屋根の重心）"""
+        centroid = roof_polygon.centroid
+        return centroid.x, centroid.y
+    
+    @staticmethod
+    def _rotate_points(points: np.ndarray, angle: float, pivot: Tuple[float, float]) -> np.ndarray:
+        """(..., 2) の点群を pivot 中心に angle 度（反時計回り）回転"""
+        theta = math.radians(angle)
+        cos_t, sin_t = math.cos(theta), math.sin(theta)
+        dx = points[..., 0] - pivot[0]
+        dy = points[..., 1] - pivot[1]
+        return np.stack([pivot[0] + dx * cos_t - dy * sin_t,
+                         pivot[1] + dx * sin_t + dy * cos_t], axis=-1)
+    
+    def _evaluate_sequential(self, roof_polygon: Polygon, candidates: List[LayoutCandidate],
+                             upper_bound: int) -> Dict[int, np.ndarray]:
+        """候補を順に評価（上限到達・deadline で打ち切り。最初の候補は必ず評価する）"""
+        results = {}
+        for i, candidate in enumerate(candidates):
+            if results and self._past_deadline():
+                break
+            results[i] = self._grid_origins(roof_polygon, candidate)
+            if len(results[i]) >= upper_bound:
+                break
+        self._count_cells(roof_polygon, [candidates[i] for i in results])
+        return results
+    
+    def _evaluate_parallel(self, roof_polygon: Polygon, candidates: List[LayoutCandidate],
+                           upper_bound: int) -> Dict[int, np.ndarray]:
+        """候補をプロセスプールで並列評価（上限到達で未着手の候補をキャンセル）"""
+        pool = get_process_pool(self.parallel_pool)
+        futures = {
+            pool.submit(self._grid_origins, roof_polygon, candidate): i
+            for i, candidate in enumerate(candidates)
+        }
+        
+        results = {}
+        timeout = None if self.deadline is None else max(0.0, self.deadline - time.time())
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                results[futures[future]] = future.result()
+                if len(results[futures[future]]) >= upper_bound:
+                    break
+        except TimeoutError:
+            if not results:
+                # 1件も終わっていなければ先頭の候補を待つ（結果を空にしないため）
+                first = next(iter(futures))
+                results[futures[first]] = first.result()
+            self.timed_out = True
+        for pending in futures:
+            pending.cancel()
+        # ワーカーが deadline で行の途中までを返した場合も打ち切りとして扱う
+        self._past_deadline()
+        # ワーカー内の計測は親プロセスに届かないため、判定したセル数はここで数える
+        self._count_cells(roof_polygon, [candidates[i] for i in results])
+        return results
+    
+    def _count_cells(self, roof_polygon: Polygon, candidates: List[LayoutCandidate]):
+        """評価した候補の判定セル数をカウンタに加算"""
+        cells = 0
+        for candidate in candidates:
+            xs, ys, _ = self._grid_axes(roof_polygon, candidate)
+            cells += len(xs) * len(ys)
+        count('layout_cells_tested', cells)
+    
+    def _pack_strips(self, roof_polygon: Polygon
+                     ) -> List[Tuple[LayoutCandidate, np.ndarray, Tuple[float, float]]]:
+        """
+        水平帯（ストリップ）単位でパネルを詰める混在配置
+        
+        各帯について屋根ポリゴンとの交差区間を区間演算で求め、区間内に左詰めでパネルを並べる。
+        横置きのみ・縦置きのみ・帯ごとに密度の高い向きを選ぶ貪欲法の3通りを計算し、
+        最もパネル数が多いものを返す。計算量はセル数ではなく O(帯数 × 辺数)。
+        
+        Returns:
+            [(向き, セル左下座標, 回転中心), ...] の帯ごとのリスト
+        """
+        edges = self._polygon_edges(roof_polygon)
+        if len(edges) == 0:
             return []
         
-        ref_lat = coords[0][0]
-        ref_lon = coords[0][1]
-        
-        meters_coords = []
-        for lat, lon in coords:
-            # 簡易的な変換（小範囲では十分な精度）
-            x = (lon - ref_lon) * 111320 * math.cos(math.radians(ref_lat))
-            y = (lat - ref_lat) * 110540
-            meters_coords.append((x, y))
-        
-        return meters_coords
-    
-    def _meters_to_latlon(self, meter_coords: List[List[float]], ref_point: List[float]) -> List[List[float]]:
-        """メートル座標系を緯度経度に変換"""
-        ref_lat, ref_lon = ref_point
-        
-        latlon_coords = []
-        for x, y in meter_coords:
-            lon = ref_lon + x / (111320 * math.cos(math.radians(ref_lat)))
-            lat = ref_lat + y / 110540
-            latlon_coords.append([lat, lon])
-        
-        return latlon_coords
-    
-    def _get_panel_corners_latlon(self, x: float, y: float, w: float, h: float, 
-                                   ref_point: List[float]) -> List[List[float]]:
-        """パネルの4隅の座標を緯度経度で取得"""
-        corners_m = [
-            [x, y],
-            [x + w, y],
-            [x + w, y + h],
-            [x, y + h]
+        landscape, portrait = self._search_candidates(1)[:2]
+        plans = [
+            self._strip_plan(edges, roof_polygon.bounds, [landscape]),
+            self._strip_plan(edges, roof_polygon.bounds, [portrait]),
+            self._strip_plan(edges, roof_polygon.bounds, [landscape, portrait]),
         ]
-        return self._meters_to_latlon(corners_m, ref_point)
+        rows = max(plans, key=lambda plan: sum(len(origins) for _, origins in plan))
+        return [(candidate, origins, (0.0, 0.0)) for candidate, origins in rows]
+    
+    def _strip_plan(self, edges: np.ndarray, bounds: Tuple[float, float, float, float],
+                    orientations: List[LayoutCandidate]) -> List[Tuple[LayoutCandidate, np.ndarray]]:
+        """
+        下から順に帯を積み上げる配置計画を作成
+        
+        Returns:
+            [(向き, (N, 2) のセル左下座標), ...] の帯ごとのリスト
+        """
+        _, miny, _, maxy = bounds
+        min_height = min(c.h for c in orientations)
+        # どの向きも置けない高さでは少しずつ上へずらす
+        scan_step = min_height / 4
+        
+        rows = []
+        y = miny
+        while y + min_height <= maxy:
+            best = None
+            for candidate in orientations:
+                if y + candidate.h > maxy:
+                    continue
+                xs = self._strip_positions(edges, y, y + candidate.h, candidate.w)
+                density = len(xs) / (candidate.h + self.spacing)
+                if len(xs) and (best is None or density > best[0]):
+                    best = (density, candidate, xs)
+            
+            if best is None:
+                y += scan_step
+                continue
+            
+            _, candidate, xs = best
+            rows.append((candidate, np.column_stack([xs, np.full(len(xs), y)])))
+            y += candidate.h + self.spacing
+        
+        return rows
+    
+    def _strip_positions(self, edges: np.ndarray, y0: float, y1: float, w: float) -> np.ndarray:
+        """
+        帯 [y0, y1] 内に幅 w のパネルを左詰めで並べたときの x 座標
+
+        グリッドのセル判定と同じく、帯と区間の判定には CELL_TOLERANCE_M の余裕を持たせる
+        （投影でわずかに傾いた辺に接する帯が空にならないようにする）。
+        """
+        eps = CELL_TOLERANCE_M
+        step = w + self.spacing
+        positions = []
+        for left, right in self._strip_intervals(edges, y0 + eps, y1 - eps):
+            fit = int((right - left + 2 * eps + self.spacing) // step)
+            positions.append(left - eps + step * np.arange(fit))
+        return np.concatenate(positions) if positions else np.empty(0)
+    
+    @staticmethod
+    def _polygon_edges(roof_polygon: Polygon) -> np.ndarray:
+        """
+        全リング（外周・穴）の非水平な辺を (x1, y1, x2, y2) 形式 (y1 < y2) の配列で返す
+        """
+        segments = []
+        for part in shapely.get_parts(roof_polygon):
+            rings = [part.exterior] + list(part.interiors)
+            for ring in rings:
+                coords = shapely.get_coordinates(ring)
+                segments.append(np.hstack([coords[:-1], coords[1:]]))
+        if not segments:
+            return np.empty((0, 4))
+        
+        edges = np.concatenate(segments)
+        edges = edges[edges[:, 1] != edges[:, 3]]
+        # 下端が (x1, y1) になるよう並べ替え
+        flip = edges[:, 1] > edges[:, 3]
+        edges[flip] = edges[flip][:, [2, 3, 0, 1]]
+        return edges
+    
+    @staticmethod
+    def _strip_intervals(edges: np.ndarray, y0: float, y1: float) -> List[Tuple[float, float]]:
+        """
+        帯 [y0, y1] の全高さにわたって屋根内部となる x 区間の一覧を求める
+        
+        帯を頂点の y 座標で小帯に分割すると、小帯内では各辺が直線で交差する辺の組も変わらない。
+        小帯ごとに内部区間の両端での幅の共通部分を取り、さらに全小帯の区間を積集合にする。
+        """
+        levels = edges[:, [1, 3]].ravel()
+        levels = np.unique(np.concatenate([[y0, y1], levels[(levels > y0) & (levels < y1)]]))
+        
+        intervals = None
+        for ya, yb in zip(levels[:-1], levels[1:]):
+            mid = (ya + yb) / 2
+            active = edges[(edges[:, 1] <= mid) & (mid < edges[:, 3])]
+            if len(active) == 0:
+                return []
+            
+            x1, e_y1, x2, e_y2 = active.T
+            slope = (x2 - x1) / (e_y2 - e_y1)
+            xa = x1 + (ya - e_y1) * slope
+            xb = x1 + (yb - e_y1) * slope
+            order = np.argsort(x1 + (mid - e_y1) * slope)
+            xa, xb = xa[order], xb[order]
+            
+            # 偶奇規則で隣り合う交点の組が内部区間になる
+            lefts = np.maximum(xa[0::2], xb[0::2])
+            rights = np.minimum(xa[1::2], xb[1::2])
+            slab = [(l, r) for l, r in zip(lefts.tolist(), rights.tolist()) if l < r]
+            
+            intervals = slab if intervals is None else PanelLayout._intersect_intervals(intervals, slab)
+            if not intervals:
+                return []
+        
+        return intervals or []
+    
+    @staticmethod
+    def _intersect_intervals(a: List[Tuple[float, float]],
+                             b: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+        """昇順に並んだ互いに素な区間リスト同士の積集合"""
+        result = []
+        i = j = 0
+        while i < len(a) and j < len(b):
+            left = max(a[i][0], b[j][0])
+            right = min(a[i][1], b[j][1])
+            if left < right:
+                result.append((left, right))
+            if a[i][1] < b[j][1]:
+                i += 1
+            else:
+                j += 1
+        return result
+    
+    def _grid_origins(self, roof_polygon: Polygon, candidate: LayoutCandidate) -> np.ndarray:
+        """
+        グリッド上の候補セルを一括生成し、屋根内に収まるセルの左下座標を返す
+        
+        候補矩形は shapely.box で配列として生成し、準備済み (prepared) ジオメトリに対する
+        _cells_within でまとめて判定する。回転角がある場合は、屋根を回転させた座標系で
+        グリッドを作り、セルの4隅を元の座標系へ回転して戻してから判定する。
+        
+        Returns:
+            (N, 2) の ndarray（回転後の座標系でのセル左下座標）。行順（y 昇順 → x 昇順）で並ぶ
+        """
+        w, h, angle = candidate.w, candidate.h, candidate.angle
+        xs, ys, pivot = self._grid_axes(roof_polygon, candidate)
+        if len(xs) == 0 or len(ys) == 0:
+            return np.empty((0, 2))
+        
+        # 巨大な屋根でもメモリが膨らまないよう行単位のチャンクで判定する
+        rows_per_chunk = max(1, self.max_cells_per_chunk // len(xs))
+        accepted = []
+        for i in range(0, len(ys), rows_per_chunk):
+            gx, gy = np.meshgrid(xs, ys[i:i + rows_per_chunk])
+            gx = gx.ravel()
+            gy = gy.ravel()
+            # 投影・回転の丸め誤差で辺に接するセルが外れないよう、判定用の矩形をわずかに縮める
+            eps = CELL_TOLERANCE_M
+            if angle:
+                corners = self._cell_corners(gx + eps, gy + eps, w - 2 * eps, h - 2 * eps)
+                cells = shapely.polygons(self._rotate_points(corners, angle, pivot))
+            else:
+                cells = shapely.box(gx + eps, gy + eps, gx + w - eps, gy + h - eps)
+            mask = self._cells_within(roof_polygon, cells)
+            accepted.append(np.column_stack([gx[mask], gy[mask]]))
+            if self._past_deadline():
+                # 判定済みの行までの配置を返す（屋根の下側だけが埋まった部分的な結果）
+                break
+        
+        return np.concatenate(accepted)
+    
+    def _grid_axes(self, roof_polygon: Polygon, candidate: LayoutCandidate
+                   ) -> Tuple[np.ndarray, np.ndarray, Optional[Tuple[float, float]]]:
+        """候補のグリッドのセル開始位置 (xs, ys) と回転中心（回転なしなら None）"""
+        pivot = None
+        if candidate.angle:
+            pivot = self._rotation_pivot(roof_polygon)
+            local = self._rotate_points(shapely.get_coordinates(roof_polygon), -candidate.angle, pivot)
+            minx, miny = local.min(axis=0)
+            maxx, maxy = local.max(axis=0)
+        else:
+            minx, miny, maxx, maxy = roof_polygon.bounds
+        
+        xs = self._grid_axis(minx + candidate.phase_x, maxx, candidate.w, self.spacing)
+        ys = self._grid_axis(miny + candidate.phase_y, maxy, candidate.h, self.spacing)
+        return xs, ys, pivot
+    
+    @staticmethod
+    def _grid_axis(start: float, stop: float, size: float, spacing: float) -> np.ndarray:
+        """
+        1軸方向のセル開始位置を生成（start から size + spacing 刻みで stop に収まる範囲）
+        
+        逐次加算と同じ丸め誤差になるよう np.add.accumulate で累積する。
+        """
+        if start + size > stop:
+            return np.empty(0)
+        step = size + spacing
+        steps = int((stop - start - size) // step) + 2
+        positions = np.add.accumulate(np.r_[start, np.full(steps - 1, step)])
+        return positions[positions + size <= stop]
+    
+    def _panel_arrays(self, rows: List[Tuple[LayoutCandidate, np.ndarray, Tuple[float, float]]],
+                      projection: LocalProjection) -> Dict[str, np.ndarray]:
+        """
+        配置結果（向き・セル座標・回転中心の組）から緯度経度の配列を作成
+        
+        全パネルの中心と4隅を (N, 5, 2) にまとめ、1回の配列変換で緯度経度にする。
+        """
+        points_m = []
+        codes = []
+        for candidate, origins, pivot in rows:
+            if len(origins) == 0:
+                continue
+            w, h = candidate.w, candidate.h
+            x = origins[:, 0]
+            y = origins[:, 1]
+            points = np.concatenate([
+                np.column_stack([x + w/2, y + h/2])[:, None, :],
+                self._cell_corners(x, y, w, h)
+            ], axis=1)
+            if candidate.angle:
+                points = self._rotate_points(points, candidate.angle, pivot)
+            points_m.append(points)
+            codes.append(np.full(len(origins), ORIENTATIONS.index(candidate.orientation), dtype=np.int8))
+        
+        if not points_m:
+            return {
+                'centers': np.empty((0, 2)),
+                'corners': np.empty((0, 4, 2)),
+                'orientation': np.empty(0, dtype=np.int8)
+            }
+        
+        points = projection.to_latlng(np.concatenate(points_m))
+        return {
+            'centers': points[:, 0],
+            'corners': points[:, 1:],
+            'orientation': np.concatenate(codes)
+        }
+    
+    @staticmethod
+    def _cell_corners(x: np.ndarray, y: np.ndarray, w: float, h: float) -> np.ndarray:
+        """セル左下座標の配列から4隅の座標 (N, 4, 2) を作成"""
+        return np.stack([
+            np.column_stack([x, y]),
+            np.column_stack([x + w, y]),
+            np.column_stack([x + w, y + h]),
+            np.column_stack([x, y + h])
+        ], axis=1)
     
     def get_bounds(self, polygon_coords: List[List[float]]) -> Dict:
         """多角形の境界情報を取得"""
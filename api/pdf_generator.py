@@ -9,11 +9,47 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.colors import HexColor, black, blue, green
 from reportlab.platypus import Table, TableStyle
 from reportlab.lib import colors
+from reportlab.lib.utils import ImageReader
 from PIL import Image
 import base64
+import os
+import tempfile
 from io import BytesIO
 from datetime import datetime
-from typing import Dict, List
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from projection import LocalProjection
+from layout_format import decode_panel_corners
+from instrumentation import stage
+
+# 地図画像・配置図を描く枠 (x, y, 幅, 高さ) pt
+MAP_FRAME = (50, 300, 500, 300)
+
+# 配置図の枠内の余白 (pt)
+PLAN_MARGIN = 15
+
+# 配置図の色（凡例と共通）
+ROOF_FILL = HexColor('#FF000033', hasAlpha=True)
+ROOF_STROKE = HexColor('#CC0000')
+PANEL_FILL = HexColor('#0000FF33', hasAlpha=True)
+PANEL_STROKE = HexColor('#0000CC')
+
+# パネル1枚分のパス（4隅、pt 単位で小数2桁）
+PANEL_PATH_FORMAT = '%.2f %.2f m %.2f %.2f l %.2f %.2f l %.2f %.2f l h'
+
+# 縮尺バーの長さの候補 (m)
+SCALE_BAR_LENGTHS_M = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# 地図画像を埋め込む解像度（枠の大きさに対する dpi）
+MAP_IMAGE_DPI = 150
+
+# JPEG で再エンコードするときの品質
+MAP_JPEG_QUALITY = 85
+
+# 生成した PDF をメモリに保持する上限（超えると一時ファイルに書き出す）
+PDF_SPOOL_MAX_BYTES = int(os.environ.get('PDF_SPOOL_MAX_BYTES', 4 * 1024 * 1024))
 
 class PDFGenerator:
     def __init__(self):
@@ -22,41 +58,139 @@ class PDFGenerator:
         
     def generate(self, polygon: List[List[float]], panels: List[Dict],
                 power_data: Dict, map_image_base64: str, 
-                location: Dict, panel_specs: Dict) -> BytesIO:
+                location: Dict, panel_specs: Dict, output: Optional[BinaryIO] = None) -> BinaryIO:
         """
         PDFを生成
         
         Args:
             polygon: 屋根の多角形座標
-            panels: パネル配置情報
+            panels: パネル配置情報（パネル辞書のリスト、または列指向・binary 形式）
             power_data: 発電量データ
-            map_image_base64: Google Mapsの画像（Base64）
+            map_image_base64: Google Mapsの画像（Base64、省略可）
             location: 設置場所情報
             panel_specs: パネル仕様
+            output: 書き込み先のファイルオブジェクト。省略時は一定サイズまでメモリに置き、
+                    超えた分は一時ファイルに書き出す SpooledTemporaryFile を使う
             
         Returns:
-            PDF BytesIOバッファ
+            先頭に戻した PDF のファイルオブジェクト（そのまま send_file に渡せる）
         """
-        buffer = BytesIO()
-        pdf = canvas.Canvas(buffer, pagesize=A4)
+        if output is None:
+            output = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_BYTES)
+        pdf = canvas.Canvas(output, pagesize=A4)
         
         # ページ1: レイアウト図
-        self._create_layout_page(pdf, map_image_base64, panels, polygon, location, panel_specs)
+        with stage('pdf.layout_page'):
+            self._create_layout_page(pdf, map_image_base64, panels, polygon, power_data, location, panel_specs)
         
         # ページ2: 発電量シミュレーション
-        self._create_simulation_page(pdf, power_data, location, panel_specs)
+        with stage('pdf.simulation_page'):
+            self._create_simulation_page(pdf, power_data, location, panel_specs)
+        
+        with stage('pdf.save'):
+            pdf.save()
+        output.seek(0)
+        return output
+    
+    def _draw_layout_furniture(self, pdf: canvas.Canvas):
+        """レイアウト図ページのタイトル・見出し・凡例を描画（描画状態はページ側に残さない）"""
+        pdf.saveState()
+        pdf.setFont("Helvetica-Bold", 20)
+        pdf.drawString(50, self.page_height - 50, "Solar Panel Layout Plan")
+        
+        pdf.setFont("Helvetica-Bold", 14)
+        pdf.drawString(50, 270, "Panel Configuration")
+        
+        pdf.setFont("Helvetica-Bold", 12)
+        pdf.drawString(350, 270, "Legend")
+        
+        pdf.setFont("Helvetica", 10)
+        # 屋根エリア
+        pdf.setFillColor(ROOF_FILL)
+        pdf.setStrokeColor(ROOF_STROKE)
+        pdf.rect(370, 245, 20, 10, fill=1)
+        pdf.setFillColor(black)
+        pdf.drawString(400, 248, "Roof Area")
         
-        pdf.save()
-        buffer.seek(0)
-        return buffer
+        # パネルエリア
+        pdf.setFillColor(PANEL_FILL)
+        pdf.setStrokeColor(PANEL_STROKE)
+        pdf.rect(370, 225, 20, 10, fill=1)
+        pdf.setFillColor(black)
+        pdf.setStrokeColor(black)
+        pdf.drawString(400, 228, "Solar Panels")
+        pdf.restoreState()
+    
+    def _draw_simulation_furniture(self, pdf: canvas.Canvas):
+        """発電量ページのタイトル・見出し・注意事項を描画（描画状態はページ側に残さない）"""
+        pdf.saveState()
+        pdf.setFont("Helvetica-Bold", 20)
+        pdf.drawString(50, self.page_height - 50, "Power Generation Simulation")
+        
+        pdf.setFont("Helvetica-Bold", 16)
+        pdf.drawString(50, self.page_height - 100, "Annual Generation Forecast")
+        
+        pdf.setFont("Helvetica-Bold", 14)
+        pdf.drawString(50, self.page_height - 180, "System Specifications")
+        pdf.drawString(50, self.page_height - 350, "Monthly Generation Forecast")
+        
+        pdf.setFont("Helvetica", 8)
+        pdf.drawString(50, 60, "Note: This is a simulation based on average solar irradiance data.")
+        pdf.drawString(50, 45, "Actual generation may vary depending on weather conditions and system maintenance.")
+        pdf.restoreState()
+    
+    def _draw_map_image(self, pdf: canvas.Canvas, map_image_base64: str):
+        """地図画像を枠の大きさ・MAP_IMAGE_DPI に縮小してから描画"""
+        x, y, width, height = MAP_FRAME
+        try:
+            with stage('pdf.map_image'):
+                image = ImageReader(self._prepare_map_image(map_image_base64, self._map_image_size()))
+            pdf.drawImage(image, x, y, width=width, height=height, preserveAspectRatio=True)
+        except Exception as e:
+            pdf.drawString(50, 450, f"Map image could not be loaded: {str(e)}")
+    
+    @staticmethod
+    def _map_image_size() -> Tuple[int, int]:
+        """地図枠に MAP_IMAGE_DPI で収まる画素数"""
+        _, _, width, height = MAP_FRAME
+        return round(width / 72 * MAP_IMAGE_DPI), round(height / 72 * MAP_IMAGE_DPI)
+    
+    @staticmethod
+    def _prepare_map_image(map_image_base64: str, size: Tuple[int, int]) -> BytesIO:
+        """
+        Base64 の地図画像をデコードし、size に収まるよう縮小して再エンコード
+        
+        JPEG は Image.draft でデコード時に縮小するため、大きな画像でも全画素を展開しない。
+        透過のない画像は JPEG（PDF にはそのまま DCTDecode で埋め込まれる）、透過のある画像は PNG にする。
+        
+        Returns:
+            再エンコードした画像のファイルオブジェクト
+        """
+        comma = map_image_base64.find(',')
+        image_data = base64.b64decode(map_image_base64[comma + 1:] if comma >= 0 else map_image_base64)
+        
+        image = Image.open(BytesIO(image_data))
+        image.draft('RGB', size)
+        has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+        if image.mode not in ('RGB', 'RGBA', 'L'):
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+        image.thumbnail(size, Image.LANCZOS)
+        del image_data
+        
+        encoded = BytesIO()
+        if has_alpha:
+            image.save(encoded, format='PNG', optimize=False)
+        else:
+            image.convert('RGB').save(encoded, format='JPEG', quality=MAP_JPEG_QUALITY)
+        encoded.seek(0)
+        return encoded
     
     def _create_layout_page(self, pdf: canvas.Canvas, map_image_base64: str, 
-                           panels: List[Dict], polygon: List[List[float]], 
+                           panels: List[Dict], polygon: List[List[float]], power_data: Dict,
                            location: Dict, panel_specs: Dict):
         """レイアウト図ページを作成"""
-        # タイトル
-        pdf.setFont("Helvetica-Bold", 20)
-        pdf.drawString(50, self.page_height - 50, "Solar Panel Layout Plan")
+        # タイトル・見出し・凡例
+        self._draw_layout_furniture(pdf)
         
         # 日付と場所
         pdf.setFont("Helvetica", 10)
@@ -64,33 +198,21 @@ class PDFGenerator:
         if location.get('address'):
             pdf.drawString(50, self.page_height - 95, f"Location: {location['address']}")
         
-        # Google Maps画像を描画
-        if map_image_base64:
-            try:
-                # Base64デコード
-                image_data = base64.b64decode(map_image_base64.split(',')[1] if ',' in map_image_base64 else map_image_base64)
-                image = Image.open(BytesIO(image_data))
-                
-                # 画像を一時保存
-                temp_image = BytesIO()
-                image.save(temp_image, format='PNG')
-                temp_image.seek(0)
-                
-                # PDFに画像を描画
-                pdf.drawImage(temp_image, 50, 300, width=500, height=300, preserveAspectRatio=True)
-            except Exception as e:
-                pdf.drawString(50, 450, f"Map image could not be loaded: {str(e)}")
+        # 屋根とパネルの配置図（屋根が無い場合は Google Maps画像）
+        corners = decode_panel_corners(panels)
+        has_plan = polygon is not None and len(polygon) >= 3
+        if has_plan:
+            self._draw_layout_plan(pdf, polygon, corners)
+        elif map_image_base64:
+            self._draw_map_image(pdf, map_image_base64)
         
         # パネル配置情報
-        pdf.setFont("Helvetica-Bold", 14)
-        pdf.drawString(50, 270, "Panel Configuration")
-        
         pdf.setFont("Helvetica", 11)
         info_y = 250
         
         # パネル情報を表示
         panel_info = [
-            f"Total Panels: {len(panels)}",
+            f"Total Panels: {len(corners)}",
             f"Panel Size: {panel_specs.get('width', 'N/A')}cm x {panel_specs.get('height', 'N/A')}cm",
             f"Offset: {panel_specs.get('offset', 'N/A')}cm",
             f"Total Area: {power_data.get('panel_info', {}).get('total_area_m2', 'N/A')} m²"
@@ -100,36 +222,95 @@ class PDFGenerator:
             pdf.drawString(70, info_y, info)
             info_y -= 20
         
-        # 凡例
-        pdf.setFont("Helvetica-Bold", 12)
-        pdf.drawString(350, 270, "Legend")
+        pdf.showPage()
         
-        pdf.setFont("Helvetica", 10)
-        # 屋根エリア
-        pdf.setFillColor(HexColor('#FF000033'))
-        pdf.rect(370, 245, 20, 10, fill=1)
-        pdf.setFillColor(black)
-        pdf.drawString(400, 248, "Roof Area")
+        # 配置図と Google Maps画像の両方がある場合は画像を別ページに載せる
+        if has_plan and map_image_base64:
+            pdf.setFont("Helvetica-Bold", 20)
+            pdf.drawString(50, self.page_height - 50, "Site Map")
+            self._draw_map_image(pdf, map_image_base64)
+            pdf.showPage()
+    
+    def _draw_layout_plan(self, pdf: canvas.Canvas, polygon: List[List[float]], corners: np.ndarray):
+        """
+        屋根の多角形とパネルをベクターで描画
         
-        # パネルエリア
-        pdf.setFillColor(HexColor('#0000FF33'))
-        pdf.rect(370, 225, 20, 10, fill=1)
-        pdf.setFillColor(black)
-        pdf.drawString(400, 228, "Solar Panels")
+        屋根の重心を原点とするメートル座標に変換し、縦横比を保ったまま配置図の枠に収める。
+        パネルは1枚ずつ rect を呼ばず、全パネルの4隅を1つのパスにまとめて1回で塗る。
+        """
+        projection = LocalProjection.for_polygon(polygon)
+        roof = projection.to_local(np.asarray(polygon, dtype=float))
+        panels = projection.to_local(corners) if len(corners) else np.empty((0, 4, 2))
         
-        pdf.showPage()
+        # メートル座標 → ページ座標（北が上）
+        frame_x, frame_y, frame_w, frame_h = MAP_FRAME
+        points = np.concatenate([roof, panels.reshape(-1, 2)])
+        lower = points.min(axis=0)
+        extent = np.maximum(points.max(axis=0) - lower, 1e-9)
+        scale = min((frame_w - 2 * PLAN_MARGIN) / extent[0], (frame_h - 2 * PLAN_MARGIN) / extent[1])
+        offset = np.array([frame_x + frame_w / 2, frame_y + frame_h / 2]) - (lower + extent / 2) * scale
+        roof = roof * scale + offset
+        panels = panels * scale + offset
+        
+        pdf.saveState()
+        pdf.setLineWidth(0.5)
+        pdf.setStrokeColor(colors.lightgrey)
+        pdf.rect(frame_x, frame_y, frame_w, frame_h, fill=0)
+        
+        # 屋根
+        path = pdf.beginPath()
+        self._add_polygon(path, roof)
+        pdf.setFillColor(ROOF_FILL)
+        pdf.setStrokeColor(ROOF_STROKE)
+        pdf.drawPath(path, fill=1, stroke=1)
+        
+        # パネル（全パネルで1つのパス）
+        if len(panels):
+            pdf.setLineWidth(0.25)
+            pdf.setFillColor(PANEL_FILL)
+            pdf.setStrokeColor(PANEL_STROKE)
+            # 数万枚でも速いよう、パス演算子の文字列を直接組み立てて塗り＋線 (B) で描く
+            segments = (PANEL_PATH_FORMAT % tuple(panel) for panel in panels.reshape(-1, 8).tolist())
+            pdf.addLiteral('\n'.join(segments) + '\nB')
+        
+        self._draw_scale_bar(pdf, scale)
+        pdf.restoreState()
+    
+    @staticmethod
+    def _add_polygon(path, points: np.ndarray):
+        """閉じた多角形をパスに追加"""
+        (x, y), rest = points[0], points[1:]
+        path.moveTo(x, y)
+        for x, y in rest:
+            path.lineTo(x, y)
+        path.close()
+    
+    def _draw_scale_bar(self, pdf: canvas.Canvas, points_per_meter: float):
+        """配置図の左下に縮尺バーを描画（枠の幅の 1/4 以下で最長のもの）"""
+        frame_x, frame_y, frame_w, _ = MAP_FRAME
+        fitting = [length for length in SCALE_BAR_LENGTHS_M if length * points_per_meter <= frame_w / 4]
+        if not fitting:
+            return
+        
+        length = fitting[-1]
+        x, y = frame_x + 10, frame_y + 10
+        bar = length * points_per_meter
+        pdf.setStrokeColor(black)
+        pdf.setFillColor(black)
+        pdf.setLineWidth(1)
+        pdf.line(x, y, x + bar, y)
+        pdf.line(x, y - 2, x, y + 2)
+        pdf.line(x + bar, y - 2, x + bar, y + 2)
+        pdf.setFont("Helvetica", 8)
+        pdf.drawString(x + bar + 4, y - 3, f"{length} m")
     
     def _create_simulation_page(self, pdf: canvas.Canvas, power_data: Dict, 
                                location: Dict, panel_specs: Dict):
         """発電量シミュレーションページを作成"""
-        # タイトル
-        pdf.setFont("Helvetica-Bold", 20)
-        pdf.drawString(50, self.page_height - 50, "Power Generation Simulation")
+        # タイトル・見出し・注意事項
+        self._draw_simulation_furniture(pdf)
         
         # 年間発電量
-        pdf.setFont("Helvetica-Bold", 16)
-        pdf.drawString(50, self.page_height - 100, "Annual Generation Forecast")
-        
         yearly_total = power_data.get('yearly_total_kwh', 0)
         pdf.setFont("Helvetica-Bold", 24)
         pdf.setFillColor(green)
@@ -137,9 +318,6 @@ class PDFGenerator:
         pdf.setFillColor(black)
         
         # システム仕様
-        pdf.setFont("Helvetica-Bold", 14)
-        pdf.drawString(50, self.page_height - 180, "System Specifications")
-        
         pdf.setFont("Helvetica", 11)
         specs_y = self.page_height - 200
         
@@ -157,9 +335,6 @@ class PDFGenerator:
             specs_y -= 20
         
         # 月別発電量グラフ（簡易的な棒グラフ）
-        pdf.setFont("Helvetica-Bold", 14)
-        pdf.drawString(50, self.page_height - 350, "Monthly Generation Forecast")
-        
         # グラフエリア
         graph_x = 70
         graph_y = 200
@@ -206,9 +381,4 @@ class PDFGenerator:
         pdf.setFont("Helvetica", 10)
         pdf.drawString(50, 100, f"Location: Lat {location.get('lat', 'N/A')}, Lng {location.get('lng', 'N/A')}")
         
-        # 注意事項
-        pdf.setFont("Helvetica", 8)
-        pdf.drawString(50, 60, "Note: This is a simulation based on average solar irradiance data.")
-        pdf.drawString(50, 45, "Actual generation may vary depending on weather conditions and system maintenance.")
-        
         pdf.showPage()
\ No newline at end of file
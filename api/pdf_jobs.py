@@ -0,0 +1,187 @@
+"""
+PDF Jobs
+PDF 生成をプロセスプールで非同期に実行するジョブキュー
+"""
+
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Dict, Optional
+
+from worker_pool import get_process_pool
+
+# ジョブ ID の形式（spool ディレクトリ内のファイル名に使うため厳密に検証する）
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# 期限切れジョブの掃除を行う最短間隔（秒）
+CLEANUP_INTERVAL_SECONDS = 60
+
+
+class QueueFullError(Exception):
+    """未完了のジョブ数が上限に達している"""
+
+
+def render_pdf_job(payload: Dict, path: str) -> int:
+    """
+    PDF を生成して path に書き出す（プロセスプールのワーカーで実行）
+
+    書きかけのファイルが配信されないよう、一時ファイルに書いてから置き換える。
+
+    Returns:
+        ファイルサイズ (bytes)
+    """
+    # reportlab・PIL はワーカープロセスでだけ読み込む
+    from pdf_generator import PDFGenerator
+    
+    tmp_path = f'{path}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            PDFGenerator().generate(
+                polygon=payload.get('polygon', []),
+                panels=payload.get('panels', []),
+                power_data=payload.get('power_data', {}),
+                map_image_base64=payload.get('map_image', ''),
+                location=payload.get('location', {}),
+                panel_specs=payload.get('panel_specs', {}),
+                output=f
+            )
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return os.path.getsize(path)
+
+
+class PDFJobQueue:
+    def __init__(self, spool_dir: str, max_pending: int = 8, ttl_seconds: float = 3600,
+                 max_workers: Optional[int] = None):
+        """
+        PDF 生成ジョブの管理
+
+        ジョブは名前付きプロセスプール 'pdf' で実行し、完成した PDF は spool_dir に置く。
+        未完了のジョブが max_pending 件に達している間は新しいジョブを受け付けない。
+        完了から ttl_seconds 経過したジョブとファイルは削除する。
+
+        Args:
+            spool_dir: 完成した PDF を置くディレクトリ
+            max_pending: 未完了（待機中・実行中）ジョブの上限
+            ttl_seconds: 完成したジョブを保持する時間（秒）
+            max_workers: PDF 生成に使うワーカー数（プール作成時のみ有効）
+        """
+        self.spool_dir = spool_dir
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self.max_workers = max_workers
+        self._jobs: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+
+    def submit(self, payload: Dict) -> str:
+        """
+        ジョブを登録して ID を返す
+
+        Raises:
+            QueueFullError: 未完了のジョブが上限に達している場合
+        """
+        self.cleanup()
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+        job_id = uuid.uuid4().hex
+        path = self._job_path(job_id)
+        with self._lock:
+            if self._pending_count() >= self.max_pending:
+                raise QueueFullError(f"Too many pending PDF jobs (limit {self.max_pending})")
+
+            pool = get_process_pool('pdf', self.max_workers)
+            future = pool.submit(render_pdf_job, payload, path)
+            self._jobs[job_id] = {'future': future, 'path': path, 'created': time.time(), 'finished': None}
+        future.add_done_callback(lambda _: self._mark_finished(job_id))
+        return job_id
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        """
+        ジョブの状態を返す。未知・期限切れなら None
+
+        Returns:
+            {'job_id', 'status': 'queued' | 'running' | 'done' | 'failed', 'path'?, 'error'?}
+        """
+        if not JOB_ID_PATTERN.match(job_id):
+            return None
+        self.cleanup()
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            # 別のワーカープロセスで生成された PDF も spool に残っていれば返す
+            path = self._job_path(job_id)
+            if os.path.exists(path):
+                return {'job_id': job_id, 'status': 'done', 'path': path}
+            return None
+
+        future: Future = job['future']
+        if not future.done():
+            return {'job_id': job_id, 'status': 'running' if future.running() else 'queued'}
+        error = future.exception()
+        if error is not None:
+            return {'job_id': job_id, 'status': 'failed', 'error': str(error)}
+        return {'job_id': job_id, 'status': 'done', 'path': job['path']}
+
+    def cleanup(self, force: bool = False):
+        """完了から ttl_seconds 経過したジョブと、spool ディレクトリの古いファイルを削除"""
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_cleanup < CLEANUP_INTERVAL_SECONDS:
+                return
+            self._last_cleanup = now
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job['finished'] is not None and now - job['finished'] > self.ttl_seconds]
+            for job_id in expired:
+                del self._jobs[job_id]
+            active = {job['path'] for job in self._jobs.values()}
+
+        # 再起動前のプロセスが残したファイルも更新時刻で判定して消す
+        try:
+            entries = list(os.scandir(self.spool_dir))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.path not in active and now - entry.stat().st_mtime > self.ttl_seconds:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'pending': self._pending_count(),
+                'total': len(self._jobs),
+                'max_pending': self.max_pending
+            }
+
+    def _pending_count(self) -> int:
+        """未完了のジョブ数（ロック取得済みで呼ぶ）"""
+        return sum(1 for job in self._jobs.values() if job['finished'] is None)
+
+    def _mark_finished(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job['finished'] = time.time()
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.spool_dir, f'{job_id}.pdf')
+
+
+# プロセス内で共有するジョブキュー
+pdf_jobs = PDFJobQueue(
+    spool_dir=os.environ.get('PDF_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'solar-pdf-jobs')),
+    max_pending=int(os.environ.get('PDF_MAX_PENDING_JOBS', 8)),
+    ttl_seconds=float(os.environ.get('PDF_JOB_TTL', 3600)),
+    max_workers=int(os.environ.get('PDF_WORKERS', 2))
+)
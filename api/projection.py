@@ -0,0 +1,153 @@
+"""
+Local Projection Module
+屋根単位のローカル横メルカトル座標系（緯度経度 ⇔ メートル）への配列変換
+"""
+
+import math
+from functools import lru_cache
+from typing import List, Sequence
+
+import numpy as np
+
+# GRS80 楕円体（JGD2011 / WGS84 と実用上同一）
+_A = 6378137.0
+_F = 1 / 298.257222101
+_N = _F / (2 - _F)
+
+# Krüger 級数の係数（n の4次まで）
+_RECTIFYING_RADIUS = _A / (1 + _N) * (1 + _N**2 / 4 + _N**4 / 64)
+_ALPHA = np.array([
+    _N / 2 - 2 * _N**2 / 3 + 5 * _N**3 / 16 + 41 * _N**4 / 180,
+    13 * _N**2 / 48 - 3 * _N**3 / 5 + 557 * _N**4 / 1440,
+    61 * _N**3 / 240 - 103 * _N**4 / 140,
+    49561 * _N**4 / 161280,
+])
+_BETA = np.array([
+    _N / 2 - 2 * _N**2 / 3 + 37 * _N**3 / 96 - _N**4 / 360,
+    _N**2 / 48 + _N**3 / 15 - 437 * _N**4 / 1440,
+    17 * _N**3 / 480 - 37 * _N**4 / 840,
+    4397 * _N**4 / 161280,
+])
+_DELTA = np.array([
+    2 * _N - 2 * _N**2 / 3 - 2 * _N**3 + 116 * _N**4 / 45,
+    7 * _N**2 / 3 - 8 * _N**3 / 5 - 227 * _N**4 / 45,
+    56 * _N**3 / 15 - 136 * _N**4 / 35,
+    4279 * _N**4 / 630,
+])
+_E_FACTOR = 2 * math.sqrt(_N) / (1 + _N)
+
+
+class LocalProjection:
+    def __init__(self, origin_lat: float, origin_lng: float):
+        """
+        原点を中心とするローカル横メルカトル投影（縮尺係数 1）
+        
+        x は東方向、y は北方向のメートル値で、原点が (0, 0) になる。
+        GRS80 楕円体の Krüger 級数（4次）を用いており、原点から 10 km 以内では
+        往復変換の誤差は 緯度経度 → メートル → 緯度経度 で 1e-10 度未満、
+        メートル → 緯度経度 → メートル で 0.01 mm 未満に収まる。
+        縮尺の歪みは原点から 1 km で約 1e-8 と、屋根の規模では無視できる。
+        
+        Args:
+            origin_lat: 原点の緯度
+            origin_lng: 原点の経度（中央子午線）
+        """
+        self.origin_lat = origin_lat
+        self.origin_lng = origin_lng
+        self._origin_northing = float(self._forward(np.array([origin_lat]), np.array([0.0]))[1][0])
+    
+    @classmethod
+    def for_polygon(cls, polygon_coords: Sequence[Sequence[float]]) -> 'LocalProjection':
+        """多角形（[[lat, lng], ...]）の重心を原点とする投影を取得（同一原点はキャッシュを共有）"""
+        lat, lng = polygon_centroid(polygon_coords)
+        return get_projection(round(lat, 7), round(lng, 7))
+    
+    def to_local(self, latlng: np.ndarray) -> np.ndarray:
+        """
+        緯度経度をローカル座標に変換
+        
+        Args:
+            latlng: (..., 2) 形式の [lat, lng] 配列
+            
+        Returns:
+            (..., 2) 形式の [x, y] 配列（メートル）
+        """
+        latlng = np.asarray(latlng, dtype=float)
+        x, y = self._forward(latlng[..., 0], latlng[..., 1] - self.origin_lng)
+        return np.stack([x, y - self._origin_northing], axis=-1)
+    
+    def to_latlng(self, xy: np.ndarray) -> np.ndarray:
+        """
+        ローカル座標を緯度経度に変換
+        
+        Args:
+            xy: (..., 2) 形式の [x, y] 配列（メートル）
+            
+        Returns:
+            (..., 2) 形式の [lat, lng] 配列
+        """
+        xy = np.asarray(xy, dtype=float)
+        zeta = ((xy[..., 1] + self._origin_northing) + 1j * xy[..., 0]) / _RECTIFYING_RADIUS
+        zeta_p = zeta - _sine_series(_BETA, zeta)
+        xi_p, eta_p = zeta_p.real, zeta_p.imag
+        
+        chi = np.arcsin(np.sin(xi_p) / np.cosh(eta_p))
+        lat = chi + _sine_series(_DELTA, chi)
+        dlng = np.arctan2(np.sinh(eta_p), np.cos(xi_p))
+        
+        return np.stack([np.degrees(lat), self.origin_lng + np.degrees(dlng)], axis=-1)
+    
+    @staticmethod
+    def _forward(lat_deg: np.ndarray, dlng_deg: np.ndarray):
+        """中央子午線からの経度差を用いた横メルカトル順変換（赤道基準の northing を返す）"""
+        phi = np.radians(lat_deg)
+        dlam = np.radians(dlng_deg)
+        
+        sin_phi = np.sin(phi)
+        t = np.sinh(np.arctanh(sin_phi) - _E_FACTOR * np.arctanh(_E_FACTOR * sin_phi))
+        zeta_p = np.arctan2(t, np.cos(dlam)) + 1j * np.arctanh(np.sin(dlam) / np.sqrt(1 + t * t))
+        zeta = zeta_p + _sine_series(_ALPHA, zeta_p)
+        
+        return _RECTIFYING_RADIUS * zeta.imag, _RECTIFYING_RADIUS * zeta.real
+
+
+def _sine_series(coefficients: np.ndarray, z: np.ndarray) -> np.ndarray:
+    """
+    Σ c_j sin(2jz) を Clenshaw 法で評価（z は実数・複素数どちらも可）
+    
+    複素数 z = ξ + iη では sin(2jξ)cosh(2jη) + i cos(2jξ)sinh(2jη) の和を一度に求められる。
+    """
+    two_cos = 2 * np.cos(2 * z)
+    b1 = np.zeros_like(z)
+    b2 = np.zeros_like(z)
+    for c in coefficients[::-1]:
+        b1, b2 = c + two_cos * b1 - b2, b1
+    return b1 * np.sin(2 * z)
+
+
+@lru_cache(maxsize=256)
+def get_projection(origin_lat: float, origin_lng: float) -> LocalProjection:
+    """原点ごとの投影インスタンスを取得（キャッシュ付き）"""
+    return LocalProjection(origin_lat, origin_lng)
+
+
+def polygon_centroid(polygon_coords: Sequence[Sequence[float]]) -> List[float]:
+    """
+    多角形の面積重心 [lat, lng] を求める（屋根程度の範囲では緯度経度を平面として扱う）
+    
+    面積が 0 の場合は頂点の平均を返す。
+    """
+    coords = np.asarray(polygon_coords, dtype=float)
+    lat = coords[:, 0]
+    lng = coords[:, 1]
+    lat_c = lat - lat.mean()
+    lng_c = lng - lng.mean()
+    
+    cross = lng_c * np.roll(lat_c, -1) - np.roll(lng_c, -1) * lat_c
+    area = cross.sum() / 2
+    if abs(area) < 1e-18:
+        return [float(lat.mean()), float(lng.mean())]
+    
+    c_lng = ((lng_c + np.roll(lng_c, -1)) * cross).sum() / (6 * area)
+    c_lat = ((lat_c + np.roll(lat_c, -1)) * cross).sum() / (6 * area)
+    return [float(lat.mean() + c_lat), float(lng.mean() + c_lng)]
@@ -0,0 +1,178 @@
+"""
+Roof Faces
+設置角度・方位・オフセットが異なる複数の屋根面をまとめて配置・発電量計算する
+"""
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from panel_layout import PanelLayout, LAYOUT_MODES, parse_keepouts
+from solar_calc import SolarCalculator
+
+# 1リクエストで受け付ける屋根面の最大数
+MAX_FACES = 50
+
+# 屋根面ごとに上書きできる項目と既定値（tilt / azimuth の None は SolarCalculator の既定値）
+FACE_DEFAULTS = {
+    'offset': 10,
+    'layout_mode': 'grid',
+    'phase_steps': 4,
+    'keepouts': [],
+    'tilt': None,
+    'azimuth': None,
+}
+
+# 同じ向きとみなす設置角度・方位の丸め桁数（度）
+ORIENTATION_DIGITS = 1
+
+
+def resolve_faces(data: Dict) -> List[Dict]:
+    """
+    リクエストボディから屋根面ごとの設定を組み立てる
+
+    トップレベルの offset などを共通設定とし、各屋根面の同名項目で上書きする。
+    パネル寸法は全ての屋根面で共通。
+
+    Args:
+        data: {"faces": [{"polygon": [[lat, lng], ...], "tilt": ..., ...}, ...], 共通設定...}
+
+    Returns:
+        屋根面ごとの設定のリスト
+
+    Raises:
+        ValueError: 入力が不正な場合
+    """
+    faces = data.get('faces')
+    if not isinstance(faces, list) or not faces:
+        raise ValueError("faces must be a non-empty array")
+    if len(faces) > MAX_FACES:
+        raise ValueError(f"Too many faces. At most {MAX_FACES} per request.")
+
+    solar_calc = SolarCalculator()
+    shared = {key: data.get(key, default) for key, default in FACE_DEFAULTS.items()}
+    resolved = []
+    for index, face in enumerate(faces):
+        if not isinstance(face, dict):
+            raise ValueError(f"faces[{index}] must be an object")
+        spec = {key: face.get(key, value) for key, value in shared.items()}
+        spec['id'] = face.get('id', index)
+        spec['polygon'] = face.get('polygon', [])
+        spec['panel_width'] = data.get('panel_width', 165)
+        spec['panel_height'] = data.get('panel_height', 100)
+
+        if not spec['polygon'] or len(spec['polygon']) < 3:
+            raise ValueError(f"faces[{index}]: Invalid polygon. At least 3 points required.")
+        if spec['layout_mode'] not in LAYOUT_MODES:
+            raise ValueError(f"faces[{index}]: Invalid layout_mode. Use one of: {', '.join(LAYOUT_MODES)}")
+        try:
+            spec['keepouts'] = parse_keepouts(spec['keepouts'] or [])
+        except ValueError as e:
+            raise ValueError(f"faces[{index}]: {e}")
+        try:
+            spec['tilt'] = round(float(solar_calc.default_tilt if spec['tilt'] is None else spec['tilt']),
+                                 ORIENTATION_DIGITS)
+            spec['azimuth'] = round(float(solar_calc.default_azimuth if spec['azimuth'] is None else spec['azimuth'])
+                                    % 360, ORIENTATION_DIGITS)
+        except (TypeError, ValueError):
+            raise ValueError(f"faces[{index}]: tilt and azimuth must be numbers")
+        if not 0 <= spec['tilt'] <= 90:
+            raise ValueError(f"faces[{index}]: tilt must be between 0 and 90")
+        resolved.append(spec)
+    return resolved
+
+
+def calculate_faces(faces: List[Dict], face_arrays: List[Dict[str, np.ndarray]], latitude: float,
+                    longitude: float, solar_calc: SolarCalculator = None) -> Tuple[Dict, Dict[str, np.ndarray]]:
+    """
+    全屋根面の配置から発電量を計算して集計
+
+    配置は呼び出し元で屋根面ごとに計算しておく（LayoutRunner.run_many で共通の deadline を適用）。
+    日射量は向き（設置角度・方位）ごとに1回だけ求め、同じ向きの屋根面で共有する。
+
+    Args:
+        faces: resolve_faces で組み立てた屋根面ごとの設定
+        face_arrays: faces と同じ順の屋根面ごとの配置配列
+        latitude, longitude: 設置地点
+        solar_calc: 発電量計算に使うインスタンス（省略時は新規作成）
+
+    Returns:
+        (レスポンス, 全屋根面を連結した配置配列)。レスポンスの faces[i].panel_range が
+        連結した配列（panels）の中での屋根面 i の範囲 [start, end)
+    """
+    solar_calc = solar_calc or SolarCalculator()
+
+    profiles = {}
+    for spec in faces:
+        orientation = (spec['tilt'], spec['azimuth'])
+        if orientation not in profiles:
+            profiles[orientation] = solar_calc.orientation_profile(latitude, longitude, *orientation)
+
+    results = []
+    start = 0
+    for index, (spec, arrays) in enumerate(zip(faces, face_arrays)):
+        panel_count = len(arrays['orientation'])
+        panel_area = spec['panel_width'] * spec['panel_height'] / 10000
+        power_data = solar_calc.power_from_orientation(
+            latitude, longitude, panel_count, panel_area,
+            profiles[(spec['tilt'], spec['azimuth'])], spec['tilt'], spec['azimuth']
+        )
+        results.append({
+            "index": index,
+            "id": spec['id'],
+            "panel_count": panel_count,
+            "total_area": panel_count * panel_area,
+            "tilt": spec['tilt'],
+            "azimuth": spec['azimuth'],
+            "offset": spec['offset'],
+            "panel_range": [start, start + panel_count],
+            "power_estimation": power_data,
+            "layout_bounds": PanelLayout(spec['panel_width'], spec['panel_height'], spec['offset']).get_bounds(spec['polygon'])
+        })
+        start += panel_count
+
+    layout_arrays = {name: np.concatenate([arrays[name] for arrays in face_arrays])
+                     for name in face_arrays[0]}
+    all_points = [point for spec in faces for point in spec['polygon']]
+    response = {
+        "panel_count": start,
+        "total_area": sum(face['total_area'] for face in results),
+        "power_estimation": aggregate_power([face['power_estimation'] for face in results],
+                                            latitude, longitude, len(profiles)),
+        "faces": results,
+        "layout_bounds": PanelLayout(faces[0]['panel_width'], faces[0]['panel_height'], 0).get_bounds(all_points)
+    }
+    return response, layout_arrays
+
+
+def aggregate_power(power_list: List[Dict], latitude: float, longitude: float,
+                    orientation_count: int) -> Dict:
+    """屋根面ごとの発電量データを合計"""
+    monthly_data = []
+    for month in range(1, 13):
+        generation = sum(power['monthly_data'][month - 1]['generation_kwh'] for power in power_list)
+        monthly_data.append({'month': month, 'generation_kwh': round(generation, 2)})
+
+    count = sum(power['panel_info']['count'] for power in power_list)
+    first = power_list[0]
+    return {
+        'yearly_total_kwh': round(sum(power['yearly_total_kwh'] for power in power_list), 2),
+        'monthly_data': monthly_data,
+        'panel_info': {
+            'count': count,
+            'total_area_m2': round(sum(power['panel_info']['total_area_m2'] for power in power_list), 2),
+            'rated_power_per_panel_w': first['panel_info']['rated_power_per_panel_w'],
+            'total_rated_power_kw': round(sum(power['panel_info']['total_rated_power_kw'] for power in power_list), 2)
+        },
+        'assumptions': {
+            'system_efficiency': first['assumptions']['system_efficiency'],
+            'panel_efficiency': first['assumptions']['panel_efficiency'],
+            'irradiance_model': 'hourly',
+            'faces': len(power_list),
+            'orientations': orientation_count,
+            'location': {
+                'latitude': latitude,
+                'longitude': longitude
+            }
+        }
+    }
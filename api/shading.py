@@ -0,0 +1,354 @@
+"""
+Shading Analysis
+周辺の建物・煙突などの障害物の影を考慮したパネルごとの年間発電量
+"""
+
+from typing import TYPE_CHECKING, Dict, List, NamedTuple
+
+import numpy as np
+import shapely
+
+from projection import LocalProjection
+from instrumentation import timed
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# 1リクエストで受け付ける障害物の上限
+MAX_OBSTACLES = 200
+
+# 太陽位置を抽出する日の間隔（日）。抽出した日の値を月ごとに日数で按分する
+SAMPLE_DAY_STEP = 7
+
+# これより低い太陽高度は影の計算から除外（度）。影が極端に長くなる一方で直達日射はわずか
+MIN_SUN_ELEVATION = 5.0
+
+# 凸包で影を作る障害物かどうかの判定に用いる面積の許容比
+CONVEX_TOLERANCE = 1e-6
+
+# 交差面積を配列演算で求めるときに一度に処理する組の数
+OVERLAP_CHUNK = 8192
+
+
+def parse_obstacles(obstacles) -> List[Dict]:
+    """
+    リクエストの障害物リストを検証して正規化
+
+    Args:
+        obstacles: [{"polygon": [[lat, lng], ...], "height": float}, ...]
+                   height は屋根面（パネル面）からの高さ (m)
+
+    Returns:
+        float に揃えた障害物のリスト
+
+    Raises:
+        ValueError: 形式が不正な場合
+    """
+    if not isinstance(obstacles, list):
+        raise ValueError("obstacles must be a list")
+    if len(obstacles) > MAX_OBSTACLES:
+        raise ValueError(f"Too many obstacles ({len(obstacles)}). At most {MAX_OBSTACLES}.")
+
+    parsed = []
+    for i, obstacle in enumerate(obstacles):
+        if not isinstance(obstacle, dict):
+            raise ValueError(f"obstacles[{i}] must be an object")
+        polygon = obstacle.get('polygon')
+        if not isinstance(polygon, list) or len(polygon) < 3:
+            raise ValueError(f"obstacles[{i}]: polygon needs at least 3 points")
+        try:
+            points = [[float(lat), float(lng)] for lat, lng in polygon]
+            height = float(obstacle.get('height'))
+        except (TypeError, ValueError):
+            raise ValueError(f"obstacles[{i}]: polygon points and height must be numbers")
+        if not height > 0:
+            raise ValueError(f"obstacles[{i}]: height must be positive")
+        parsed.append({'polygon': points, 'height': height})
+    return parsed
+
+
+class ShadingResult(NamedTuple):
+    """パネルごとの影による損失（日射量は傾斜面 1 m² あたりの温度補正後の値）"""
+    shaded_wh_m2: np.ndarray    # (N, 12) 月別に影で失われる直達日射量 (Wh/m²)
+    unshaded_wh_m2: np.ndarray  # (12,) 影が無い場合の月別日射量 (Wh/m²)
+    sample_count: int           # 影を計算した太陽位置の数
+
+    def yield_ratio(self) -> np.ndarray:
+        """パネルごとの影なしに対する年間発電量の比 (N,)"""
+        total = max(float(self.unshaded_wh_m2.sum()), 1e-9)
+        return 1 - self.shaded_wh_m2.sum(axis=1) / total
+
+    def monthly_ratio(self) -> np.ndarray:
+        """全パネル合計での影なしに対する月別発電量の比 (12,)"""
+        if len(self.shaded_wh_m2) == 0:
+            return np.ones(12)
+        unshaded = np.maximum(self.unshaded_wh_m2, 1e-9) * len(self.shaded_wh_m2)
+        return 1 - self.shaded_wh_m2.sum(axis=0) / unshaded
+
+    def subset(self, mask: np.ndarray) -> 'ShadingResult':
+        """mask で選んだパネルだけの結果"""
+        return self._replace(shaded_wh_m2=self.shaded_wh_m2[mask])
+
+
+class ShadingAnalysis:
+    def __init__(self, obstacles: List[Dict], projection: LocalProjection,
+                 day_step: int = SAMPLE_DAY_STEP):
+        """
+        障害物の影によるパネルごとの損失を計算するクラス
+
+        屋根面を水平とみなし、高さ h の障害物の影を「足元の多角形を太陽と反対方向に
+        h / tan(太陽高度) だけ動かした掃引領域」として平面上で求める。
+        影は直達日射だけを遮り、散乱日射は遮らないものとする。
+
+        Args:
+            obstacles: parse_obstacles で正規化した障害物
+            projection: パネル配置と同じローカル座標系
+            day_step: 太陽位置を抽出する日の間隔（日）
+        """
+        self.projection = projection
+        self.day_step = day_step
+        self._obstacles = []
+        for obstacle in obstacles:
+            vertices = projection.to_local(obstacle['polygon'])
+            footprint = shapely.make_valid(shapely.polygons(vertices))
+            hull_area = shapely.area(shapely.convex_hull(footprint))
+            convex = hull_area - shapely.area(footprint) <= CONVEX_TOLERANCE * max(hull_area, 1e-9)
+            self._obstacles.append((vertices, footprint, obstacle['height'], convex))
+
+    @timed('shading')
+    def evaluate(self, corners: np.ndarray, hourly: 'pd.DataFrame') -> ShadingResult:
+        """
+        全パネルの月別の影による損失を計算
+
+        Args:
+            corners: (N, 4, 2) のパネル4隅 [lat, lng]
+            hourly: SolarCalculator.get_hourly_profile の代表年 8760 時間のプロファイル
+
+        Returns:
+            ShadingResult
+        """
+        month = hourly.index.month.values
+        unshaded = np.bincount(month - 1, weights=(hourly['poa_global'] * hourly['temperature_factor']).values,
+                               minlength=12)
+
+        sample_month, weights, offsets = self._sun_samples(hourly)
+        panel_count = len(corners)
+        shaded = np.zeros((panel_count, 12))
+        if panel_count and self._obstacles and len(weights):
+            panels = shapely.polygons(self.projection.to_local(corners))
+            panel_idx, sample_idx, fraction = self._shaded_fractions(panels, offsets)
+            shaded = np.bincount(
+                panel_idx * 12 + sample_month[sample_idx] - 1,
+                weights=fraction * weights[sample_idx],
+                minlength=panel_count * 12
+            ).reshape(panel_count, 12)
+
+        return ShadingResult(shaded, unshaded, len(weights))
+
+    def _sun_samples(self, hourly: 'pd.DataFrame'):
+        """
+        影を計算する太陽位置を抽出
+
+        day_step 日ごとの日中の各時刻を取り出し、月の日数 / 抽出した日数 を掛けて
+        月全体の直達日射量を代表させる。
+
+        Returns:
+            (月 (S,), 重み Wh/m² (S,), 高さ 1 m あたりの影の移動量 (S, 2))
+        """
+        index = hourly.index
+        month = index.month.values
+        sampled_day = index.dayofyear.values % self.day_step == self.day_step // 2
+
+        days_in_month = np.bincount(month - 1, minlength=12) / 24
+        sampled_days = np.bincount(month[sampled_day] - 1, minlength=12) / 24
+        scale = days_in_month / np.maximum(sampled_days, 1)
+
+        elevation = hourly['solar_elevation'].values
+        direct = (hourly['poa_direct'] * hourly['temperature_factor']).values
+        selected = sampled_day & (elevation >= MIN_SUN_ELEVATION) & (direct > 0)
+
+        azimuth = np.radians(hourly['solar_azimuth'].values[selected])
+        # 影は太陽と反対方向（x: 東、y: 北）に伸びる
+        offsets = -np.column_stack([np.sin(azimuth), np.cos(azimuth)]) / np.tan(np.radians(elevation[selected]))[:, None]
+        return month[selected], direct[selected] * scale[month[selected] - 1], offsets
+
+    def _shadows(self, offsets: np.ndarray) -> np.ndarray:
+        """
+        障害物ごと・太陽位置ごとの影の多角形 (K, S)
+
+        凸な障害物は足元と移動後の頂点の凸包、凸でない障害物は各辺の掃引四角形と
+        足元・移動後の多角形の和集合とする。
+        """
+        shadows = []
+        for vertices, footprint, height, convex in self._obstacles:
+            shift = offsets * height
+            moved = vertices[None] + shift[:, None]
+            base = np.broadcast_to(vertices, moved.shape)
+            if convex:
+                shadows.append(shapely.convex_hull(shapely.multipoints(np.concatenate([base, moved], axis=1))))
+                continue
+
+            quads = np.stack([base, np.roll(base, -1, axis=1), np.roll(moved, -1, axis=1), moved], axis=2)
+            swept = shapely.convex_hull(shapely.multipoints(quads))
+            parts = np.concatenate([
+                swept,
+                shapely.make_valid(shapely.polygons(moved))[:, None],
+                np.full((len(offsets), 1), footprint, dtype=object)
+            ], axis=1)
+            shadows.append(shapely.union_all(parts, axis=1))
+        return np.stack(shadows)
+
+    def _shaded_fractions(self, panels: np.ndarray, offsets: np.ndarray):
+        """
+        影が掛かるパネルと太陽位置の組と、影に覆われた面積の割合
+
+        パネルの STRtree に障害物ごとの影で問い合わせて交差する組を求め、交差部分の面積比を取る。
+        凸な影とパネルの交差面積は _convex_overlap_area で配列演算によりまとめて求める。
+        同じ太陽位置で複数の障害物の影が一部ずつ掛かるパネルだけ、影を合成して重なりを除く。
+
+        Returns:
+            (パネル番号, 太陽位置の番号, 影の面積比) の配列
+        """
+        shadows = self._shadows(offsets)
+        sample_count = len(offsets)
+        flat_shadows = shadows.ravel()
+        shapely.prepare(flat_shadows)
+
+        tree = shapely.STRtree(panels)
+        shadow_idx, panel_idx = tree.query(flat_shadows, predicate='intersects')
+        panel_area = shapely.area(panels)
+
+        fraction = np.empty(len(panel_idx))
+        convex_rows = np.array([convex for _, _, _, convex in self._obstacles])
+        convex = convex_rows[shadow_idx // sample_count]
+        if convex.any():
+            convex_flat = np.repeat(convex_rows, sample_count)
+            ring_index = np.cumsum(convex_flat) - 1
+            shadow_rings = _rings(flat_shadows[convex_flat])
+            panel_rings = _rings(panels)
+            pairs = np.flatnonzero(convex)
+            for start in range(0, len(pairs), OVERLAP_CHUNK):
+                chunk = pairs[start:start + OVERLAP_CHUNK]
+                fraction[chunk] = _convex_overlap_area(
+                    panel_rings[panel_idx[chunk]], shadow_rings[ring_index[shadow_idx[chunk]]]
+                ) / panel_area[panel_idx[chunk]]
+        if not convex.all():
+            pairs = np.flatnonzero(~convex)
+            overlap = shapely.intersection(panels[panel_idx[pairs]], flat_shadows[shadow_idx[pairs]])
+            fraction[pairs] = shapely.area(overlap) / panel_area[panel_idx[pairs]]
+        fraction = np.clip(fraction, 0.0, 1.0)
+
+        keys, inverse, counts = np.unique(panel_idx * sample_count + shadow_idx % sample_count,
+                                          return_inverse=True, return_counts=True)
+        result = np.minimum(np.bincount(inverse, weights=fraction), 1.0)
+
+        # 複数の影が一部ずつ掛かる組は、影を合成した多角形との交差面積で置き換える
+        covered = np.bincount(inverse, weights=fraction >= 1.0) > 0
+        overlapped = np.flatnonzero((counts > 1) & ~covered)
+        if len(overlapped):
+            order = np.argsort(inverse, kind='stable')
+            starts = np.cumsum(counts) - counts
+            members = np.full((len(overlapped), counts[overlapped].max()), None, dtype=object)
+            for column in range(members.shape[1]):
+                has_member = counts[overlapped] > column
+                member = order[starts[overlapped[has_member]] + column]
+                members[has_member, column] = flat_shadows[shadow_idx[member]]
+            group_panels = panels[keys[overlapped] // sample_count]
+            merged = shapely.intersection(group_panels, shapely.union_all(members, axis=1))
+            result[overlapped] = shapely.area(merged) / shapely.area(group_panels)
+
+        panel_idx, sample_idx = np.divmod(keys, sample_count)
+        return panel_idx, sample_idx, result
+
+
+def _rings(polygons: np.ndarray) -> np.ndarray:
+    """
+    多角形の外周を反時計回りに揃えた (M, V, 2) の配列にする
+
+    頂点数が V に満たない多角形は閉じた最後の頂点を繰り返して埋める（長さ 0 の辺になる）。
+    """
+    coords, index = shapely.get_coordinates(shapely.get_exterior_ring(polygons), return_index=True)
+    counts = np.bincount(index, minlength=len(polygons))
+    starts = np.cumsum(counts) - counts
+    positions = np.minimum(np.arange(counts.max())[None, :], counts[:, None] - 1) + starts[:, None]
+    rings = coords[positions]
+
+    x, y = rings[..., 0], rings[..., 1]
+    clockwise = (x[:, :-1] * y[:, 1:] - x[:, 1:] * y[:, :-1]).sum(axis=1) < 0
+    rings[clockwise] = rings[clockwise, ::-1]
+    return rings
+
+
+def _convex_overlap_area(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    凸多角形の組ごとの交差面積
+
+    交差部分の外周は「b の内側にある a の辺」と「a の内側にある b の辺」からなるため、
+    各辺を相手の多角形で切り取り（Cyrus-Beck）、グリーンの定理で面積を足し合わせる。
+    同じ向きに重なる辺は a 側だけで数え、逆向きに接する辺はどちらでも数えない。
+
+    Args:
+        a, b: _rings 形式の (M, Va, 2) と (M, Vb, 2)
+
+    Returns:
+        (M,) の面積
+    """
+    return _clipped_edge_area(a, b, strict=False) + _clipped_edge_area(b, a, strict=True)
+
+
+def _clipped_edge_area(a: np.ndarray, b: np.ndarray, strict: bool) -> np.ndarray:
+    """a の各辺のうち b の内側にある部分の、グリーンの定理による面積への寄与の合計"""
+    p0 = a[:, :-1, None, :]
+    d = (a[:, 1:] - a[:, :-1])[:, :, None, :]
+    q = b[:, None, :-1, :]
+    e = (b[:, 1:] - b[:, :-1])[:, None, :, :]
+
+    # b の辺の外向き法線 n に対し、n・(p0 + t d - q) <= 0 が内側
+    nx, ny = e[..., 1], -e[..., 0]
+    num = nx * (p0[..., 0] - q[..., 0]) + ny * (p0[..., 1] - q[..., 1])
+    den = nx * d[..., 0] + ny * d[..., 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = -num / den
+    t_enter = np.where(den < 0, t, 0.0).max(axis=2).clip(0.0, None)
+    t_exit = np.where(den > 0, t, 1.0).min(axis=2).clip(None, 1.0)
+
+    # 頂点数を揃えるためにパディングした長さ 0 の辺（b 側）は切り取りの条件にしない
+    parallel = (den == 0) & ((e[..., 0] != 0) | (e[..., 1] != 0))
+    if strict:
+        outside = parallel & (num >= 0)
+    else:
+        opposite = d[..., 0] * e[..., 0] + d[..., 1] * e[..., 1] < 0
+        outside = parallel & ((num > 0) | ((num == 0) & opposite))
+    length = np.where(outside.any(axis=2), 0.0, np.maximum(t_exit - t_enter, 0.0))
+
+    cross = p0[:, :, 0, 0] * d[:, :, 0, 1] - p0[:, :, 0, 1] * d[:, :, 0, 0]
+    return (length * cross).sum(axis=1) / 2
+
+
+def apply_shading(power_data: Dict, result: ShadingResult, obstacle_count: int) -> Dict:
+    """
+    発電量データに影による損失を反映し、パネルごとの年間発電量をまとめる
+
+    power_data の月別・年間発電量を書き換える（影なしの値から月別の比で縮小）。
+
+    Returns:
+        {'obstacle_count', 'sample_count', 'shading_loss', 'unshaded_yearly_kwh', 'panel_yield_kwh': [...]}
+    """
+    panel_count = len(result.shaded_wh_m2)
+    unshaded_yearly = power_data['yearly_total_kwh']
+    per_panel = unshaded_yearly / panel_count if panel_count else 0.0
+
+    for entry, ratio in zip(power_data['monthly_data'], result.monthly_ratio()):
+        entry['generation_kwh'] = round(entry['generation_kwh'] * float(ratio), 2)
+    power_data['yearly_total_kwh'] = round(sum(entry['generation_kwh'] for entry in power_data['monthly_data']), 2)
+
+    loss = 1 - power_data['yearly_total_kwh'] / unshaded_yearly if unshaded_yearly else 0.0
+    power_data['assumptions']['shading_loss'] = f'{round(loss * 100, 1)}%'
+
+    return {
+        'obstacle_count': obstacle_count,
+        'sample_count': result.sample_count,
+        'shading_loss': round(loss, 4),
+        'unshaded_yearly_kwh': unshaded_yearly,
+        'panel_yield_kwh': np.round(per_panel * result.yield_ratio(), 1).tolist()
+    }
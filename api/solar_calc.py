@@ -4,22 +4,148 @@ Solar Calculation Module
 """
 
 import numpy as np
-import pandas as pd
 from datetime import datetime, timedelta
-from typing import Dict, List, Tuple
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+import json
 import math
+import os
+
+from financial import project_cash_flows, summarize, to_list
+from instrumentation import timed
+from irradiance_cache import irradiance_cache, IrradianceCache, PREFECTURE_CAPITALS
+
+# pandas・pvlib は読み込みに時間がかかるため、時間別計算で初めて必要になったときに import する
+# （簡易テーブル・グリッドだけを使うリクエストではコールドスタートの時間に含めない）
+if TYPE_CHECKING:
+    import pandas as pd
+
+# 日射量モデル: 'table'（月別の簡易テーブル）/ 'hourly'（pvlib による 8760 時間計算）
+IRRADIANCE_MODELS = ('table', 'hourly')
+
+# 時間別計算に用いる代表年（うるう年でない年）とタイムゾーン
+SIMULATION_YEAR = 2023
+SIMULATION_TZ = 'Asia/Tokyo'
+
+# 時間別モデルで計算できる時間間隔（分）
+SIMULATION_INTERVALS = (60, 15)
+
+# 事前計算した日射量グリッド（build_irradiance_grid.py で作成）
+DEFAULT_GRID_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'irradiance_grid.npy')
+
+
+class IrradianceGrid:
+    def __init__(self, path: str):
+        """
+        日本全域の日射量グリッド（メモリマップ）
+        
+        path の .npy は (緯度数, 経度数, 12 + 12×24) の float32 配列で、
+        先頭12要素が月別の日平均日射量（Wh/m²/day）、続く288要素が月ごとの
+        代表日の時刻別日射量（W/m²、0〜23時）。同名の .json に範囲と刻みを記録する。
+        np.load(mmap_mode='r') で開くため、複数ワーカーでもページキャッシュを共有する。
+        
+        Args:
+            path: グリッドファイル（.npy）のパス
+        """
+        with open(os.path.splitext(path)[0] + '.json') as f:
+            meta = json.load(f)
+        self.lat_min = meta['lat_min']
+        self.lng_min = meta['lng_min']
+        self.step = meta['step']
+        self.source = meta.get('source', 'unknown')
+        self.data = np.load(path, mmap_mode='r')
+        self.lat_max = self.lat_min + self.step * (self.data.shape[0] - 1)
+        self.lng_max = self.lng_min + self.step * (self.data.shape[1] - 1)
+    
+    def contains(self, latitude: float, longitude: float) -> bool:
+        """グリッドの範囲内かどうか"""
+        return (self.lat_min <= latitude <= self.lat_max and
+                self.lng_min <= longitude <= self.lng_max)
+    
+    def contains_many(self, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+        """複数地点がグリッドの範囲内かどうか（bool 配列）"""
+        return ((self.lat_min <= latitudes) & (latitudes <= self.lat_max) &
+                (self.lng_min <= longitudes) & (longitudes <= self.lng_max))
+    
+    def monthly_many(self, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+        """複数地点の月別日射量（地点数 × 12）を双線形補間で一括取得"""
+        fi = np.clip((latitudes - self.lat_min) / self.step, 0, self.data.shape[0] - 1)
+        fj = np.clip((longitudes - self.lng_min) / self.step, 0, self.data.shape[1] - 1)
+        i0 = np.minimum(fi.astype(int), self.data.shape[0] - 2)
+        j0 = np.minimum(fj.astype(int), self.data.shape[1] - 2)
+        di = (fi - i0)[:, None]
+        dj = (fj - j0)[:, None]
+        
+        monthly = self.data[..., :12]
+        return ((1 - di) * (1 - dj) * monthly[i0, j0] + (1 - di) * dj * monthly[i0, j0 + 1] +
+                di * (1 - dj) * monthly[i0 + 1, j0] + di * dj * monthly[i0 + 1, j0 + 1])
+    
+    def monthly(self, latitude: float, longitude: float) -> np.ndarray:
+        """月別の日平均日射量（Wh/m²/day、12要素）を双線形補間で取得"""
+        return self._interpolate(latitude, longitude)[:12]
+    
+    def hourly_typical(self, latitude: float, longitude: float) -> np.ndarray:
+        """月ごとの代表日の時刻別日射量（W/m²、12×24）を双線形補間で取得"""
+        return self._interpolate(latitude, longitude)[12:].reshape(12, 24)
+    
+    def _interpolate(self, latitude: float, longitude: float) -> np.ndarray:
+        """周囲4点の双線形補間（範囲外は端の値）"""
+        fi = min(max((latitude - self.lat_min) / self.step, 0.0), self.data.shape[0] - 1)
+        fj = min(max((longitude - self.lng_min) / self.step, 0.0), self.data.shape[1] - 1)
+        i0 = min(int(fi), self.data.shape[0] - 2)
+        j0 = min(int(fj), self.data.shape[1] - 2)
+        di = fi - i0
+        dj = fj - j0
+        
+        cell = np.asarray(self.data[i0:i0 + 2, j0:j0 + 2], dtype=np.float64)
+        return ((1 - di) * (1 - dj) * cell[0, 0] + (1 - di) * dj * cell[0, 1] +
+                di * (1 - dj) * cell[1, 0] + di * dj * cell[1, 1])
+
+
+def load_irradiance_grid(path: str = None) -> Optional[IrradianceGrid]:
+    """日射量グリッドを読み込む（ファイルが無ければ None、簡易テーブルで計算する）"""
+    path = path or os.environ.get('IRRADIANCE_GRID_PATH', DEFAULT_GRID_PATH)
+    if not os.path.exists(path):
+        return None
+    return IrradianceGrid(path)
+
+
+# 起動時に一度だけメモリマップする
+irradiance_grid = load_irradiance_grid()
+
+
+@lru_cache(maxsize=len(SIMULATION_INTERVALS))
+def _simulation_times(interval_minutes: int = 60) -> 'pd.DatetimeIndex':
+    """代表年の interval_minutes 分ごとの時刻（各区間の中央時刻。60分なら 8760 時間）"""
+    import pandas as pd
+    start = pd.Timestamp(f'{SIMULATION_YEAR}-01-01') + pd.Timedelta(minutes=interval_minutes / 2)
+    return pd.date_range(start, periods=8760 * 60 // interval_minutes, freq=f'{interval_minutes}min',
+                         tz=SIMULATION_TZ)
 
 class SolarCalculator:
-    def __init__(self):
-        """太陽光発電量計算クラス"""
+    def __init__(self, cache: IrradianceCache = None, grid: IrradianceGrid = None):
+        """
+        太陽光発電量計算クラス
+        
+        Args:
+            cache: 日射量プロファイルのキャッシュ（省略時はプロセス共有のキャッシュ）
+            grid: 日射量グリッド（省略時は起動時に読み込んだもの。無ければ簡易テーブル）
+        """
+        self.cache = cache if cache is not None else irradiance_cache
+        self.grid = grid if grid is not None else irradiance_grid
         # システム効率係数
         self.system_efficiency = 0.85  # システム全体の効率（85%）
         self.panel_efficiency = 0.20   # パネル効率（20%）
         self.temperature_coefficient = -0.004  # 温度係数（-0.4%/℃）
         self.standard_temperature = 25  # 標準テスト条件温度（℃）
+        self.default_tilt = 20  # 既定の設置角度（度、4寸勾配相当）
+        self.default_azimuth = 180  # 既定の設置方位（度、真南）
+        self.wind_speed = 1.0  # セル温度計算に用いる風速（m/s）
         
+    @timed('power')
     def calculate_power(self, latitude: float, longitude: float, 
-                       panel_count: int, panel_area_m2: float) -> Dict:
+                       panel_count: int, panel_area_m2: float,
+                       model: str = 'table', tilt: float = None, azimuth: float = None) -> Dict:
         """
         発電量を計算
         
@@ -28,17 +154,41 @@ class SolarCalculator:
             longitude: 経度  
             panel_count: パネル枚数
             panel_area_m2: 1枚あたりのパネル面積（m²）
+            model: 日射量モデル（'table' または 'hourly'）
+            tilt: 設置角度（度）。'hourly' モードのみ使用
+            azimuth: 設置方位（度、北=0 / 南=180）。'hourly' モードのみ使用
             
         Returns:
             発電量データ
         """
+        if model not in IRRADIANCE_MODELS:
+            raise ValueError(f"Unknown irradiance model: {model}")
+        
+        if model == 'hourly':
+            return self._calculate_power_hourly(
+                latitude, longitude, panel_count, panel_area_m2,
+                self.default_tilt if tilt is None else tilt,
+                self.default_azimuth if azimuth is None else azimuth
+            )
+        
+        return self.power_from_profile(latitude, longitude, panel_count, panel_area_m2,
+                                       self.get_monthly_profile(latitude, longitude))
+    
+    def power_from_profile(self, latitude: float, longitude: float, panel_count: int,
+                           panel_area_m2: float, monthly_profile: np.ndarray) -> Dict:
+        """
+        月別の平均日射量（12要素）から発電量データを作成
+        
+        Args:
+            monthly_profile: 月別の日平均日射量（Wh/m²/day）
+        """
         # 年間の月別データを計算
         monthly_data = []
         yearly_total = 0
         
         for month in range(1, 13):
             # 月別の平均日射量を取得（簡易計算）
-            daily_irradiance = self._get_monthly_irradiance(latitude, month)
+            daily_irradiance = float(monthly_profile[month - 1])
             
             # 月の日数
             days_in_month = self._get_days_in_month(month)
@@ -84,6 +234,235 @@ class SolarCalculator:
             }
         }
     
+    def _calculate_power_hourly(self, latitude: float, longitude: float, panel_count: int,
+                                panel_area_m2: float, tilt: float, azimuth: float) -> Dict:
+        """時間別の傾斜面日射量とセル温度から発電量を計算"""
+        profile = self.orientation_profile(latitude, longitude, tilt, azimuth)
+        return self.power_from_orientation(latitude, longitude, panel_count, panel_area_m2,
+                                           profile, tilt, azimuth)
+    
+    @timed('power.orientation')
+    def orientation_profile(self, latitude: float, longitude: float,
+                            tilt: float, azimuth: float) -> Dict[str, np.ndarray]:
+        """
+        設置の向きごとの月別の傾斜面日射量（時間別モデル、1〜12月の12要素）
+        
+        同じ向きの屋根面はこの結果を共有し、面積と枚数を掛けるだけで発電量を出せる。
+        
+        Returns:
+            {
+                'poa_wh_m2': 傾斜面日射量の月合計 (Wh/m²),
+                'effective_wh_m2': 温度補正後の傾斜面日射量の月合計 (Wh/m²)
+            }
+        """
+        hourly = self.get_hourly_profile(latitude, longitude, tilt, azimuth)
+        month = hourly.index.month
+        return {
+            'poa_wh_m2': hourly['poa_global'].groupby(month).sum().values,
+            'effective_wh_m2': (hourly['poa_global'] * hourly['temperature_factor']).groupby(month).sum().values
+        }
+    
+    def power_from_orientation(self, latitude: float, longitude: float, panel_count: int,
+                               panel_area_m2: float, profile: Dict[str, np.ndarray],
+                               tilt: float, azimuth: float) -> Dict:
+        """
+        orientation_profile の月別日射量から発電量データを作成
+        
+        Args:
+            profile: orientation_profile の戻り値
+            tilt, azimuth: profile を求めた設置角度・方位（結果の assumptions に記録）
+        """
+        # 月ごとの発電量（Wh）= 温度補正後の傾斜面日射量 × 面積 × 枚数 × 効率
+        monthly_generation = (
+            profile['effective_wh_m2'] *
+            panel_area_m2 *
+            panel_count *
+            self.panel_efficiency *
+            self.system_efficiency
+        )
+        
+        monthly_data = []
+        for month in range(1, 13):
+            monthly_data.append({
+                'month': month,
+                'generation_kwh': round(monthly_generation[month - 1] / 1000, 2),  # Wh to kWh
+                'daily_irradiance': round(profile['poa_wh_m2'][month - 1] / self._get_days_in_month(month), 2)
+            })
+        
+        yearly_total = monthly_generation.sum()
+        panel_rated_power = panel_area_m2 * 1000 * self.panel_efficiency
+        
+        # 温度による年間損失率（日射量で重み付け）
+        temperature_loss = 1 - profile['effective_wh_m2'].sum() / profile['poa_wh_m2'].sum()
+        
+        return {
+            'yearly_total_kwh': round(yearly_total / 1000, 2),
+            'monthly_data': monthly_data,
+            'panel_info': {
+                'count': panel_count,
+                'total_area_m2': round(panel_area_m2 * panel_count, 2),
+                'rated_power_per_panel_w': round(panel_rated_power, 0),
+                'total_rated_power_kw': round(panel_rated_power * panel_count / 1000, 2)
+            },
+            'assumptions': {
+                'system_efficiency': f'{self.system_efficiency * 100}%',
+                'panel_efficiency': f'{self.panel_efficiency * 100}%',
+                'irradiance_model': 'hourly',
+                'tilt': tilt,
+                'azimuth': azimuth,
+                'temperature_loss': f'{round(temperature_loss * 100, 1)}%',
+                'location': {
+                    'latitude': latitude,
+                    'longitude': longitude
+                }
+            }
+        }
+    
+    def get_monthly_profile(self, latitude: float, longitude: float) -> np.ndarray:
+        """
+        月別の平均日射量（Wh/m²/day、1〜12月の12要素）を取得（キャッシュ付き）
+        
+        緯度経度はキャッシュのグリッドに量子化してから計算する。戻り値は変更しないこと。
+        """
+        lat, lng = self.cache.quantize(latitude, longitude)
+        return self.cache.get_or_compute(
+            ('monthly', lat, lng),
+            lambda: self._compute_monthly_profile(lat, lng)
+        )
+    
+    def monthly_profiles(self, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+        """
+        複数地点の月別平均日射量を一括で求める（地点数 × 12、Wh/m²/day）
+        
+        get_monthly_profile と同じくキャッシュのグリッドに量子化した座標で計算するが、
+        キャッシュは経由せずグリッド補間・簡易テーブルを配列演算でまとめて評価する。
+        """
+        step = self.cache.grid_deg
+        lats = np.round(np.asarray(latitudes, dtype=float) / step) * step
+        lngs = np.round(np.asarray(longitudes, dtype=float) / step) * step
+        
+        profiles = np.stack([self._get_monthly_irradiance(lats, month) for month in range(1, 13)], axis=1)
+        if self.grid:
+            inside = self.grid.contains_many(lats, lngs)
+            if inside.any():
+                profiles[inside] = self.grid.monthly_many(lats[inside], lngs[inside])
+        return profiles
+    
+    def _compute_monthly_profile(self, latitude: float, longitude: float) -> np.ndarray:
+        """月別の平均日射量を日射量グリッド（範囲外・未作成なら簡易テーブル）から求める"""
+        if self.grid and self.grid.contains(latitude, longitude):
+            return self.grid.monthly(latitude, longitude)
+        return self.table_monthly_profile(latitude)
+    
+    def table_monthly_profile(self, latitude: float) -> np.ndarray:
+        """簡易テーブルによる月別の平均日射量（Wh/m²/day、12要素）"""
+        return np.array([self._get_monthly_irradiance(latitude, month) for month in range(1, 13)])
+    
+    def get_hourly_profile(self, latitude: float, longitude: float,
+                           tilt: float, azimuth: float, interval_minutes: int = 60) -> 'pd.DataFrame':
+        """
+        代表年 8760 時間の傾斜面日射量プロファイルを取得（キャッシュ付き）
+        
+        緯度経度・傾斜角・方位角はキャッシュの刻みに量子化してから計算する。戻り値は変更しないこと。
+        interval_minutes に 15 を指定すると 15 分ごと（35040 区間）のプロファイルになる。
+        """
+        if interval_minutes not in SIMULATION_INTERVALS:
+            raise ValueError(f"Unknown simulation interval: {interval_minutes}")
+        lat, lng = self.cache.quantize(latitude, longitude)
+        tilt, azimuth = self.cache.quantize_orientation(tilt, azimuth)
+        key = ('hourly', lat, lng, tilt, azimuth)
+        if interval_minutes != 60:
+            key += (interval_minutes,)
+        return self.cache.get_or_compute(
+            key, lambda: self._hourly_simulation(lat, lng, tilt, azimuth, interval_minutes)
+        )
+    
+    def warm_up(self, locations: Dict[str, Tuple[float, float]] = None) -> int:
+        """
+        主要地点の日射量プロファイルを事前計算してキャッシュに載せる
+        
+        Args:
+            locations: {名前: (緯度, 経度)}。省略時は都道府県庁所在地
+            
+        Returns:
+            事前計算した地点数
+        """
+        locations = PREFECTURE_CAPITALS if locations is None else locations
+        for latitude, longitude in locations.values():
+            self.get_monthly_profile(latitude, longitude)
+            self.get_hourly_profile(latitude, longitude, self.default_tilt, self.default_azimuth)
+        return len(locations)
+    
+    @timed('power.simulation')
+    def _hourly_simulation(self, latitude: float, longitude: float,
+                           tilt: float, azimuth: float, interval_minutes: int = 60) -> 'pd.DataFrame':
+        """
+        代表年 8760 時間（interval_minutes 分ごと）の傾斜面日射量とセル温度補正係数を計算
+        
+        1. 太陽位置と晴天日射（Ineichen）を計算
+        2. 月別の水平面日射量が月別プロファイル（グリッドまたは簡易テーブル）と一致するよう晴天日射を縮小
+        3. Erbs モデルで直達/散乱に分離し、Hay-Davies モデルで傾斜面日射量に変換
+        4. SAPM モデルのセル温度から temperature_coefficient で出力補正係数を求める
+        
+        Returns:
+            時刻をインデックスとし poa_global, poa_direct (W/m²), temp_cell (℃), temperature_factor,
+            solar_elevation, solar_azimuth (度、影の計算用) を持つ DataFrame
+        """
+        import pandas as pd
+        import pvlib
+        
+        times = _simulation_times(interval_minutes)
+        month = times.month.values
+        
+        solar_position = pvlib.solarposition.get_solarposition(times, latitude, longitude)
+        apparent_zenith = solar_position['apparent_zenith']
+        
+        airmass = pvlib.atmosphere.get_absolute_airmass(pvlib.atmosphere.get_relative_airmass(apparent_zenith))
+        linke_turbidity = pvlib.clearsky.lookup_linke_turbidity(times, latitude, longitude)
+        clearsky = pvlib.clearsky.ineichen(apparent_zenith, airmass, linke_turbidity)
+        
+        # 月別の水平面日射量（気候値）に合わせて晴天日射を縮小（晴天を超えない）
+        clearsky_monthly = clearsky['ghi'].groupby(month).sum().values * (interval_minutes / 60)  # Wh/m²
+        target_monthly = self._compute_monthly_profile(latitude, longitude) * np.array(
+            [self._get_days_in_month(m) for m in range(1, 13)]
+        )
+        clearness = np.minimum(1.0, target_monthly / np.maximum(clearsky_monthly, 1e-9))
+        ghi = clearsky['ghi'] * clearness[month - 1]
+        
+        components = pvlib.irradiance.erbs(ghi, solar_position['zenith'], times)
+        poa = pvlib.irradiance.get_total_irradiance(
+            tilt, azimuth,
+            apparent_zenith, solar_position['azimuth'],
+            components['dni'], ghi, components['dhi'],
+            dni_extra=pvlib.irradiance.get_extra_radiation(times),
+            model='haydavies'
+        )
+        poa_global = poa['poa_global'].fillna(0).clip(lower=0)
+        
+        temp_air = self._get_monthly_temperature(latitude)[month - 1]
+        temp_cell = pvlib.temperature.sapm_cell(
+            poa_global, temp_air, self.wind_speed,
+            **pvlib.temperature.TEMPERATURE_MODEL_PARAMETERS['sapm']['close_mount_glass_glass']
+        )
+        temperature_factor = 1 + self.temperature_coefficient * (temp_cell - self.standard_temperature)
+        
+        return pd.DataFrame({
+            'poa_global': poa_global,
+            'poa_direct': poa['poa_direct'].fillna(0).clip(lower=0),
+            'temp_cell': temp_cell,
+            'temperature_factor': temperature_factor,
+            'solar_elevation': solar_position['apparent_elevation'],
+            'solar_azimuth': solar_position['azimuth']
+        }, index=times)
+    
+    def _get_monthly_temperature(self, latitude: float) -> np.ndarray:
+        """
+        月別の平均気温（℃）を取得
+        東京の平年値を基準に、緯度1度あたり0.8℃の補正を行う簡易計算
+        """
+        tokyo_normals = np.array([5.4, 6.1, 9.4, 14.3, 18.8, 21.9, 25.7, 26.9, 23.3, 18.0, 12.5, 7.7])
+        return tokyo_normals - 0.8 * (latitude - 35.7)
+    
     def get_irradiance_data(self, latitude: float, longitude: float) -> Dict:
         """
         指定地点の年間日射量データを取得
@@ -96,9 +475,10 @@ class SolarCalculator:
             日射量データ
         """
         monthly_irradiance = []
+        monthly_profile = self.get_monthly_profile(latitude, longitude)
         
         for month in range(1, 13):
-            irradiance = self._get_monthly_irradiance(latitude, month)
+            irradiance = monthly_profile[month - 1]
             monthly_irradiance.append({
                 'month': month,
                 'month_name': self._get_month_name(month),
@@ -108,20 +488,29 @@ class SolarCalculator:
         # 年間平均
         yearly_average = sum([m['daily_average_kwh_m2'] for m in monthly_irradiance]) / 12
         
-        return {
+        result = {
             'location': {
                 'latitude': latitude,
                 'longitude': longitude
             },
             'monthly_data': monthly_irradiance,
             'yearly_average_daily_kwh_m2': round(yearly_average, 3),
-            'annual_total_kwh_m2': round(yearly_average * 365, 1)
+            'annual_total_kwh_m2': round(yearly_average * 365, 1),
+            'source': 'table'
         }
+        
+        # 日射量グリッドの範囲内なら月ごとの代表日の時刻別日射量も返す
+        if self.grid and self.grid.contains(latitude, longitude):
+            result['source'] = f'grid:{self.grid.source}'
+            result['typical_day_w_m2'] = self.grid.hourly_typical(latitude, longitude).round(1).tolist()
+        
+        return result
     
-    def _get_monthly_irradiance(self, latitude: float, month: int) -> float:
+    def _get_monthly_irradiance(self, latitude, month: int):
         """
         月別の平均日射量を取得（Wh/m²/day）
-        簡易的な計算式を使用（実際にはNEDO等のデータベースを使用すべき）
+        簡易的な計算式を使用（日射量グリッドが無い場合・範囲外の場合に使用）
+        latitude に配列を渡すと地点ごとの値を配列で返す
         """
         # 日本の緯度に基づく簡易計算
         # 基準値（東京付近、年間平均）
@@ -144,8 +533,8 @@ class SolarCalculator:
         }
         
         # 緯度による補正（北に行くほど減少）
-        latitude_factor = 1.0 - (abs(latitude - 35.0) * 0.02)
-        latitude_factor = max(0.7, min(1.3, latitude_factor))
+        latitude_factor = 1.0 - (np.abs(np.asarray(latitude) - 35.0) * 0.02)
+        latitude_factor = np.clip(latitude_factor, 0.7, 1.3)
         
         # 最終的な日射量
         monthly_irradiance = base_irradiance * seasonal_factors[month] * latitude_factor
@@ -163,47 +552,64 @@ class SolarCalculator:
                  'July', 'August', 'September', 'October', 'November', 'December']
         return months[month - 1]
     
+    @timed('roi')
     def calculate_roi(self, installation_cost: float, yearly_generation_kwh: float,
-                     electricity_price_per_kwh: float = 30) -> Dict:
+                     electricity_price_per_kwh: float = 30, years: int = 20,
+                     **financial_params) -> Dict:
         """
         投資回収期間を計算
-        
+
+        年ごとの劣化・単価上昇・売電と自家消費の配分・割引を financial.project_cash_flows で
+        配列演算としてまとめて計算する（期間は任意）。
+
         Args:
             installation_cost: 設置費用（円）
             yearly_generation_kwh: 年間発電量（kWh）
             electricity_price_per_kwh: 電力単価（円/kWh）
-            
+            years: 計算する年数（1以上）
+            **financial_params: degradation_rate, price_escalation, self_consumption_ratio,
+                feed_in_price, feed_in_years, post_feed_in_price, maintenance_cost, discount_rate
+
         Returns:
-            投資回収データ
-        """
-        yearly_savings = yearly_generation_kwh * electricity_price_per_kwh
-        payback_period = installation_cost / yearly_savings if yearly_savings > 0 else float('inf')
-        
-        # 20年間の累積データ
-        cumulative_data = []
-        for year in range(1, 21):
-            # 経年劣化を考慮（年0.5%低下）
-            degradation_factor = (1 - 0.005) ** (year - 1)
-            yearly_generation_adjusted = yearly_generation_kwh * degradation_factor
-            yearly_savings_adjusted = yearly_generation_adjusted * electricity_price_per_kwh
-            
-            cumulative_savings = sum([
-                yearly_generation_kwh * ((1 - 0.005) ** y) * electricity_price_per_kwh
-                for y in range(year)
-            ])
-            
-            cumulative_data.append({
-                'year': year,
-                'generation_kwh': round(yearly_generation_adjusted, 0),
-                'savings_yen': round(yearly_savings_adjusted, 0),
-                'cumulative_savings_yen': round(cumulative_savings, 0),
-                'net_benefit_yen': round(cumulative_savings - installation_cost, 0)
-            })
-        
+            投資回収データ。payback_period_years と twenty_year_* は従来どおり単純回収年数と
+            20年目の累積値。期間 years 全体の値は cumulative_payback_years（年内補間した累積回収年数）、
+            discounted_payback_years, total_savings_yen, net_benefit_yen, npv_yen, irr
+        """
+        # 従来の twenty_year_* は期間が20年未満でも20年目の値を返すため、少なくとも20年分を計算する
+        horizon = max(years, 20)
+        flows = project_cash_flows(
+            horizon,
+            installation_cost=installation_cost,
+            yearly_generation_kwh=yearly_generation_kwh,
+            electricity_price_per_kwh=electricity_price_per_kwh,
+            **financial_params
+        )
+        twenty_year = {name: round(float(flows[name][19]), 0)
+                       for name in ('cumulative_savings_yen', 'net_benefit_yen')}
+        flows = {name: values[:years] for name, values in flows.items()}
+        summary = summarize(flows, installation_cost)
+
+        yearly_savings = float(flows['savings_yen'][0])
+        simple_payback = installation_cost / yearly_savings if yearly_savings > 0 else float('inf')
+
+        columns = {name: np.round(flows[name], 0).tolist()
+                   for name in ('generation_kwh', 'savings_yen', 'cumulative_savings_yen', 'net_benefit_yen')}
+        yearly_data = [
+            {'year': year, **{name: values[year - 1] for name, values in columns.items()}}
+            for year in range(1, years + 1)
+        ]
+
         return {
-            'payback_period_years': round(payback_period, 1),
+            'years': years,
+            'payback_period_years': to_list(simple_payback, 1),
+            'cumulative_payback_years': to_list(summary['cumulative_payback_years'], 1),
+            'discounted_payback_years': to_list(summary['discounted_payback_years'], 1),
             'yearly_savings_yen': round(yearly_savings, 0),
-            'twenty_year_total_savings_yen': round(cumulative_data[-1]['cumulative_savings_yen'], 0),
-            'twenty_year_net_benefit_yen': round(cumulative_data[-1]['net_benefit_yen'], 0),
-            'yearly_data': cumulative_data[:10]  # 最初の10年分のみ返す
+            'twenty_year_total_savings_yen': twenty_year['cumulative_savings_yen'],
+            'twenty_year_net_benefit_yen': twenty_year['net_benefit_yen'],
+            'total_savings_yen': yearly_data[-1]['cumulative_savings_yen'],
+            'net_benefit_yen': yearly_data[-1]['net_benefit_yen'],
+            'npv_yen': to_list(summary['npv_yen'], 0),
+            'irr': to_list(summary['irr'], 4),
+            'yearly_data': yearly_data
         }
\ No newline at end of file
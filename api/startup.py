@@ -0,0 +1,107 @@
+"""
+Startup
+起動時の事前処理（ウォームアップ）と gunicorn --preload の fork 後処理
+"""
+
+import os
+import threading
+import time
+from typing import Dict
+
+from instrumentation import metrics
+
+# 配置・日射量の処理を1回通してから受け付ける
+STARTUP_WARMUP = os.environ.get('STARTUP_WARMUP', '').lower() in ('1', 'true', 'yes')
+
+# ウォームアップで PDF 生成用のライブラリ（reportlab・PIL）も読み込む
+STARTUP_WARMUP_PDF = os.environ.get('STARTUP_WARMUP_PDF', '').lower() in ('1', 'true', 'yes')
+
+# 都道府県庁所在地の日射量をバックグラウンドで事前計算
+IRRADIANCE_WARMUP = os.environ.get('IRRADIANCE_WARMUP', '').lower() in ('1', 'true', 'yes')
+
+# gunicorn --preload でマスターが読み込んだアプリか（gunicorn.conf.py が設定する）
+PRELOADED = os.environ.get('SOLAR_PRELOADED') == '1'
+
+# ウォームアップに使う屋根（東京、約 10m × 6m）と地点
+WARMUP_LOCATION = (35.6762, 139.6503)
+WARMUP_ROOF = [[35.67617, 139.65024], [35.67617, 139.65036], [35.67623, 139.65036], [35.67623, 139.65024]]
+
+_state = {'warmup_ms': {}, 'background_pid': None}
+_lock = threading.Lock()
+
+
+def warm_up() -> Dict[str, float]:
+    """
+    配置・発電量（簡易テーブルと時間別）の処理を1回ずつ実行し、遅延 import とキャッシュを済ませる
+
+    時間別計算で pandas・pvlib を読み込み、既定の向きの日射量プロファイルをキャッシュに載せる。
+    計測値は処理段階のメトリクスに含めないよう最後に消去する。
+
+    Returns:
+        {段階: 所要時間 (ms)}
+    """
+    from panel_layout import PanelLayout
+    from solar_calc import SolarCalculator
+
+    timings = {}
+
+    def run(name, func):
+        start = time.perf_counter()
+        func()
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+
+    layout = PanelLayout(165, 100, 10)
+    solar_calc = SolarCalculator()
+    latitude, longitude = WARMUP_LOCATION
+    run('layout', lambda: layout.calculate_layout(WARMUP_ROOF, mode='search'))
+    run('power_table', lambda: solar_calc.calculate_power(latitude, longitude, 10, 1.65))
+    run('power_hourly', lambda: solar_calc.calculate_power(latitude, longitude, 10, 1.65, model='hourly'))
+    if STARTUP_WARMUP_PDF:
+        run('pdf_import', _import_pdf_generator)
+
+    metrics.reset()
+    with _lock:
+        _state['warmup_ms'] = timings
+    return timings
+
+
+def _import_pdf_generator():
+    import pdf_generator  # noqa: F401
+
+
+def start_background_tasks():
+    """
+    バックグラウンドの事前計算スレッドを開始（プロセスごとに1回）
+
+    スレッドは fork で引き継がれないため、--preload 時は fork 後のワーカーで呼ぶ。
+    """
+    if not IRRADIANCE_WARMUP:
+        return
+    with _lock:
+        if _state['background_pid'] == os.getpid():
+            return
+        _state['background_pid'] = os.getpid()
+
+    from solar_calc import SolarCalculator
+    threading.Thread(target=lambda: SolarCalculator().warm_up(), daemon=True).start()
+
+
+def after_fork():
+    """
+    gunicorn --preload で fork したワーカーの初期化（gunicorn.conf.py の post_fork から呼ぶ）
+
+    マスターでのウォームアップの計測値を引き継がないようメトリクスを消去し、
+    バックグラウンドの事前計算を開始する。プロセスプールは worker_pool が fork 時に破棄する。
+    """
+    metrics.reset()
+    start_background_tasks()
+
+
+def stats() -> Dict:
+    """ヘルスチェック用の起動情報"""
+    with _lock:
+        return {
+            'preloaded': PRELOADED,
+            'warmup_ms': dict(_state['warmup_ms']),
+            'background_warmup': _state['background_pid'] == os.getpid()
+        }
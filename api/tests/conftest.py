@@ -0,0 +1,12 @@
+"""
+pytest の共通設定
+api ディレクトリのモジュール（panel_layout, projection など）をテストから import できるようにする
+
+Usage:
+    cd api && python -m pytest tests
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,113 @@
+"""
+投資回収シミュレーション（financial・/api/calculate-roi）の検証
+"""
+
+import numpy as np
+import pytest
+
+from financial import (MAX_GRID_CELLS, MAX_SCENARIOS, _irr, _payback_years, evaluate_grid,
+                       project_cash_flows, summarize)
+from solar_calc import SolarCalculator
+
+# 従来の calculate_roi が返していたキー
+LEGACY_ROI_KEYS = ('payback_period_years', 'yearly_savings_yen', 'twenty_year_total_savings_yen',
+                   'twenty_year_net_benefit_yen', 'yearly_data')
+
+
+@pytest.fixture(scope='module')
+def client():
+    from main import app
+    return app.test_client()
+
+
+def test_calculate_roi_keeps_legacy_keys():
+    result = SolarCalculator().calculate_roi(installation_cost=1500000, yearly_generation_kwh=5000, years=10)
+    for key in LEGACY_ROI_KEYS:
+        assert key in result
+    # 単純回収年数 = 設置費用 / 初年度の節約額、twenty_year_* は期間が短くても20年目の値
+    assert result['yearly_savings_yen'] == 150000
+    assert result['payback_period_years'] == 10.0
+    assert len(result['yearly_data']) == 10
+    assert result['twenty_year_total_savings_yen'] > result['yearly_data'][-1]['cumulative_savings_yen']
+
+
+def test_calculate_roi_endpoint_keeps_legacy_keys(client):
+    response = client.post('/api/calculate-roi', json={'installation_cost': 1500000,
+                                                       'yearly_generation_kwh': 5000})
+    assert response.status_code == 200
+    body = response.get_json()
+    for key in LEGACY_ROI_KEYS:
+        assert key in body
+    assert set(body['yearly_data'][0]) >= {'year', 'savings_yen', 'cumulative_savings_yen', 'net_benefit_yen'}
+
+
+def test_payback_and_npv_of_constant_cash_flow():
+    # 設置費用 1000 円、毎年 10 kWh × 30 円 = 300 円（劣化なし）を 5 年
+    flows = project_cash_flows(5, installation_cost=1000, yearly_generation_kwh=10,
+                               electricity_price_per_kwh=30, degradation_rate=0, discount_rate=0.1)
+    summary = summarize(flows, 1000)
+
+    np.testing.assert_allclose(flows['savings_yen'], [300] * 5)
+    np.testing.assert_allclose(flows['net_benefit_yen'], [-700, -400, -100, 200, 500])
+    # 累積: 3 年目末で -100、4 年目に 300 入るので 3 + 100 / 300 年
+    assert summary['cumulative_payback_years'] == pytest.approx(3 + 100 / 300)
+
+    discounted = [300 / 1.1 ** t for t in range(1, 6)]
+    assert summary['npv_yen'] == pytest.approx(sum(discounted) - 1000)
+    # 割引後の累積は 4 年目末で sum(discounted[:4]) - 1000 < 0、5 年目に回収
+    remaining = 1000 - sum(discounted[:4])
+    assert summary['discounted_payback_years'] == pytest.approx(4 + remaining / discounted[4])
+
+
+def test_payback_never_reached_is_inf():
+    net = np.array([[-900.0, -800.0, -700.0]])
+    flows = np.array([[100.0, 100.0, 100.0]])
+    assert np.isinf(_payback_years(net, flows, np.array([1000.0])))[0]
+
+
+def test_irr_of_known_cash_flows():
+    # 2 年間 100 円ずつ受け取るキャッシュフローの IRR が 10% / 0% になる設置費用
+    costs = np.array([100 / 1.1 + 100 / 1.1 ** 2, 200.0])
+    savings = np.full((2, 2), 100.0)
+    np.testing.assert_allclose(_irr(savings, costs), [0.1, 0.0], atol=1e-9)
+
+
+def test_irr_without_solution_is_nan():
+    # 収支が常に赤字なら探索範囲内に解が無い
+    assert np.isnan(_irr(np.array([[-10.0, -10.0]]), np.array([100.0])))[0]
+
+
+def test_summarize_irr_matches_constant_cash_flow():
+    flows = project_cash_flows(5, installation_cost=1000, yearly_generation_kwh=10,
+                               electricity_price_per_kwh=30, degradation_rate=0)
+    irr = float(summarize(flows, 1000)['irr'])
+    assert sum(300 / (1 + irr) ** t for t in range(1, 6)) == pytest.approx(1000)
+
+
+def test_evaluate_grid_rejects_too_many_scenarios():
+    count = MAX_SCENARIOS // 1000 + 1
+    grid = {'installation_cost': np.linspace(1e6, 2e6, 1000).tolist(),
+            'electricity_price_per_kwh': np.linspace(20, 40, count).tolist()}
+    with pytest.raises(ValueError, match='Too many scenarios'):
+        evaluate_grid({'yearly_generation_kwh': 5000}, grid)
+
+
+def test_evaluate_grid_rejects_too_many_cells():
+    # シナリオ数は上限内だが、シナリオ数 × 年数が MAX_GRID_CELLS を超える
+    side = int(np.ceil(np.sqrt(MAX_GRID_CELLS / 20 + 1)))
+    assert side * side <= MAX_SCENARIOS
+    grid = {'installation_cost': np.linspace(1e6, 2e6, side).tolist(),
+            'electricity_price_per_kwh': np.linspace(20, 40, side).tolist()}
+    with pytest.raises(ValueError, match='for 20 years'):
+        evaluate_grid({'yearly_generation_kwh': 5000}, grid, years=20)
+
+
+def test_sensitivity_over_cap_is_bad_request(client):
+    side = int(np.ceil(np.sqrt(MAX_SCENARIOS + 1)))
+    response = client.post('/api/calculate-roi', json={
+        'installation_cost': 1500000,
+        'yearly_generation_kwh': 5000,
+        'sensitivity': {'installation_cost': list(range(side)), 'electricity_price_per_kwh': list(range(side))}
+    })
+    assert response.status_code == 400
+    assert 'Too many scenarios' in response.get_json()['error']
@@ -0,0 +1,75 @@
+"""
+LayoutSession.apply_delta（変化した領域のセルだけの再判定）が全件計算と一致することの検証
+"""
+
+import numpy as np
+import pytest
+
+from incremental_layout import LayoutSession
+from panel_layout import PanelLayout
+from projection import LocalProjection
+
+REF_LAT = 35.6762
+REF_LNG = 139.6503
+
+# 屋根（メートル）。左下の頂点が原点、右上の頂点 (index 2) を動かす
+ROOF_M = [(0, 0), (14, 0), (14, 9), (6, 9), (6, 5), (0, 5)]
+
+
+def _latlng(meters):
+    return LocalProjection(REF_LAT, REF_LNG).to_latlng(np.array(meters, dtype=float)).tolist()
+
+
+def _moved(index, dx, dy):
+    meters = [list(point) for point in ROOF_M]
+    meters[index] = [meters[index][0] + dx, meters[index][1] + dy]
+    return _latlng(meters)
+
+
+def _assert_same_panels(actual, expected, atol=0.0):
+    a, b = actual.layout_arrays(), expected.layout_arrays()
+    assert actual.panel_count == expected.panel_count
+    np.testing.assert_array_equal(a['orientation'], b['orientation'])
+    np.testing.assert_allclose(a['centers'], b['centers'], rtol=0, atol=atol)
+    np.testing.assert_allclose(a['corners'], b['corners'], rtol=0, atol=atol)
+
+
+def _full(session):
+    """session と同じグリッドで編集後の屋根の全セルを判定し直したセッション"""
+    return LayoutSession.on_grid(session.layout, session.polygon_coords, session.projection,
+                                 session.candidate, session.frame)
+
+
+EDITS = {
+    'grow_vertex': dict(polygon_coords=_moved(2, 2.3, 1.7)),
+    'shrink_vertex': dict(polygon_coords=_moved(2, -3.1, -2.2)),
+    'grow_offset': dict(offset_cm=35),
+    'shrink_offset': dict(offset_cm=0),
+    'vertex_and_offset': dict(polygon_coords=_moved(3, -1.4, 0.8), offset_cm=25),
+}
+
+
+@pytest.mark.parametrize('mode', ['grid', 'search'])
+@pytest.mark.parametrize('edit', sorted(EDITS))
+def test_delta_matches_full_recompute_on_same_grid(edit, mode):
+    session = LayoutSession.create(PanelLayout(165, 100, 10), _latlng(ROOF_M), mode=mode)
+    updated = session.apply_delta(**EDITS[edit])
+
+    np.testing.assert_array_equal(updated.mask, _full(updated).mask)
+    _assert_same_panels(updated, _full(updated))
+
+
+def test_chained_deltas_match_full_recompute():
+    session = LayoutSession.create(PanelLayout(165, 100, 10), _latlng(ROOF_M))
+    for edit in ('grow_vertex', 'grow_offset', 'shrink_vertex', 'shrink_offset', 'vertex_and_offset'):
+        session = session.apply_delta(**EDITS[edit])
+        _assert_same_panels(session, _full(session))
+
+
+def test_vertex_move_matches_create_on_edited_polygon():
+    # 左下の頂点を動かさない編集ではグリッド原点が変わらないため、作り直したセッションと同じ配置になる
+    # （ローカル座標の原点は屋根の重心で変わるので、緯度経度は丸め誤差の範囲で比較する）
+    layout = PanelLayout(165, 100, 10)
+    edited = _moved(2, 2.3, 1.7)
+    updated = LayoutSession.create(layout, _latlng(ROOF_M)).apply_delta(polygon_coords=edited)
+    _assert_same_panels(updated, LayoutSession.create(layout, edited), atol=1e-10)
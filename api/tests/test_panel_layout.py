@@ -0,0 +1,79 @@
+"""
+PanelLayout の配置結果（枚数・屋根内に収まること・重なりが無いこと）の検証
+"""
+
+import math
+
+import numpy as np
+import pytest
+import shapely
+
+from panel_layout import PanelLayout, CELL_TOLERANCE_M
+from projection import LocalProjection
+
+REF_LAT = 35.6762
+REF_LNG = 139.6503
+
+# 幅の異なる部分を持つ屋根（メートル）: 下段は幅 10 m、上段は幅 4.3 m の階段形・台形・T 字形
+MIXED_WIDTH_ROOFS = {
+    'step': [(0, 0), (10, 0), (10, 2.1), (4.3, 2.1), (4.3, 8), (0, 8)],
+    'trapezoid': [(0, 0), (12, 0), (8, 6), (2, 6)],
+    'tee': [(0, 0), (3.4, 0), (3.4, 4), (8, 4), (8, 5.1), (-4.6, 5.1), (-4.6, 4), (0, 4)],
+}
+
+
+def _latlng_rectangle(width_m, height_m):
+    """緯度経度に沿った width_m × height_m の長方形の屋根（東京）"""
+    dlat = height_m / 110540
+    dlng = width_m / (111320 * math.cos(math.radians(REF_LAT)))
+    return [[REF_LAT, REF_LNG], [REF_LAT + dlat, REF_LNG],
+            [REF_LAT + dlat, REF_LNG + dlng], [REF_LAT, REF_LNG + dlng]]
+
+
+@pytest.mark.parametrize('offset_cm, expected', [(0, 133), (30, 110)])
+@pytest.mark.parametrize('mode', ['grid', 'search'])
+def test_latlng_rectangle_keeps_edge_cells(mode, offset_cm, expected):
+    # 辺に接するセルがローカル投影の丸め誤差で落ちないこと（投影導入前と同じ枚数）
+    layout = PanelLayout(165, 100, offset_cm)
+    panels = layout.calculate_layout(_latlng_rectangle(20, 12), mode=mode)
+    assert len(panels) == expected
+
+
+def _latlng_roof(meters):
+    return LocalProjection(REF_LAT, REF_LNG).to_latlng(np.array(meters, dtype=float)).tolist()
+
+
+@pytest.mark.parametrize('offset_cm', [0, 20])
+@pytest.mark.parametrize('name', sorted(MIXED_WIDTH_ROOFS))
+def test_strips_places_at_least_as_many_as_grid(name, offset_cm):
+    polygon = _latlng_roof(MIXED_WIDTH_ROOFS[name])
+    layout = PanelLayout(165, 100, offset_cm)
+    grid = layout.calculate_layout_arrays(polygon, mode='grid')
+    strips = layout.calculate_layout_arrays(polygon, mode='strips')
+    assert len(strips['orientation']) >= len(grid['orientation'])
+
+
+def test_strips_mixes_orientations_on_step_roof():
+    # 下段は横置き、上段は縦置きにすることでグリッドより多く置ける
+    layout = PanelLayout(165, 100, 0)
+    polygon = _latlng_roof(MIXED_WIDTH_ROOFS['step'])
+    strips = layout.calculate_layout_arrays(polygon, mode='strips')
+    grid = layout.calculate_layout_arrays(polygon, mode='grid')
+    assert len(np.unique(strips['orientation'])) == 2
+    assert len(strips['orientation']) > len(grid['orientation'])
+
+
+@pytest.mark.parametrize('offset_cm', [0, 20])
+@pytest.mark.parametrize('name', sorted(MIXED_WIDTH_ROOFS))
+def test_strips_panels_inside_roof_without_overlap(name, offset_cm):
+    polygon = _latlng_roof(MIXED_WIDTH_ROOFS[name])
+    layout = PanelLayout(165, 100, offset_cm)
+    corners = layout.calculate_layout_arrays(polygon, mode='strips')['corners']
+    projection = layout._make_projection(polygon)
+    roof = layout._prepare_roof(polygon, projection)
+    panels = shapely.polygons(projection.to_local(corners.reshape(-1, 2)).reshape(corners.shape))
+
+    # セル判定と同じ CELL_TOLERANCE_M 以内のはみ出しは許す
+    assert shapely.contains(roof.buffer(2 * CELL_TOLERANCE_M), panels).all()
+    left, right = shapely.STRtree(panels).query(panels, predicate='intersects')
+    assert np.array_equal(left, right)
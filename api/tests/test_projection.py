@@ -0,0 +1,65 @@
+"""
+LocalProjection の往復誤差（docstring に記載した上限）の検証
+"""
+
+import numpy as np
+import pytest
+
+from projection import LocalProjection
+
+# LocalProjection の docstring に記載した誤差の上限（原点から 10 km 以内）
+MAX_LATLNG_ROUND_TRIP_DEG = 1e-10
+MAX_METER_ROUND_TRIP_M = 1e-5
+
+# 原点（東京・札幌・那覇と、日本の範囲外の高緯度・南半球）
+ORIGINS = [
+    (35.6762, 139.6503),
+    (43.0642, 141.3469),
+    (26.2124, 127.6809),
+    (60.0, 10.0),
+    (-33.8688, 151.2093),
+]
+
+
+def _points_within_10km(origin, count=100000, seed=0):
+    """原点から東西・南北それぞれ約 10 km 以内の緯度経度"""
+    lat, lng = origin
+    rng = np.random.default_rng(seed)
+    dlat = 0.09
+    dlng = 0.09 / np.cos(np.radians(lat))
+    return np.column_stack([
+        lat + rng.uniform(-dlat, dlat, count),
+        lng + rng.uniform(-dlng, dlng, count),
+    ])
+
+
+@pytest.mark.parametrize('origin', ORIGINS)
+def test_latlng_round_trip_within_bound(origin):
+    projection = LocalProjection(*origin)
+    points = _points_within_10km(origin)
+    error = np.abs(projection.to_latlng(projection.to_local(points)) - points).max()
+    assert error < MAX_LATLNG_ROUND_TRIP_DEG
+
+
+@pytest.mark.parametrize('origin', ORIGINS)
+def test_meter_round_trip_within_bound(origin):
+    projection = LocalProjection(*origin)
+    rng = np.random.default_rng(1)
+    xy = rng.uniform(-10000, 10000, size=(100000, 2))
+    error = np.abs(projection.to_local(projection.to_latlng(xy)) - xy).max()
+    assert error < MAX_METER_ROUND_TRIP_M
+
+
+@pytest.mark.parametrize('origin', ORIGINS)
+def test_origin_maps_to_zero(origin):
+    projection = LocalProjection(*origin)
+    np.testing.assert_allclose(projection.to_local([origin]), [[0.0, 0.0]], atol=1e-9)
+    np.testing.assert_allclose(projection.to_latlng([[0.0, 0.0]]), [origin], atol=1e-12)
+
+
+def test_round_trip_keeps_array_shape():
+    projection = LocalProjection(*ORIGINS[0])
+    corners = np.random.default_rng(2).uniform(-100, 100, size=(50, 4, 2))
+    latlng = projection.to_latlng(corners)
+    assert latlng.shape == corners.shape
+    assert np.abs(projection.to_local(latlng) - corners).max() < MAX_METER_ROUND_TRIP_M
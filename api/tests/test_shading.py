@@ -0,0 +1,67 @@
+"""
+凸多角形の交差面積（_convex_overlap_area）を shapely の intersection と比較する検証
+"""
+
+import numpy as np
+import pytest
+import shapely
+from shapely.geometry import Polygon, box
+
+from shading import _rings, _convex_overlap_area
+
+
+def _random_convex(rng, count):
+    """頂点数の異なるランダムな凸多角形（_rings で頂点数を揃えるときにパディングが入る）"""
+    polygons = []
+    for vertices in rng.integers(3, 12, count):
+        points = rng.normal(size=(int(vertices), 2)) + rng.normal(size=2) * 0.5
+        polygons.append(shapely.convex_hull(shapely.multipoints(points)))
+    return np.array(polygons)
+
+
+def _overlap(a, b):
+    return _convex_overlap_area(_rings(np.array(a)), _rings(np.array(b)))
+
+
+def _expected(a, b):
+    return shapely.area(shapely.intersection(np.array(a), np.array(b)))
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_random_convex_pairs_match_shapely(seed):
+    rng = np.random.default_rng(seed)
+    a = _random_convex(rng, 2000)
+    b = _random_convex(rng, 2000)
+    np.testing.assert_allclose(_overlap(a, b), _expected(a, b), atol=1e-9)
+    np.testing.assert_allclose(_overlap(b, a), _expected(a, b), atol=1e-9)
+
+
+def test_padded_rings_match_shapely():
+    # 三角形と多角形を同じ配列に入れ、三角形側に長さ 0 の辺が並ぶようにする
+    a = [Polygon([(0, 0), (2, 0), (1, 2)]), shapely.Point(0, 0).buffer(1, quad_segs=8)]
+    b = [shapely.Point(1, 0.5).buffer(1, quad_segs=8), Polygon([(-2, -2), (0.5, -2), (0.5, 2)])]
+    np.testing.assert_allclose(_overlap(a, b), _expected(a, b), atol=1e-12)
+    np.testing.assert_allclose(_overlap(b, a), _expected(a, b), atol=1e-12)
+
+
+def test_shared_and_coincident_edges():
+    a = [box(0, 0, 1, 1), box(0, 0, 1, 1), box(0, 0, 1, 1), box(0, 0, 2, 2)]
+    b = [box(0, 0, 1, 1), box(1, 0, 2, 1), box(0, 0, 1, 0.5), box(0.5, 0.5, 1.5, 1.5)]
+    np.testing.assert_allclose(_overlap(a, b), [1.0, 0.0, 0.5, 1.0], atol=1e-12)
+    np.testing.assert_allclose(_overlap(b, a), [1.0, 0.0, 0.5, 1.0], atol=1e-12)
+
+
+def test_degenerate_polygons():
+    # 重複した頂点・面積 0 の多角形
+    a = [Polygon([(0, 0), (1, 0), (1, 0), (1, 1), (0, 1)]), Polygon([(0, 0), (1, 0), (2, 0)])]
+    b = [box(0.5, 0.5, 2, 2), box(-1, -1, 3, 1)]
+    np.testing.assert_allclose(_overlap(a, b), [0.25, 0.0], atol=1e-12)
+    np.testing.assert_allclose(_overlap(b, a), [0.25, 0.0], atol=1e-12)
+
+
+def test_non_overlapping_pairs():
+    rng = np.random.default_rng(3)
+    a = _random_convex(rng, 500)
+    b = shapely.transform(_random_convex(rng, 500), lambda coords: coords + [20.0, 0.0])
+    assert np.all(np.abs(_overlap(a, b)) < 1e-12)
+    assert np.all(np.abs(_overlap(b, a)) < 1e-12)
@@ -0,0 +1,345 @@
+"""
+Timeseries Export
+時間別モデルの発電量時系列（1時間・15分ごと）を CSV / Parquet / Arrow でストリーミング出力する
+"""
+
+import calendar
+import csv
+import io
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from financial import ROI_DEFAULTS
+from incremental_layout import layout_sessions
+from solar_calc import SolarCalculator, SIMULATION_INTERVALS
+
+# 出力形式 → Content-Type
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+# 1リクエストで出力できるシステム数・年数の上限
+MAX_EXPORT_SYSTEMS = 100
+MAX_EXPORT_YEARS = 30
+
+# 1リクエストで計算する日射量プロファイル（量子化した地点 × 設置角度 × 方位）の種類の上限
+MAX_EXPORT_PROFILES = 10
+
+# システムごとに上書きできる項目と既定値（tilt / azimuth の None は SolarCalculator の既定値）
+SYSTEM_DEFAULTS = {
+    'panel_count': None,
+    'panel_width': 165,
+    'panel_height': 100,
+    'location': {'lat': 35.6762, 'lng': 139.6503},
+    'tilt': None,
+    'azimuth': None,
+    'degradation_rate': ROI_DEFAULTS['degradation_rate'],
+}
+
+# 出力する列（system_id・timestamp の後に続く数値列と小数桁数）
+VALUE_COLUMNS = (
+    ('poa_w_m2', 1),       # 傾斜面日射量 (W/m²、区間平均)
+    ('temp_cell_c', 2),    # セル温度 (℃)
+    ('ac_kw', 4),          # 交流出力 (kW、区間平均)
+    ('energy_kwh', 5),     # 区間の発電量 (kWh)
+)
+
+# 出力の時刻（区間の開始時刻）のタイムゾーン。代表年のシミュレーションと同じ
+EXPORT_UTC_OFFSET = '+09:00'
+EXPORT_UTC_OFFSET_HOURS = 9
+
+DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def pyarrow_available() -> bool:
+    """Parquet / Arrow の出力に必要な pyarrow を読み込めるか（任意の依存パッケージ）"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def resolve_systems(data: Dict) -> List[Dict]:
+    """
+    リクエストボディからシステムごとの設定を組み立てる
+
+    トップレベルの値を共通設定とし、systems の各要素の同名項目で上書きする（systems を
+    省略するとトップレベルを1つのシステムとして扱う）。layout_token を指定したシステムは、
+    インクリメンタル配置のセッションのパネル枚数・寸法・地点・設置の向きを既定値にする。
+
+    Returns:
+        システムごとの設定のリスト
+
+    Raises:
+        ValueError: 入力が不正な場合、またはプロファイルの種類が MAX_EXPORT_PROFILES を超える場合
+    """
+    systems = data.get('systems')
+    if systems is None:
+        systems = [{}]
+    if not isinstance(systems, list) or not systems:
+        raise ValueError("systems must be a non-empty array")
+    if len(systems) > MAX_EXPORT_SYSTEMS:
+        raise ValueError(f"Too many systems. At most {MAX_EXPORT_SYSTEMS} per export.")
+
+    solar_calc = SolarCalculator()
+    resolved = []
+    for index, system in enumerate(systems):
+        if not isinstance(system, dict):
+            raise ValueError(f"systems[{index}] must be an object")
+        spec = dict(SYSTEM_DEFAULTS)
+        token = system.get('layout_token', data.get('layout_token'))
+        if token is not None:
+            session = layout_sessions.get(token)
+            if session is None:
+                raise ValueError(f"systems[{index}]: Unknown or expired layout token")
+            spec.update({
+                'panel_count': session.panel_count,
+                'panel_width': session.layout.panel_width,
+                'panel_height': session.layout.panel_height,
+                'location': session.options.get('location') or spec['location'],
+                'tilt': session.options.get('tilt'),
+                'azimuth': session.options.get('azimuth'),
+            })
+        for key in SYSTEM_DEFAULTS:
+            value = system.get(key, data.get(key))
+            if value is not None:
+                spec[key] = value
+        spec['id'] = system.get('id', index)
+        if not isinstance(spec['id'], (str, int, float)):
+            raise ValueError(f"systems[{index}]: id must be a string or a number")
+
+        try:
+            spec['panel_count'] = int(spec['panel_count'])
+            spec['panel_area_m2'] = float(spec['panel_width']) * float(spec['panel_height']) / 10000
+            spec['lat'] = float(spec['location'].get('lat', 35.6762))
+            spec['lng'] = float(spec['location'].get('lng', 139.6503))
+            spec['tilt'] = float(solar_calc.default_tilt if spec['tilt'] is None else spec['tilt'])
+            spec['azimuth'] = float(solar_calc.default_azimuth if spec['azimuth'] is None else spec['azimuth']) % 360
+            spec['degradation_rate'] = float(spec['degradation_rate'])
+        except (TypeError, ValueError, AttributeError):
+            raise ValueError(f"systems[{index}]: panel_count (or layout_token), panel size, location, "
+                             f"tilt, azimuth and degradation_rate must be numbers")
+        if spec['panel_count'] < 0:
+            raise ValueError(f"systems[{index}]: panel_count must not be negative")
+        if not 0 <= spec['tilt'] <= 90:
+            raise ValueError(f"systems[{index}]: tilt must be between 0 and 90")
+        if not 0 <= spec['degradation_rate'] < 1:
+            raise ValueError(f"systems[{index}]: degradation_rate must be between 0 and 1")
+        resolved.append(spec)
+
+    # 同じ地点・向きのシステムはプロファイルを共有するため、種類の数だけを制限する
+    profiles = {(solar_calc.cache.quantize(spec['lat'], spec['lng']),
+                 solar_calc.cache.quantize_orientation(spec['tilt'], spec['azimuth']))
+                for spec in resolved}
+    if len(profiles) > MAX_EXPORT_PROFILES:
+        raise ValueError(f"Too many distinct locations / orientations ({len(profiles)}). "
+                         f"At most {MAX_EXPORT_PROFILES} per export.")
+    return resolved
+
+
+def resolve_period(data: Dict) -> Dict:
+    """
+    出力期間（start_year・years）と時間間隔（interval_minutes）を検証
+
+    Raises:
+        ValueError: 入力が不正な場合
+    """
+    try:
+        start_year = int(data.get('start_year') or datetime.now().year)
+        years = int(data.get('years', 1))
+        interval_minutes = int(data.get('interval_minutes', 60))
+    except (TypeError, ValueError):
+        raise ValueError("start_year, years and interval_minutes must be integers")
+    if not 1 <= years <= MAX_EXPORT_YEARS:
+        raise ValueError(f"years must be between 1 and {MAX_EXPORT_YEARS}")
+    if not 1900 <= start_year <= 2200:
+        raise ValueError("start_year must be between 1900 and 2200")
+    if interval_minutes not in SIMULATION_INTERVALS:
+        raise ValueError(f"interval_minutes must be one of: {', '.join(map(str, SIMULATION_INTERVALS))}")
+    return {'start_year': start_year, 'years': years, 'interval_minutes': interval_minutes}
+
+
+def iter_month_columns(systems: List[Dict], start_year: int, years: int, interval_minutes: int = 60,
+                       solar_calc: SolarCalculator = None) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    システム → 年 → 月の順に、1か月分の時系列を列ごとの配列で返す
+
+    代表年のプロファイル（キャッシュ済み）から月の区間を切り出し、経年劣化
+    （(1 - degradation_rate) ** 経過年数）を掛ける。一度に持つのは1か月分の出力だけなので、
+    年数・システム数を増やしてもメモリは増えない。閏年の2月29日は2月28日と同じ値にする。
+
+    Yields:
+        {'system_id': (N,) object, 'timestamp': (N,) datetime64[m]（区間の開始時刻、日本時間）,
+         VALUE_COLUMNS の各列: (N,) float}
+    """
+    solar_calc = solar_calc or SolarCalculator()
+    steps_per_day = 24 * 60 // interval_minutes
+    month_starts = np.concatenate([[0], np.cumsum(DAYS_IN_MONTH)]) * steps_per_day
+    interval_hours = interval_minutes / 60
+
+    for spec in systems:
+        profile = solar_calc.get_hourly_profile(spec['lat'], spec['lng'], spec['tilt'], spec['azimuth'],
+                                                interval_minutes)
+        poa = profile['poa_global'].to_numpy()
+        temp_cell = profile['temp_cell'].to_numpy()
+        # 交流出力 (kW) = 温度補正後の傾斜面日射量 × 面積 × 枚数 × 効率
+        ac_kw = (poa * profile['temperature_factor'].to_numpy() * spec['panel_area_m2'] * spec['panel_count'] *
+                 solar_calc.panel_efficiency * solar_calc.system_efficiency / 1000)
+
+        for year_index in range(years):
+            year = start_year + year_index
+            degradation = (1 - spec['degradation_rate']) ** year_index
+            for month in range(1, 13):
+                rows = slice(month_starts[month - 1], month_starts[month])
+                month_poa, month_temp, month_ac = poa[rows], temp_cell[rows], ac_kw[rows]
+                if month == 2 and calendar.isleap(year):
+                    last_day = slice(-steps_per_day, None)
+                    month_poa = np.concatenate([month_poa, month_poa[last_day]])
+                    month_temp = np.concatenate([month_temp, month_temp[last_day]])
+                    month_ac = np.concatenate([month_ac, month_ac[last_day]])
+
+                start = np.datetime64(f'{year:04d}-{month:02d}-01T00:00', 'm')
+                month_ac = month_ac * degradation
+                yield {
+                    'system_id': np.full(len(month_poa), spec['id'], dtype=object),
+                    'timestamp': start + np.arange(len(month_poa)) * np.timedelta64(interval_minutes, 'm'),
+                    'poa_w_m2': month_poa,
+                    'temp_cell_c': month_temp,
+                    'ac_kw': month_ac,
+                    'energy_kwh': month_ac * interval_hours,
+                }
+
+
+def _csv_field(value) -> str:
+    """1つの値を CSV のフィールドに変換（区切り文字・引用符・改行を含む場合は引用符で囲む）"""
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='').writerow([value])
+    return buffer.getvalue()
+
+
+def iter_csv(month_columns: Iterator[Dict[str, np.ndarray]]) -> Iterator[str]:
+    """
+    月ごとの列を CSV のテキストに変換して返す（最初にヘッダ行）
+
+    system_id は csv モジュールでエスケープする（数値列と時刻は区切り文字を含まないので書式だけで整える）。
+    """
+    yield ','.join(['system_id', 'timestamp'] + [name for name, _ in VALUE_COLUMNS]) + '\n'
+    row_format = ','.join(['%s', '%s'] + [f'%.{digits}f' for _, digits in VALUE_COLUMNS])
+    for columns in month_columns:
+        ids = columns['system_id'].tolist()
+        fields = {value: _csv_field(value) for value in set(ids)}
+        timestamps = np.char.add(np.datetime_as_string(columns['timestamp'], unit='m'), EXPORT_UTC_OFFSET)
+        rows = zip([fields[value] for value in ids], timestamps.tolist(),
+                   *[columns[name].tolist() for name, _ in VALUE_COLUMNS])
+        yield '\n'.join(row_format % row for row in rows) + '\n'
+
+
+class _StreamSink(io.RawIOBase):
+    """pyarrow の書き出し先。書かれたバイト列をためておき、drain で取り出す"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _record_batch(columns: Dict[str, np.ndarray]):
+    """月ごとの列を Arrow の RecordBatch に変換（時刻は UTC を保持し、タイムゾーンを付ける）"""
+    import pyarrow as pa
+
+    utc = (columns['timestamp'] - np.timedelta64(EXPORT_UTC_OFFSET_HOURS, 'h')).astype('datetime64[s]')
+    arrays = [pa.array(columns['system_id'].astype(str)), pa.array(utc, type=pa.timestamp('s', tz='Asia/Tokyo'))]
+    arrays += [pa.array(columns[name].astype(np.float64)) for name, _ in VALUE_COLUMNS]
+    return pa.RecordBatch.from_arrays(arrays, names=['system_id', 'timestamp'] + [n for n, _ in VALUE_COLUMNS])
+
+
+def iter_arrow(month_columns: Iterator[Dict[str, np.ndarray]]) -> Iterator[bytes]:
+    """Arrow IPC ストリーム形式で返す（1か月ごとに1つの RecordBatch）"""
+    import pyarrow as pa
+
+    sink = _StreamSink()
+    writer = None
+    for columns in month_columns:
+        batch = _record_batch(columns)
+        if writer is None:
+            writer = pa.ipc.new_stream(sink, batch.schema)
+        writer.write_batch(batch)
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+
+def iter_parquet(month_columns: Iterator[Dict[str, np.ndarray]],
+                 row_group_months: int = 12) -> Iterator[bytes]:
+    """
+    Parquet 形式で返す（row_group_months か月分ごとに1つの行グループ）
+
+    Parquet はファイル末尾にメタデータを書くため、行グループを書き出すたびにそこまでの
+    バイト列を返し、最後にフッタを返す。
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _StreamSink()
+    writer: Optional[pq.ParquetWriter] = None
+    pending = []
+    for columns in month_columns:
+        pending.append(_record_batch(columns))
+        if len(pending) < row_group_months:
+            continue
+        if writer is None:
+            writer = pq.ParquetWriter(sink, pending[0].schema, compression='zstd')
+        writer.write_table(pa.Table.from_batches(pending))
+        pending = []
+        yield sink.drain()
+    if pending:
+        if writer is None:
+            writer = pq.ParquetWriter(sink, pending[0].schema, compression='zstd')
+        writer.write_table(pa.Table.from_batches(pending))
+    if writer is not None:
+        writer.close()
+    yield sink.drain()
+
+
+def iter_export(systems: List[Dict], start_year: int, years: int, interval_minutes: int,
+                export_format: str = 'csv') -> Iterator:
+    """
+    指定の形式で時系列を出力するジェネレータ（CSV は str、Parquet / Arrow は bytes を返す）
+
+    Raises:
+        ValueError: 形式が不正な場合、または Parquet / Arrow で pyarrow が無い場合
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid format. Use one of: {', '.join(EXPORT_FORMATS)}")
+    if export_format != 'csv' and not pyarrow_available():
+        raise ValueError(f"format '{export_format}' requires the pyarrow package")
+
+    month_columns = iter_month_columns(systems, start_year, years, interval_minutes)
+    if export_format == 'parquet':
+        return iter_parquet(month_columns)
+    if export_format == 'arrow':
+        return iter_arrow(month_columns)
+    return iter_csv(month_columns)
@@ -0,0 +1,67 @@
+"""
+Worker Pool
+CPU負荷の高い処理を分散するためのプロセスプール管理
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+# forkserver で事前に読み込むモジュール（ワーカーはこれを読み込み済みの状態で起動する）
+FORKSERVER_PRELOAD = ['numpy', 'shapely', 'panel_layout']
+
+_pools: Dict[str, ProcessPoolExecutor] = {}
+_lock = threading.Lock()
+
+
+def get_process_pool(name: str, max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """
+    名前付きのプロセスプールを取得（初回呼び出し時に作成）
+    
+    gunicorn のスレッドから fork すると他スレッドが保持するロックを引き継ぐ恐れがあるため、
+    利用可能なら forkserver でワーカーを起動する。
+    
+    Args:
+        name: プール名（用途ごとに分ける）
+        max_workers: ワーカー数。省略時は環境変数 WORKER_POOL_SIZE または CPU 数
+        
+    Returns:
+        ProcessPoolExecutor
+    """
+    with _lock:
+        pool = _pools.get(name)
+        if pool is None:
+            if max_workers is None:
+                max_workers = int(os.environ.get('WORKER_POOL_SIZE', os.cpu_count() or 1))
+            
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else None)
+            if context.get_start_method() == 'forkserver':
+                context.set_forkserver_preload(FORKSERVER_PRELOAD)
+            pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+            _pools[name] = pool
+        return pool
+
+
+def _forget_pools():
+    """
+    fork した子プロセスでは親のプールを使えない（管理スレッドが引き継がれない）ため破棄する
+
+    gunicorn --preload のマスターでプールが作られていても、各ワーカーは自前のプールを作り直す。
+    """
+    global _lock
+    _lock = threading.Lock()
+    _pools.clear()
+
+
+os.register_at_fork(after_in_child=_forget_pools)
+
+
+def shutdown_pools():
+    """全てのプロセスプールを停止"""
+    with _lock:
+        for pool in _pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        _pools.clear()
@@ -5,12 +5,16 @@
 // API設定 - Cloud RunのURLに置き換える
 const API_BASE_URL = 'https://your-cloud-run-url.run.app';  // TODO: デプロイ後に更新
 
+// PDF生成ジョブの完成を待つ最長時間（ミリ秒）
+const PDF_JOB_MAX_WAIT_MS = 120000;
+
 // グローバル変数
 let map;
 let drawingManager;
 let currentPolygon = null;
 let panelMarkers = [];
 let simulationData = null;
+let lastLayoutResponse = null;  // { etag, data } 直前の計算結果（304 時に再利用）
 
 /**
  * Google Maps初期化
@@ -155,17 +159,33 @@ async function calculatePanels() {
     };
     
     try {
-        const response = await fetch(`${API_BASE_URL}/api/calculate-panels`, {
+        const headers = {
+            'Content-Type': 'application/json',
+        };
+        // 前回と同じ入力なら 304 が返り、本文のダウンロードを省略できる
+        if (lastLayoutResponse) {
+            headers['If-None-Match'] = lastLayoutResponse.etag;
+        }
+        
+        const response = await fetch(`${API_BASE_URL}/api/calculate-panels?format=columnar`, {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
+            headers: headers,
             body: JSON.stringify(requestData)
         });
         
-        if (!response.ok) throw new Error('計算に失敗しました');
-        
-        const data = await response.json();
+        let data;
+        if (response.status === 304 && lastLayoutResponse) {
+            data = lastLayoutResponse.data;
+        } else {
+            if (!response.ok) throw new Error('計算に失敗しました');
+            
+            data = await response.json();
+            // PDF 生成には列指向形式のまま送る（パネル辞書のリストより大幅に小さい）
+            data.panelsColumnar = data.panels;
+            data.panels = decodeColumnarPanels(data.panels);
+            const etag = response.headers.get('ETag');
+            lastLayoutResponse = etag ? { etag: etag, data: data } : null;
+        }
         simulationData = data;
         
         // パネルを地図上に表示
@@ -187,6 +207,42 @@ async function calculatePanels() {
     }
 }
 
+/**
+ * 列指向形式（?format=columnar）のパネル配置をパネルオブジェクトの配列に復元
+ *
+ * corners は原点からの差分を scale 単位の整数で [lat, lng, ...] と並べたもの（1パネル8要素）
+ */
+function decodeColumnarPanels(columnar) {
+    const panels = [];
+    const [originLat, originLng] = columnar.origin;
+    const scale = columnar.scale;
+    
+    for (let i = 0; i < columnar.count; i++) {
+        const corners = [];
+        let sumLat = 0;
+        let sumLng = 0;
+        for (let k = 0; k < 4; k++) {
+            const lat = originLat + columnar.corners[i * 8 + k * 2] * scale;
+            const lng = originLng + columnar.corners[i * 8 + k * 2 + 1] * scale;
+            corners.push([lat, lng]);
+            sumLat += lat;
+            sumLng += lng;
+        }
+        
+        const code = columnar.orientation[i];
+        panels.push({
+            id: i,
+            center: [sumLat / 4, sumLng / 4],
+            corners: corners,
+            orientation: columnar.orientations[code],
+            width_cm: columnar.sizes_cm[code][0],
+            height_cm: columnar.sizes_cm[code][1]
+        });
+    }
+    
+    return panels;
+}
+
 /**
  * パネルを地図上に表示
  */
@@ -292,13 +348,13 @@ async function generatePDF() {
     showLoading(true);
     
     try {
-        // Google Maps画像をキャプチャ（簡易版）
-        // 実際にはGoogle Static Maps APIを使用する
-        const mapImage = ''; // TODO: Static Maps APIで取得
+        // 屋根とパネルはサーバー側でベクター描画されるため、地図画像は任意
+        // 航空写真を添付する場合は Static Maps API などで取得して設定する
+        const mapImage = '';
         
         const requestData = {
             polygon: getPolygonCoordinates(),
-            panels: simulationData.panels,
+            panels: simulationData.panelsColumnar || simulationData.panels,
             power_data: simulationData.power_estimation,
             map_image: mapImage,
             location: {
@@ -313,7 +369,8 @@ async function generatePDF() {
             }
         };
         
-        const response = await fetch(`${API_BASE_URL}/api/generate-pdf`, {
+        // PDF生成ジョブを登録し、完成するまでポーリングする
+        const jobResponse = await fetch(`${API_BASE_URL}/api/pdf-jobs`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -321,6 +378,31 @@ async function generatePDF() {
             body: JSON.stringify(requestData)
         });
         
+        if (jobResponse.status === 429) {
+            showStatus('PDF生成が混み合っています。しばらくしてから再度お試しください', 'error');
+            return;
+        }
+        if (!jobResponse.ok) throw new Error('PDF生成に失敗しました');
+        
+        const job = await jobResponse.json();
+        const giveUpAt = Date.now() + PDF_JOB_MAX_WAIT_MS;
+        let response;
+        while (true) {
+            response = await fetch(`${API_BASE_URL}${job.status_url}`);
+            if (response.status !== 202) break;
+            const retryAfter = parseFloat(response.headers.get('Retry-After')) || 1;
+            if (Date.now() + retryAfter * 1000 > giveUpAt) {
+                showStatus('PDF生成がタイムアウトしました。しばらくしてから再度お試しください', 'error');
+                return;
+            }
+            await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+        }
+        
+        // ジョブが見つからない・期限切れ（サーバーの再起動や保持期間の経過）
+        if (response.status === 404 || response.status === 410) {
+            showStatus('PDF生成ジョブが見つかりません。もう一度お試しください', 'error');
+            return;
+        }
         if (!response.ok) throw new Error('PDF生成に失敗しました');
         
         // PDFダウンロード